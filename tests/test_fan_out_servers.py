@@ -0,0 +1,74 @@
+# File: test_fan_out_servers.py
+#
+# Copyright (c) 2016-2025 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# Checks that the copies of the connector of the servers of an asset write the state and report
+# the progress through the thread of the action run
+import os
+import sys
+import threading
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+pytest.importorskip("phantom")
+
+import phantom.app as phantom
+from phantom.base_connector import BaseConnector
+
+import vsphere_connector
+from vsphere_consts import *
+
+
+SERVERS = ["vcenter1.corp.local", "vcenter2.corp.local", "vcenter3.corp.local"]
+
+
+def test_fan_out_servers_merges_state_and_progress(monkeypatch):
+    progress = []
+    monkeypatch.setattr(
+        BaseConnector, "save_progress", lambda self, message, *args, **kwargs: progress.append((threading.current_thread(), message))
+    )
+
+    def connect(connector, config):
+        server = config[phantom.APP_JSON_SERVER]
+        if server == SERVERS[2]:
+            connector._state[VSPHERE_CONST_STATE_SESSIONS].pop(server, None)
+            return phantom.APP_ERROR
+        connector.save_progress(f"Connected to {server}")
+        connector._state.setdefault(VSPHERE_CONST_STATE_SESSIONS, {})[server] = {VSPHERE_CONST_SESSION_SERVER: server}
+        return phantom.APP_SUCCESS
+
+    connector = vsphere_connector.VsphereConnector()
+    connector._servers = SERVERS
+    connector._reuse_session = True
+    connector._state = {VSPHERE_CONST_STATE_SESSIONS: {SERVERS[2]: {}, "vcenter4.corp.local": {}}}
+    monkeypatch.setattr(vsphere_connector.VsphereConnector, "_connect_to_server", connect)
+
+    results, failed = connector._fan_out_servers(
+        {phantom.APP_JSON_SERVER: SERVERS[0]}, lambda server_connector, server_config: server_config[phantom.APP_JSON_SERVER]
+    )
+
+    assert results == [(SERVERS[0], SERVERS[0]), (SERVERS[1], SERVERS[1])]
+    assert list(failed) == [SERVERS[2]]
+    assert connector._state[VSPHERE_CONST_STATE_SESSIONS] == {
+        SERVERS[0]: {VSPHERE_CONST_SESSION_SERVER: SERVERS[0]},
+        SERVERS[1]: {VSPHERE_CONST_SESSION_SERVER: SERVERS[1]},
+        # the server that failed to connect dropped its session
+        "vcenter4.corp.local": {},
+    }
+    assert sorted(message for _, message in progress) == [f"Connected to {SERVERS[0]}", f"Connected to {SERVERS[1]}"]
+    assert all(thread is threading.current_thread() for thread, _ in progress)
@@ -0,0 +1,139 @@
+# File: test_properties_decoder.py
+#
+# Copyright (c) 2016-2025 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# Checks that the PropertiesDecoder returns what the ZSI bindings of pysphere return for the vm listing
+# properties, on responses in the format of the vCenter property collector
+import os
+import sys
+from email.message import Message
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+pytest.importorskip("phantom")
+
+from pysphere.resources import VimService_services as VI
+from pysphere.ZSI import FaultException
+from pysphere.ZSI.client import Binding
+
+import vsphere_connector
+from vsphere_consts import VSPHERE_CONST_PROP_QUESTION, VSPHERE_CONST_VM_PROPERTIES
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+PAGES = [
+    ("retrieve_properties_ex_vms.xml", VI.RetrievePropertiesExResponseMsg),
+    ("continue_retrieve_properties_ex_vms.xml", VI.ContinueRetrievePropertiesExResponseMsg),
+]
+
+
+def _read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _binding(data):
+    """Returns a binding of the ZSI client that received data, as the one of a VIServer does"""
+
+    binding = Binding(url="https://vcenter.corp.local/sdk")
+    binding.data = data
+    binding.reply_headers = Message()
+    binding.reply_headers["Content-Type"] = "text/xml; charset=utf-8"
+    return binding
+
+
+def _receive(data, response_msg):
+    """Returns the page as _retrieve_properties_page builds it from the output of binding.Receive"""
+
+    retval = _binding(data).Receive(response_msg.typecode)._returnval
+    objects = [(obj.Obj, {prop.Name: prop.Val for prop in getattr(obj, "PropSet", None) or []}) for obj in retval.Objects]
+    return objects, getattr(retval, "Token", None)
+
+
+class _Server:
+    """A vsphere server object whose binding replies with data"""
+
+    def __init__(self, data):
+        binding = _binding(data)
+        binding.Send = lambda *args, **kwargs: None
+        self._proxy = type("Proxy", (), {"binding": binding})()
+
+
+def _assert_same_value(decoded, received):
+    # ZSI returns the enums as holders that subclass str, a bool is an int though
+    base_type = next(t for t in (bool, int, float, str) if isinstance(received, t))
+    assert isinstance(decoded, base_type)
+    assert isinstance(decoded, bool) == isinstance(received, bool)
+    assert decoded == received
+    if isinstance(received, vsphere_connector.VIMor):
+        assert decoded.get_attribute_type() == received.get_attribute_type()
+
+
+@pytest.mark.parametrize(("fixture", "response_msg"), PAGES)
+def test_decoder_matches_receive(fixture, response_msg):
+    data = _read_fixture(fixture)
+
+    decoded = vsphere_connector.PropertiesDecoder(data).decode()
+    received = _receive(data, response_msg)
+
+    assert decoded is not None
+    assert decoded[1] == received[1]
+    assert len(decoded[0]) == len(received[0])
+
+    for (decoded_mor, decoded_props), (received_mor, received_props) in zip(decoded[0], received[0]):
+        _assert_same_value(decoded_mor, received_mor)
+        assert sorted(decoded_props) == sorted(received_props)
+        assert set(decoded_props) <= set(VSPHERE_CONST_VM_PROPERTIES)
+        for name, value in received_props.items():
+            _assert_same_value(decoded_props[name], value)
+
+
+def test_fixtures_cover_vm_properties():
+    names = set()
+    for fixture, _ in PAGES:
+        for _, props in vsphere_connector.PropertiesDecoder(_read_fixture(fixture)).decode()[0]:
+            names.update(props)
+
+    # a pending question is not decoded, see test_question_falls_back_to_receive
+    assert names == set(VSPHERE_CONST_VM_PROPERTIES) - {VSPHERE_CONST_PROP_QUESTION}
+
+
+def test_question_falls_back_to_receive():
+    data = _read_fixture("retrieve_properties_ex_vm_question.xml")
+
+    assert vsphere_connector.PropertiesDecoder(data).decode() is None
+
+    connector = vsphere_connector.VsphereConnector()
+    objects, token = connector._retrieve_properties_page(None, VI.RetrievePropertiesExResponseMsg, _Server(data))
+    received, received_token = _receive(data, VI.RetrievePropertiesExResponseMsg)
+
+    assert token == received_token is None
+    assert [str(mor) for mor, _ in objects] == [str(mor) for mor, _ in received] == ["vm-1041"]
+    assert objects[0][1][VSPHERE_CONST_PROP_QUESTION].Id == "_vmx1"
+    assert sorted(objects[0][1]) == sorted(received[0][1])
+
+
+def test_fault_falls_back_to_receive():
+    data = _read_fixture("retrieve_properties_ex_fault.xml")
+
+    assert vsphere_connector.PropertiesDecoder(data).decode() is None
+
+    connector = vsphere_connector.VsphereConnector()
+    with pytest.raises(FaultException):
+        connector._retrieve_properties_page(None, VI.RetrievePropertiesExResponseMsg, _Server(data))
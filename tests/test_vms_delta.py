@@ -0,0 +1,133 @@
+# File: test_vms_delta.py
+#
+# Copyright (c) 2016-2025 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# Checks that a full resync of the delta mode of list vms reports the vms added, changed and removed
+# since the last run, from the vms known before it
+import os
+import sys
+from types import SimpleNamespace
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+pytest.importorskip("phantom")
+
+import phantom.app as phantom
+from phantom.action_result import ActionResult
+
+import vsphere_connector
+from vsphere_consts import *
+
+
+SERVER = "vcenter.corp.local"
+DATACENTER = "dc1"
+FILTER = "session[52b3c0a1]52d1e2f3"
+
+
+def _vm_props(name, power_state=VSPHERE_CONST_POWERED_ON):
+    return {
+        VSPHERE_CONST_PROP_VMX_PATH: f"[datastore1] {name}/{name}.vmx",
+        VSPHERE_CONST_PROP_NAME: name,
+        VSPHERE_CONST_PROP_POWER_STATE: power_state,
+    }
+
+
+def _enter(vm_mor, props):
+    changes = [SimpleNamespace(Name=name, Val=value) for name, value in props.items()]
+    return SimpleNamespace(Kind="enter", Obj=vm_mor, ChangeSet=changes)
+
+
+def _connector(previous_vms, inventory):
+    """Returns a connector whose delta state knows previous_vms and whose resync lists inventory"""
+
+    connector = vsphere_connector.VsphereConnector()
+    connector._datacenters = [DATACENTER]
+    connector._state = {
+        VSPHERE_CONST_STATE_VMS_DELTA: {
+            VSPHERE_CONST_DELTA_SERVER: SERVER,
+            VSPHERE_CONST_DELTA_COLLECTOR: "session[52b3c0a1]1a2b3c4d",
+            VSPHERE_CONST_DELTA_FILTERS: {FILTER: DATACENTER},
+            VSPHERE_CONST_DELTA_VIEWS: [],
+            # no version, the collector of the last run is gone and a full resync is due
+            VSPHERE_CONST_DELTA_VERSION: "",
+            VSPHERE_CONST_DELTA_VMS: previous_vms,
+        }
+    }
+
+    connector._start_vms_delta = lambda config: {
+        VSPHERE_CONST_DELTA_SERVER: SERVER,
+        VSPHERE_CONST_DELTA_COLLECTOR: "session[52b3c0a1]5e6f7a8b",
+        VSPHERE_CONST_DELTA_FILTERS: {FILTER: DATACENTER},
+        VSPHERE_CONST_DELTA_VIEWS: [],
+        VSPHERE_CONST_DELTA_VERSION: "",
+        VSPHERE_CONST_DELTA_VMS: {},
+    }
+
+    object_set = [_enter(vm_mor, props) for vm_mor, props in inventory.items()]
+    update_set = SimpleNamespace(FilterSet=[SimpleNamespace(Filter=FILTER, ObjectSet=object_set)])
+    connector._collect_updates = lambda collector, version: ([update_set], "1")
+
+    return connector
+
+
+def _known_vm(connector, props):
+    curr_data = connector._create_vm_data(DATACENTER, props)
+    return [curr_data[VSPHERE_JSON_VMX_PATH], connector._get_vm_data_digest(curr_data)]
+
+
+def _run(connector, param):
+    action_result = ActionResult(dict(param))
+    status = connector._get_vms_delta(connector.ACTION_ID_GET_REGISTERED_GUESTS, {phantom.APP_JSON_SERVER: SERVER}, param, action_result)
+    assert status == phantom.APP_SUCCESS
+    return {data[VSPHERE_JSON_VMX_PATH]: data[VSPHERE_JSON_CHANGE_TYPE] for data in action_result.get_data()}
+
+
+def test_resync_reports_removed_vms():
+    web = _vm_props("web-01")
+    connector = _connector({}, {})
+    previous_vms = {
+        "vm-1": _known_vm(connector, web),
+        "vm-2": _known_vm(connector, _vm_props("db-01")),
+        # the state of older versions only holds the vmx path
+        "vm-3": f"[{DATACENTER}][datastore1] old/old.vmx",
+    }
+    connector = _connector(previous_vms, {"vm-1": web, "vm-4": _vm_props("new-01")})
+
+    changes = _run(connector, {VSPHERE_JSON_DELTA: True})
+
+    assert changes == {
+        f"[{DATACENTER}][datastore1] new-01/new-01.vmx": VSPHERE_CONST_CHANGE_ADDED,
+        f"[{DATACENTER}][datastore1] db-01/db-01.vmx": VSPHERE_CONST_CHANGE_REMOVED,
+        f"[{DATACENTER}][datastore1] old/old.vmx": VSPHERE_CONST_CHANGE_REMOVED,
+    }
+    assert sorted(connector._state[VSPHERE_CONST_STATE_VMS_DELTA][VSPHERE_CONST_DELTA_VMS]) == ["vm-1", "vm-4"]
+
+
+def test_explicit_resync_reports_all_vms():
+    web = _vm_props("web-01")
+    connector = _connector({}, {})
+    previous_vms = {"vm-1": _known_vm(connector, web), "vm-2": _known_vm(connector, _vm_props("db-01"))}
+    stopped = _vm_props("db-01", power_state="poweredOff")
+    connector = _connector(previous_vms, {"vm-1": web, "vm-2": stopped})
+
+    changes = _run(connector, {VSPHERE_JSON_DELTA: True, VSPHERE_JSON_FULL_RESYNC: True})
+
+    assert changes == {
+        f"[{DATACENTER}][datastore1] web-01/web-01.vmx": VSPHERE_CONST_CHANGE_UNCHANGED,
+        f"[{DATACENTER}][datastore1] db-01/db-01.vmx": VSPHERE_CONST_CHANGE_MODIFIED,
+    }
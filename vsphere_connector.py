@@ -15,27 +15,525 @@
 #
 #
 # Phantom imports
+import calendar
+import copy
+import fcntl
+import gzip
+import hashlib
+import http.client
+import io
+import json
+import mmap
 import os
+import queue
 import re
+import shutil
 import ssl
+import struct
+import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, CancelledError, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import cached_property, partial
 from tempfile import mkdtemp
-from time import mktime
+from urllib.parse import urlparse
+from xml.etree import ElementTree
 
+import encryption_helper
 import phantom.app as phantom
 import phantom.rules as ph_rules
 import requests
 from phantom.action_result import ActionResult
 from phantom.base_connector import BaseConnector
 from phantom.vault import Vault
-from pysphere import VIServer
-from requests.auth import HTTPBasicAuth
+from pysphere import FaultTypes, MORTypes, VIException, VIMor, VIServer, VITask, VMPowerState
+from pysphere.resources import VimService_services as VI
+from pysphere.vi_virtual_machine import VIVirtualMachine
+from pysphere.ZSI import TC
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
 
 # THIS Connector imports
 from vsphere_consts import *
 
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+VMSD_LINE_REGEX = re.compile(VSPHERE_CONST_VMSD_LINE_PATTERN)
+VMX_PATH_SEPARATOR_REGEX = re.compile(VSPHERE_CONST_VMX_PATH_SEPARATOR_PATTERN)
+
+
+class StreamCompressor:
+    """Compresses the data it is fed, in order, to a file. gzip compresses fixed size blocks in parallel,
+    each one a member of a multi-member gzip file, zstd uses the multi-threaded compressor of zstandard.
+    """
+
+    def __init__(self, path, codec, workers):
+        self.path = path
+        self.codec = codec
+        self.workers = workers
+        self.original_size = 0
+        self._file = open(path, "wb")
+        self._start()
+
+    def _start(self):
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = None
+        self._compressor = None
+
+        if self.codec == VSPHERE_CONST_COMPRESSION_ZSTD:
+            self._compressor = zstandard.ZstdCompressor(level=VSPHERE_CONST_ZSTD_LEVEL, threads=self.workers).compressobj()
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _write_blocks(self, max_pending):
+        # keeps the number of blocks in flight, and so the memory used, bounded
+        while len(self._pending) > max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def update(self, data):
+        self.original_size += len(data)
+
+        if self._compressor:
+            self._file.write(self._compressor.compress(data))
+            return
+
+        self._buffer += data
+        while len(self._buffer) >= VSPHERE_CONST_GZIP_BLOCK_SIZE:
+            block = bytes(self._buffer[:VSPHERE_CONST_GZIP_BLOCK_SIZE])
+            del self._buffer[:VSPHERE_CONST_GZIP_BLOCK_SIZE]
+            self._pending.append(self._executor.submit(gzip.compress, block, VSPHERE_CONST_GZIP_LEVEL, mtime=0))
+            self._write_blocks(2 * self.workers)
+
+    def reset(self):
+        """Drops all the data compressed so far"""
+
+        self._stop()
+        self._file.seek(0)
+        self._file.truncate()
+        self.original_size = 0
+        self._start()
+
+    def _stop(self):
+        if self._executor:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+
+    def close(self):
+        """Writes the rest of the data and closes the file
+
+        Return:
+            The size of the compressed file
+        """
+
+        if self._compressor:
+            self._file.write(self._compressor.flush())
+        else:
+            if self._buffer:
+                self._pending.append(self._executor.submit(gzip.compress, bytes(self._buffer), VSPHERE_CONST_GZIP_LEVEL, mtime=0))
+                self._buffer = bytearray()
+            self._write_blocks(0)
+            self._executor.shutdown()
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        """Drops the compressed file"""
+
+        self._stop()
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MappedFile:
+    """A file memory-mapped for reading, e.g. the .vmem file that holds the memory of a vm"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    def view(self, offset, size):
+        """Returns a memoryview of the data at an offset, without copying it, it must be released before the file is closed"""
+
+        return memoryview(self._map)[offset : offset + size]
+
+    def close(self):
+        self._map.close()
+
+
+class CheckpointFile(MappedFile):
+    """Walks the groups and tags of a VMware checkpoint (.vmss/.vmsn) file, memory-mapped, so that the data of
+    the tags, e.g. the memory of the vm, is never read unless asked for.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+
+        try:
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_header(self):
+        header_size = struct.calcsize(VSPHERE_CONST_CHECKPOINT_HEADER_FORMAT)
+        group_size = struct.calcsize(VSPHERE_CONST_CHECKPOINT_GROUP_FORMAT)
+
+        if len(self._map) < header_size:
+            raise ValueError(VSPHERE_ERR_NOT_CHECKPOINT_FILE)
+
+        magic, _, group_count = struct.unpack_from(VSPHERE_CONST_CHECKPOINT_HEADER_FORMAT, self._map, 0)
+        if magic not in VSPHERE_CONST_CHECKPOINT_MAGICS:
+            raise ValueError(VSPHERE_ERR_NOT_CHECKPOINT_FILE)
+
+        # the sizes of the big tags are 32 bits in the first version of the format
+        self._size_format = "<I" if (magic & 0xF) == 0 else "<Q"
+
+        if len(self._map) < header_size + (group_count * group_size):
+            raise ValueError(VSPHERE_ERR_CHECKPOINT_TRUNCATED)
+
+        self.groups = {}
+        for index in range(group_count):
+            name, offset, _ = struct.unpack_from(VSPHERE_CONST_CHECKPOINT_GROUP_FORMAT, self._map, header_size + (index * group_size))
+            self.groups[name.split(b"\0", 1)[0].decode(errors="replace")] = offset
+
+    def tags(self, group):
+        """Yields the name, the indices, the offset and the size of the data of each tag of a group"""
+
+        size_length = struct.calcsize(self._size_format)
+        offset = self.groups[group]
+
+        try:
+            while True:
+                flags, name_length = struct.unpack_from("<BB", self._map, offset)
+                if not flags and not name_length:
+                    return
+
+                offset += 2
+                name = self._map[offset : offset + name_length].decode(errors="replace")
+                offset += name_length
+
+                index_count = (flags >> 6) & 3
+                indices = struct.unpack_from(f"<{index_count}I", self._map, offset)
+                offset += 4 * index_count
+
+                # the size of the data of a small tag is in its flags, a big tag is followed by the size of
+                # its data on disk and in memory, then by the length of the padding before its data
+                data_size = flags & 0x3F
+                if data_size in VSPHERE_CONST_CHECKPOINT_BIG_TAG_SIZES:
+                    (data_size,) = struct.unpack_from(self._size_format, self._map, offset)
+                    offset += 2 * size_length
+                    (padding,) = struct.unpack_from("<H", self._map, offset)
+                    offset += 2 + padding
+
+                if offset + data_size > len(self._map):
+                    raise ValueError(VSPHERE_ERR_CHECKPOINT_TRUNCATED)
+
+                yield name, indices, offset, data_size
+                offset += data_size
+        except struct.error:
+            raise ValueError(VSPHERE_ERR_CHECKPOINT_TRUNCATED)
+
+    def read_int(self, offset, size):
+        """Returns the data of a small tag as an integer"""
+
+        return int.from_bytes(self._map[offset : offset + size], "little")
+
+
+class SessionCookieAuth(AuthBase):
+    """Authenticates the requests with the cookies of the vSphere session, as the urls of the export leases expect"""
+
+    def __init__(self, cookies):
+        self._cookie = "; ".join(f"{k}={v}" for k, v in cookies.items())
+
+    def __call__(self, r):
+        r.headers["Cookie"] = self._cookie
+        return r
+
+
+class SessionTransport(http.client.HTTPConnection):
+    """Sends the SOAP calls of pysphere through the requests session of the connector, which keeps its connections
+    alive, instead of the new connection (and TLS handshake) ZSI opens for each call. ZSI creates an instance
+    per call, with the transdict of the binding as the keyword arguments.
+    """
+
+    def __init__(self, host, port=None, session=None, scheme="https", timeout=None):
+        super().__init__(host, port)
+        self._netloc = host
+        self._session = session
+        self._scheme = scheme
+        self._timeout = timeout
+        self._request = None
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def putrequest(self, method, url, *args, **kwargs):
+        self._request = {"method": method, "url": f"{self._scheme}://{self._netloc}{url}", "headers": {}, "data": b""}
+
+    def putheader(self, header, *values):
+        # ZSI puts a Cookie header per cookie, they have to be sent as one
+        value = ", ".join(str(x) for x in values)
+        headers = self._request["headers"]
+        if header in headers:
+            value = headers[header] + ("; " if header.lower() == "cookie" else ", ") + value
+        headers[header] = value
+
+    def endheaders(self, message_body=None, **kwargs):
+        if message_body:
+            self._request["data"] += message_body
+
+    def send(self, data):
+        self._request["data"] += data
+
+    def getresponse(self):
+        r = self._session.request(timeout=self._timeout, allow_redirects=False, **self._request)
+        return SessionResponse(r)
+
+
+class SessionResponse:
+    """The parts of http.client.HTTPResponse ZSI reads, from a requests response"""
+
+    def __init__(self, r):
+        self.status = r.status_code
+        self.reason = r.reason
+        # the raw headers keep the Set-Cookie headers apart, requests joins them
+        self.msg = http.client.HTTPMessage()
+        for name, value in r.raw.headers.items():
+            self.msg[name] = value
+        self._content = r.content
+
+    def read(self, *args):
+        return self._content
+
+
+class ServiceTicketAuth(AuthBase):
+    """Authenticates each request to an ESXi host with a service ticket of the vCenter session, acquired for its url"""
+
+    def __init__(self, acquire):
+        self._acquire = acquire
+        self._lock = threading.Lock()
+
+    def __call__(self, r):
+        # the tickets are acquired through the SOAP binding of the session, which is not thread safe
+        with self._lock:
+            ticket = self._acquire(r.url)
+        r.headers["Cookie"] = f"{VSPHERE_CONST_SERVICE_TICKET_COOKIE}={ticket}"
+        return r
+
+
+class ServerPool:
+    """Pool of vsphere server objects leased to the worker threads of an action run, as a pysphere server (its ZSI
+    binding) can only be used by one thread at a time. The servers are created on demand, up to the size of the pool,
+    and a server that sat idle is checked before it is leased again. Closing the pool drops the servers, they don't
+    own a login, the session is logged out with the server of the connector.
+    """
+
+    def __init__(self, create, check, size):
+        self._create = create
+        self._check = check
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._closed = False
+
+    def acquire(self, timeout=None, call_timeout=None):
+        """Leases a server, waiting for one to be released when all of them are in use
+
+        Args:
+            timeout: The time (in seconds) to wait for a server, None to wait indefinitely
+            call_timeout: The timeout (in seconds) of each SOAP call during the lease, None to wait indefinitely
+
+        Return:
+            The vsphere server object
+        """
+
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(VSPHERE_ERR_SERVER_POOL_TIMEOUT)
+
+        try:
+            vs_server = None
+            while vs_server is None:
+                try:
+                    idle_server, released_at = self._idle.get_nowait()
+                except queue.Empty:
+                    vs_server = self._create()
+                    break
+
+                if ((time.monotonic() - released_at) < VSPHERE_CONST_SERVER_POOL_CHECK_INTERVAL) or self._is_healthy(idle_server):
+                    vs_server = idle_server
+        except Exception:
+            self._slots.release()
+            raise
+
+        vs_server._proxy.binding.transdict["timeout"] = call_timeout
+        return vs_server
+
+    def release(self, vs_server, healthy=True):
+        """Returns a leased server to the pool, an unhealthy one is dropped and replaced on demand"""
+
+        vs_server._proxy.binding.transdict["timeout"] = None
+        if healthy and not self._closed:
+            self._idle.put((vs_server, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def lease(self, timeout=None, call_timeout=None):
+        """Leases a server for the with block, see acquire"""
+
+        vs_server = self.acquire(timeout, call_timeout)
+        healthy = True
+        try:
+            yield vs_server
+        except requests.exceptions.RequestException:
+            # the binding could be left with a partial call
+            healthy = False
+            raise
+        finally:
+            self.release(vs_server, healthy)
+
+    def close(self):
+        self._closed = True
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+    def _is_healthy(self, vs_server):
+        try:
+            return self._check(vs_server)
+        except Exception:
+            return False
+
+
+class PropertyMor(VIMor):
+    """A VIMor that builds its ZSI typecode only when it is serialized, building it for each of the thousands
+    of mors of a bulk fetch costs more than decoding them
+    """
+
+    def __init__(self, value, mor_type):
+        self._mor_type = mor_type
+
+    @cached_property
+    def typecode(self):
+        return VI.ns0.ManagedObjectReference_Def(str(self))
+
+
+class PropertiesDecoder:
+    """Decodes a RetrievePropertiesEx (or ContinueRetrievePropertiesEx) response with the C parser of ElementTree,
+    one object at a time, instead of the ZSI object graph, which takes most of the time of a bulk fetch. Only the
+    values of the vm listings are decoded: the xsd primitives, the enums and the managed object references.
+    """
+
+    XSD_TYPES = {
+        "string": str,
+        "anyURI": str,
+        "int": int,
+        "long": int,
+        "short": int,
+        "byte": int,
+        "float": float,
+        "double": float,
+        "boolean": lambda text: text in ("true", "1"),
+    }
+
+    # vim type name to whether it is an enum, the typecodes of the bindings tell
+    _enum_types = {}
+
+    def __init__(self, data):
+        self._data = data
+        self._namespaces = {}
+
+    @classmethod
+    def _is_enum(cls, type_name):
+        if type_name not in cls._enum_types:
+            type_def = getattr(VI.ns0, f"{type_name}_Def", None)
+            cls._enum_types[type_name] = isinstance(type_def, type) and issubclass(type_def, TC.String)
+
+        return cls._enum_types[type_name]
+
+    def _decode_value(self, val):
+        prefix, _, type_name = val.get(VSPHERE_CONST_XSI_TYPE, "").rpartition(":")
+        namespace = self._namespaces.get(prefix)
+        text = val.text or ""
+
+        if namespace == VSPHERE_CONST_XSD_NS and type_name in self.XSD_TYPES:
+            return self.XSD_TYPES[type_name](text)
+
+        if namespace == VSPHERE_CONST_VIM_NS and not len(val):
+            if type_name == VSPHERE_CONST_MOR_TYPE:
+                return PropertyMor(text, val.get("type"))
+            if self._is_enum(type_name):
+                return text
+
+        raise ValueError(f"Unsupported property type {type_name}")
+
+    def decode(self):
+        """Decodes the response
+
+        Return:
+            A list of (mor, dictionary of property name to value) tuples and the continuation token, if any,
+            None if the response is a fault or holds a value that is not supported, for the ZSI bindings to handle
+        """
+
+        soap_ns = f"{{{VSPHERE_CONST_SOAP_ENV_NS}}}"
+        vim_ns = f"{{{VSPHERE_CONST_VIM_NS}}}"
+
+        fault_tag = f"{soap_ns}Fault"
+        token_tag = f"{vim_ns}token"
+        objects_tag = f"{vim_ns}objects"
+        obj_tag = f"{vim_ns}obj"
+        prop_set_tag = f"{vim_ns}propSet"
+        name_tag = f"{vim_ns}name"
+        val_tag = f"{vim_ns}val"
+
+        objects = []
+        token = None
+
+        try:
+            for event, elem in ElementTree.iterparse(io.BytesIO(self._data), events=("start-ns", "end")):
+                if event == "start-ns":
+                    self._namespaces[elem[0]] = elem[1]
+                elif elem.tag == objects_tag:
+                    obj = elem.find(obj_tag)
+                    props = {}
+                    for prop in elem.iterfind(prop_set_tag):
+                        props[prop.findtext(name_tag)] = self._decode_value(prop.find(val_tag))
+                    objects.append((PropertyMor(obj.text, obj.get("type")), props))
+
+                    # only the current object is kept in the tree, the cleared ones are empty elements
+                    elem.clear()
+                elif elem.tag == token_tag:
+                    token = elem.text
+                elif elem.tag == fault_tag:
+                    return None
+        except (ElementTree.ParseError, ValueError, TypeError, AttributeError):
+            return None
+
+        return objects, token
+
+
 class VsphereConnector(BaseConnector):
     # Actions supported by this script
     ACTION_ID_GET_REGISTERED_GUESTS = "list_vms"
@@ -46,6 +544,11 @@ class VsphereConnector(BaseConnector):
     ACTION_ID_TAKE_SNAPSHOT = "take_snapshot"
     ACTION_ID_REVERT_VM = "revert_vm"
     ACTION_ID_GET_SYSTEM_INFO = "get_system_info"
+    ACTION_ID_LIST_SNAPSHOTS = "list_snapshots"
+    ACTION_ID_PRUNE_SNAPSHOTS = "prune_snapshots"
+    ACTION_ID_EXPORT_DISK_CHANGES = "export_disk_changes"
+    ACTION_ID_REBUILD_DISK_IMAGE = "rebuild_disk_image"
+    ACTION_ID_EXPORT_VM_DISKS = "export_vm_disks"
 
     def __init__(self):
         # Call the BaseConnectors init first
@@ -53,7 +556,28 @@ class VsphereConnector(BaseConnector):
 
         self._vs_server = None
         self._datacenters = list()
+        self._datacenter_mors = dict()
+        self._datacenters_timestamp = 0
         self._verify = False
+        self._state = dict()
+        self._index_ttl = VSPHERE_CONST_DEFAULT_INDEX_TTL
+        self._index_refreshed = False
+        self._reuse_session = False
+        self._task_timeout = 0
+        self._datacenter_timeout = 0
+        self._download_chunk_size = VSPHERE_CONST_DEFAULT_DOWNLOAD_BUFFER_SIZE * 1024
+        self._compression = VSPHERE_CONST_COMPRESSION_NONE
+        self._snapshot_keep_last = None
+        self._snapshot_max_age = None
+        self._download_from_host = True
+        self._session = None
+        self._server_pool = None
+        self._servers = list()
+        # set to stop the inventory of a server once another server found what is looked for
+        self._cancel = None
+        # the progress of worker threads is queued for the thread of the action run, see save_progress
+        self._main_thread = threading.current_thread()
+        self._progress_queue = queue.Queue()
 
         # Connector result global object
         self._vs_server = VIServer()
@@ -62,14 +586,177 @@ class VsphereConnector(BaseConnector):
         config = self.get_config()
 
         self._verify = config.get("verify_server_cert", False)
+        self._reuse_session = config.get(VSPHERE_JSON_REUSE_SESSION, False)
+        self._download_from_host = config.get(VSPHERE_JSON_DOWNLOAD_FROM_HOST, True)
 
-        # setup the auth
+        # the inventory actions run on all the servers of the comma separated list, the other actions on one of them
+        self._servers = [x.strip() for x in config[phantom.APP_JSON_SERVER].split(",") if x.strip()]
+        if not self._servers:
+            return self.set_status(phantom.APP_ERROR, VSPHERE_ERR_NO_SERVER)
+
+        # setup the auth, replaced by the cookie of the vSphere session once connected, see _attach_http_session
         self._auth = HTTPBasicAuth(config[phantom.APP_JSON_USERNAME], config[phantom.APP_JSON_PASSWORD])
 
+        # one keep-alive session for all the requests of the action run, SOAP calls and datastore downloads
+        self._session = self._create_http_session()
+
+        self._state = self.load_state()
+        if not isinstance(self._state, dict):
+            self.debug_print("Resetting the state file with the default format")
+            self._state = {"app_version": self.get_app_json().get("app_version")}
+
+        for key in VSPHERE_CONST_STATE_OLD_KEYS:
+            self._state.pop(key, None)
+
+        ret_val, self._index_ttl = self._validate_integer(
+            self, config.get(VSPHERE_JSON_INDEX_TTL, VSPHERE_CONST_DEFAULT_INDEX_TTL), VSPHERE_JSON_INDEX_TTL, allow_zero=True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._task_timeout = self._validate_integer(
+            self, config.get(VSPHERE_JSON_TASK_TIMEOUT, 0), VSPHERE_JSON_TASK_TIMEOUT, allow_zero=True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._datacenter_timeout = self._validate_integer(
+            self, config.get(VSPHERE_JSON_DATACENTER_TIMEOUT, 0), VSPHERE_JSON_DATACENTER_TIMEOUT, allow_zero=True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, buffer_size = self._validate_integer(
+            self, config.get(VSPHERE_JSON_DOWNLOAD_BUFFER_SIZE, VSPHERE_CONST_DEFAULT_DOWNLOAD_BUFFER_SIZE), VSPHERE_JSON_DOWNLOAD_BUFFER_SIZE
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+        self._download_chunk_size = buffer_size * 1024
+
+        ret_val, self._snapshot_keep_last = self._validate_integer(
+            self, config.get(VSPHERE_JSON_SNAPSHOT_KEEP_LAST), VSPHERE_JSON_SNAPSHOT_KEEP_LAST
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._snapshot_max_age = self._validate_integer(self, config.get(VSPHERE_JSON_SNAPSHOT_MAX_AGE), VSPHERE_JSON_SNAPSHOT_MAX_AGE)
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        self._compression = config.get(VSPHERE_JSON_COMPRESSION, VSPHERE_CONST_COMPRESSION_NONE)
+        if self._compression not in VSPHERE_CONST_COMPRESSION_EXTENSIONS:
+            return self.set_status(
+                phantom.APP_ERROR, VSPHERE_ERR_INVALID_COMPRESSION.format(values=", ".join(VSPHERE_CONST_COMPRESSION_EXTENSIONS))
+            )
+        if (self._compression == VSPHERE_CONST_COMPRESSION_ZSTD) and (zstandard is None):
+            self.debug_print("The zstandard module is not installed, compressing with gzip instead")
+            self._compression = VSPHERE_CONST_COMPRESSION_GZIP
+
         self.debug_print("self.status", self.get_status())
 
         return phantom.APP_SUCCESS
 
+    def finalize(self):
+        self._flush_progress()
+
+        # Save the state, this data is saved across actions and app upgrades
+        self.save_state(self._state)
+
+        if self._server_pool:
+            self._server_pool.close()
+
+        if self._session:
+            self._session.close()
+
+        return phantom.APP_SUCCESS
+
+    def _create_http_session(self):
+        """Function that creates a keep-alive http session, with a connection pool big enough for the worker threads
+
+        Return:
+            The requests.Session object
+        """
+
+        session = requests.Session()
+        session.verify = self._verify
+        session.mount("https://", HTTPAdapter(pool_maxsize=VSPHERE_CONST_HTTP_POOL_SIZE))
+        session.mount("http://", HTTPAdapter(pool_maxsize=VSPHERE_CONST_HTTP_POOL_SIZE))
+
+        return session
+
+    def save_progress(self, progress_str_const, *unnamed_format_args, **named_format_args):
+        """Function that reports a progress message. The messages of worker threads are queued, and reported by the
+        thread of the action run the next time it reports progress or calls _flush_progress
+        """
+
+        self._report_progress(super().save_progress, progress_str_const, unnamed_format_args, named_format_args)
+
+    def send_progress(self, progress_str_const, *unnamed_format_args, **named_format_args):
+        """Function that reports a transient progress message, queued like the ones of save_progress"""
+
+        self._report_progress(super().send_progress, progress_str_const, unnamed_format_args, named_format_args)
+
+    def _report_progress(self, report, progress_str_const, unnamed_format_args, named_format_args):
+        """Function that reports a progress message from the thread of the action run, or queues it from a worker thread
+
+        Args:
+            report: The BaseConnector method to report the message with
+            progress_str_const: The message
+            unnamed_format_args: The positional arguments to format the message with
+            named_format_args: The named arguments to format the message with
+        """
+
+        if threading.current_thread() is not self._main_thread:
+            self._progress_queue.put((report, progress_str_const, unnamed_format_args, named_format_args))
+            return
+
+        self._flush_progress()
+        report(progress_str_const, *unnamed_format_args, **named_format_args)
+
+    def _flush_progress(self):
+        """Function that reports the progress messages queued by the worker threads, in order.
+        Does nothing outside of the thread of the action run.
+        """
+
+        if threading.current_thread() is not self._main_thread:
+            return
+
+        while True:
+            try:
+                report, progress_str_const, unnamed_format_args, named_format_args = self._progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            report(progress_str_const, *unnamed_format_args, **named_format_args)
+
+    def _validate_integer(self, action_result, parameter, key, allow_zero=False):
+        """Function that validates that a parameter is a non negative integer
+
+        Args:
+            action_result: The object (ActionResult or connector) to set the status on
+            parameter: The value of the parameter
+            key: The name of the parameter, used in the error message
+            allow_zero: Whether zero is a valid value
+
+        Return:
+            A status code and the integer value
+        """
+
+        if parameter is not None:
+            try:
+                if not float(parameter).is_integer():
+                    return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_INVALID_INTEGER.format(key=key)), None
+
+                parameter = int(parameter)
+            except Exception:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_INVALID_INTEGER.format(key=key)), None
+
+            if parameter < 0:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_NEGATIVE_INTEGER.format(key=key)), None
+            if not allow_zero and parameter == 0:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_ZERO_INTEGER.format(key=key)), None
+
+        return phantom.APP_SUCCESS, parameter
+
     def _connect_to_server(self, config):
         """Function that logins to the vsphere server
 
@@ -93,6 +780,13 @@ class VsphereConnector(BaseConnector):
         username = config[phantom.APP_JSON_USERNAME]
         password = config[phantom.APP_JSON_PASSWORD]
 
+        # test connectivity always logs in, it's there to validate the credentials
+        if self._reuse_session and (self.get_action_identifier() != phantom.ACTION_ID_TEST_ASSET_CONNECTIVITY):
+            if self._restore_session(server, username, password):
+                self._attach_http_session()
+                self.save_progress(VSPHERE_PROG_REUSING_SESSION)
+                return phantom.APP_SUCCESS
+
         self.save_progress(phantom.APP_PROG_CONNECTING_TO_ELLIPSES, server)
 
         try:
@@ -100,185 +794,3589 @@ class VsphereConnector(BaseConnector):
         except Exception as e:
             return self.set_status_save_progress(phantom.APP_ERROR, VSPHERE_ERR_SERVER_CONNECT, e, server_ip=server)
 
+        self._attach_http_session()
+
         # Get the datacenters
-        datacenters = self._vs_server.get_datacenters()
+        self._load_datacenters(self._vs_server.get_datacenters())
 
-        self._datacenters = [v for k, v in datacenters.items()]
+        if self._reuse_session:
+            self._save_session(server, username)
 
         return phantom.APP_SUCCESS
 
-    def _get_system_info(self, config, param):
-        # Connect to the server
-        status_code = self._connect_to_server(config)
-
-        if phantom.is_fail(status_code):
-            return status_code
-
-        # Add the action result
-        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
-        action_result = self.add_action_result(ActionResult(dict(param)))
+    def _load_datacenters(self, datacenters, timestamp=None):
+        """Function that sets the datacenters of the server
 
-        total_vms = 0
-        matched = False
+        Args:
+            datacenters: The dictionary of datacenter mor to name, as returned by get_datacenters
+            timestamp: The time the datacenters were fetched at, None for now
+        """
 
-        ip_hostname = param[VSPHERE_JSON_IP_HOSTNAME]
+        self._datacenters = [v for k, v in datacenters.items()]
+        self._datacenter_mors = {v: k for k, v in datacenters.items()}
+        self._datacenters_timestamp = timestamp or time.time()
 
-        for datacenter in self._datacenters:
-            vm_list = self._vs_server.get_registered_vms(datacenter=datacenter)
+    def _attach_http_session(self):
+        """Function that sends the SOAP calls of the vsphere server object through the http session of the action run,
+        and authenticates the datastore downloads with the cookie of the vSphere session instead of basic auth,
+        which the server would otherwise check, and log in with, on every download
+        """
 
-            total_vms += len(vm_list)
+        binding = self._vs_server._proxy.binding
+        binding.transport = SessionTransport
+        binding.transdict = {"session": self._session, "scheme": urlparse(binding.url).scheme}
 
-            for curr_vmx_path in vm_list:
-                # get the vm object
-                vm = self._vs_server.get_vm_by_path(curr_vmx_path, datacenter)
+        self._auth = SessionCookieAuth({k: v.coded_value for k, v in binding.cookies.items()})
 
-                ip = vm.get_property("ip_address")
-                hostname = vm.get_property("hostname")
+    def _create_worker_server(self):
+        """Function that creates a copy of the vsphere server object with a SOAP binding of its own, on the same
+        vSphere session and http session, for a worker thread. A ZSI binding keeps the state of the call in
+        progress, it can't be shared between threads.
 
-                if (ip_hostname != ip) and (ip_hostname != hostname):
-                    continue
+        Return:
+            The vsphere server object
+        """
 
-                # one of the params matched
-                curr_data = action_result.add_data({})
-                curr_data[VSPHERE_JSON_VMX_PATH] = f"[{datacenter}]" + curr_vmx_path
-                curr_data[phantom.APP_JSON_IP] = ip
-                curr_data[VSPHERE_JSON_GUEST_NAME] = vm.get_property("name")
-                curr_data[VSPHERE_JSON_GUEST_HOST_NAME] = hostname
-                curr_data[VSPHERE_JSON_GUEST_FULL_NAME] = vm.get_property("guest_full_name")
+        binding = self._vs_server._proxy.binding
 
-                if vm.is_powered_on():
-                    curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_RUNNING
-                else:
-                    curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_NOT_RUNNING
+        proxy = VI.VimServiceLocator().getVimPort(
+            url=binding.url,
+            transport=SessionTransport,
+            transdict={"session": self._session, "scheme": urlparse(binding.url).scheme, "timeout": None},
+        )
+        proxy.binding.AddHeader("User-Agent", VSPHERE_CONST_USER_AGENT)
 
-                # Found the endpoint, so break
-                matched = True
-                break
+        for name, morsel in binding.cookies.items():
+            proxy.binding.cookies.load(f"{name}={morsel.coded_value}")
 
-        # update the summary value about the total guests
-        action_result.update_summary({"total_vms_searched": total_vms})
-        action_result.update_summary({"found_endpoint": matched})
+        vs_server = copy.copy(self._vs_server)
+        vs_server._proxy = proxy
 
-        action_result.set_status(phantom.APP_SUCCESS)
+        return vs_server
 
-    def _get_vms(self, action, config, param):
-        """Function that handles ACTION_ID_GET_REGISTERED_GUESTS and
-        ACTION_ID_GET_RUNNING_GUESTS
+    def _check_server(self, vs_server):
+        """Function that checks that the session of a vsphere server object is still logged in,
+        the current session of the SessionManager is empty once it has expired
 
-         Args:
+        Args:
+            vs_server: The vsphere server object
 
-         Return:
-             A status code
+        Return:
+            True if the session is valid
         """
 
-        # Connect to the server
-        status_code = self._connect_to_server(config)
+        obj_content = vs_server._get_object_properties(vs_server._do_service_content.SessionManager, property_names=["currentSession"])
 
-        if phantom.is_fail(status_code):
-            return status_code
+        return bool(getattr(obj_content, "PropSet", None))
 
-        # Add the action result
-        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
-        action_result = self.add_action_result(ActionResult(dict(param)))
+    def _get_server_pool(self):
+        """Function that returns the pool of vsphere server objects for the worker threads of the action run,
+        it must only be used once connected
 
-        total_vms = 0
-        total_running = 0
+        Return:
+            The ServerPool object
+        """
 
-        for datacenter in self._datacenters:
-            if action == self.ACTION_ID_GET_RUNNING_GUESTS:
-                vm_list = self._vs_server.get_registered_vms(status="poweredOn", datacenter=datacenter)
-            else:
-                vm_list = self._vs_server.get_registered_vms(datacenter=datacenter)
-
-            total_vms += len(vm_list)
-
-            for curr_vmx_path in vm_list:
-                # get the vm object
-                vm = self._vs_server.get_vm_by_path(curr_vmx_path, datacenter)
-                curr_data = action_result.add_data({})
-                curr_data[VSPHERE_JSON_VMX_PATH] = f"[{datacenter}]" + curr_vmx_path
-                curr_data[phantom.APP_JSON_IP] = vm.get_property("ip_address")
-                curr_data[VSPHERE_JSON_GUEST_NAME] = vm.get_property("name")
-                curr_data[VSPHERE_JSON_GUEST_HOST_NAME] = vm.get_property("hostname")
-                curr_data[VSPHERE_JSON_GUEST_FULL_NAME] = vm.get_property("guest_full_name")
-
-                if vm.is_powered_on():
-                    curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_RUNNING
-                    total_running += 1
-                else:
-                    curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_NOT_RUNNING
+        if self._server_pool is None:
+            self._server_pool = ServerPool(self._create_worker_server, self._check_server, VSPHERE_CONST_SERVER_POOL_SIZE)
 
-        # update the summary value about the total guests
-        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS: total_vms})
-        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS_RUNNING: total_running})
+        return self._server_pool
 
-        action_result.set_status(phantom.APP_SUCCESS)
+    def _save_session(self, server, username):
+        """Function that saves the session cookie (encrypted) and the datacenters, with the time they were fetched,
+        in the state, for the next action run to reuse instead of logging in again
 
-    def _list_vms(self, action, config, param):
-        """Function that handles ACTION_ID_GET_REGISTERED_GUESTS
         Args:
-
-        Return:
-            A status code
+            server: The server the session belongs to
+            username: The user the session belongs to
         """
-        return self._get_vms(action, config, param)
 
-    def _wait_for_async_task(self, task, action, action_result):
-        """Function that asynchronously manages the task object
+        cookies = {k: v.coded_value for k, v in self._vs_server._proxy.binding.cookies.items()}
+
+        try:
+            encrypted_cookies = encryption_helper.encrypt(json.dumps(cookies), self.get_asset_id())
+        except Exception as e:
+            self.debug_print("Unable to encrypt the session cookie, it will not be reused", e)
+            self._state.get(VSPHERE_CONST_STATE_SESSIONS, {}).pop(server, None)
+            return
+
+        self._state.setdefault(VSPHERE_CONST_STATE_SESSIONS, {})[server] = {
+            VSPHERE_CONST_SESSION_SERVER: server,
+            VSPHERE_CONST_SESSION_USERNAME: username,
+            VSPHERE_CONST_SESSION_COOKIES: encrypted_cookies,
+            VSPHERE_CONST_SESSION_DATACENTERS: [[str(v), k] for k, v in self._datacenter_mors.items()],
+            VSPHERE_CONST_SESSION_DATACENTERS_TIMESTAMP: int(self._datacenters_timestamp),
+        }
+
+    def _restore_session(self, server, username, password):
+        """Function that attaches the session saved by an earlier run to the vsphere server object.
+        The service content is fetched (no authentication needed) and the session is validated
+        by reading the current session of the SessionManager, which is empty once it has expired.
+        The saved datacenters are reused for the index ttl of the asset, then fetched again.
 
         Args:
-            task: The task object to monitor.
-            action: The action that is currently being carried out.
-            action_result: The ActionResult object to hold the status
+            server: The ip or hostname of the server
+            username: The username of the asset
+            password: The password of the asset
 
         Return:
-            A status code of the type phantom.APP_[SUCC|ERR]_XXX.
+            True if the session could be reused, False if a login is required
         """
 
-        displayed_once = False
-        task_name = action.replace("_", " ")
+        session = self._state.get(VSPHERE_CONST_STATE_SESSIONS, {}).get(server)
 
-        while True:
-            # interested in all states
-            status = task.wait_for_state(["success", "error", "queued", "running"])
+        if (
+            (not isinstance(session, dict))
+            or (session.get(VSPHERE_CONST_SESSION_SERVER) != server)
+            or (session.get(VSPHERE_CONST_SESSION_USERNAME) != username)
+        ):
+            return False
 
-            if status == "error":
-                action_result.set_status(phantom.APP_ERROR, phantom.APP_ERR_CMD_EXEC)
-                action_result.append_to_message(task.get_error_message())
-                break
-            elif status == "success":
-                action_result.set_status(phantom.APP_SUCCESS, phantom.APP_SUCC_CMD_EXEC)
-                break
-            elif status == "queued":
-                self.send_progress(VSPHERE_PROG_TASK_QUEUED)
-            elif status == "running":
-                progress = task.get_progress()
-                if progress:
-                    self.send_progress(VSPHERE_PROG_TASK_COMPLETED_PERCENT, task_name=task_name, progress=progress)
-                elif not displayed_once:
-                    self.send_progress(VSPHERE_PROG_TASK_RUNNING)
-                    displayed_once = True
-
-            time.sleep(2)
+        try:
+            cookies = json.loads(encryption_helper.decrypt(session[VSPHERE_CONST_SESSION_COOKIES], self.get_asset_id()))
 
-        return action_result.get_status()
+            # pysphere has no api to attach an existing session, so set up the proxy like
+            # VIServer.connect does, minus the Login call
+            server_url = server if server.lower().startswith(("http://", "https://")) else f"https://{server}/sdk"
+            proxy = VI.VimServiceLocator().getVimPort(
+                url=server_url, transport=SessionTransport, transdict={"session": self._session, "scheme": urlparse(server_url).scheme}
+            )
+            proxy.binding.AddHeader("User-Agent", VSPHERE_CONST_USER_AGENT)
+
+            request = VI.RetrieveServiceContentRequestMsg()
+            mor_service_instance = request.new__this("ServiceInstance")
+            mor_service_instance.set_attribute_type(MORTypes.ServiceInstance)
+            request.set_element__this(mor_service_instance)
+            service_content = proxy.RetrieveServiceContent(request)._returnval
+
+            for name, value in cookies.items():
+                proxy.binding.cookies.load(f"{name}={value}")
+
+            vs_server = VIServer()
+            vs_server._proxy = proxy
+            vs_server._do_service_content = service_content
+            vs_server._VIServer__server_type = service_content.About.Name
+            vs_server._VIServer__api_version = service_content.About.ApiVersion
+            vs_server._VIServer__api_type = service_content.About.ApiType
+            vs_server._VIServer__user = username
+            vs_server._VIServer__password = password
+            vs_server._VIServer__logged = True
+
+            if not self._check_server(vs_server):
+                raise Exception(VSPHERE_ERR_SESSION_EXPIRED)
+
+            # datacenters are seldom added or removed, but they are, so the saved ones expire
+            timestamp = session.get(VSPHERE_CONST_SESSION_DATACENTERS_TIMESTAMP, 0)
+            if self._index_ttl and ((time.time() - timestamp) < self._index_ttl):
+                datacenters = {VIMor(k, MORTypes.Datacenter): v for k, v in session.get(VSPHERE_CONST_SESSION_DATACENTERS, [])}
+            else:
+                datacenters = vs_server.get_datacenters()
+                timestamp = None
+        except Exception as e:
+            self.debug_print("Unable to reuse the saved session", e)
+            self._state[VSPHERE_CONST_STATE_SESSIONS].pop(server, None)
+            return False
 
-    def _parse_vm_path(self, full_vmx_path):
-        # The full_vmx_path will be of the format
-        # [datacenter_name][datastore_name] <vm_folder>.<vmname>.vmx
-        # for e.g. [Datacenter][DAS_labesxi1_1] OpenVAS/OpenVAS.vmx
+        self._vs_server = vs_server
+        self._load_datacenters(datacenters, timestamp)
 
-        search = re.search(r"\[(.*)\](\[.*)", full_vmx_path)
-        if not search:
-            return VSPHERE_CONST_DEFAULT_DATACENTER, full_vmx_path
+        if timestamp is None:
+            self._save_session(server, username)
 
-        datacenter = search.group(1)
-        vmx_path = search.group(2)
+        return True
 
-        return datacenter, vmx_path
+    def _retrieve_properties_page(self, request, response_msg, vs_server):
+        """Function that sends a RetrievePropertiesEx or ContinueRetrievePropertiesEx request and decodes the page
+        of objects it returns. The response is decoded by the PropertiesDecoder, the ZSI bindings only parse it
+        (from the same raw data) when it is a fault or holds values the decoder does not support.
 
-    def _handle_start_stop_guest(self, action, config, param):
-        """Function that handles ACTION_ID_STOP_GUEST and ACTION_ID_START_GUEST action
+        Args:
+            request: The request message
+            response_msg: The class of the response message, for the ZSI bindings
+            vs_server: The vsphere server object to send the request with
+
+        Return:
+            A list of (mor, dictionary of property name to value) tuples and the continuation token, if any
+        """
+
+        binding = vs_server._proxy.binding
+        binding.Send(None, None, request, soapaction=VSPHERE_CONST_SOAP_ACTION)
+
+        page = PropertiesDecoder(binding.ReceiveRaw()).decode()
+        if page is not None:
+            return page
+
+        retval = binding.Receive(response_msg.typecode)._returnval
+        if not retval:
+            return [], None
+
+        objects = [(obj.Obj, {prop.Name: prop.Val for prop in getattr(obj, "PropSet", None) or []}) for obj in retval.Objects]
+        return objects, getattr(retval, "Token", None)
+
+    def _iter_vm_properties(self, datacenter, property_names=VSPHERE_CONST_VM_PROPERTIES, vs_server=None, deadline=None):
+        """Function that fetches the properties of all the vms of a datacenter in bulk and yields them page by page.
+        A single property collector retrieval is done on a container view of the datacenter, paged through the
+        RetrievePropertiesEx continuation tokens, so there is no round trip per vm.
+
+        Args:
+            datacenter: The name of the datacenter
+            property_names: The list of vm properties to fetch
+            vs_server: The vsphere server object to fetch with, None for the one of the connector
+            deadline: The time after which no more page is fetched, None to fetch all of them
+
+        Return:
+            A generator of dictionaries (one per vm) of property name to value
+        """
+
+        vs_server = vs_server or self._vs_server
+        datacenter_mor = self._datacenter_mors.get(datacenter)
+
+        # a None from_node would traverse the whole inventory
+        if datacenter_mor is None:
+            return
+
+        collector = vs_server._do_service_content.PropertyCollector
+        view = self._create_container_view(datacenter_mor, MORTypes.VirtualMachine, vs_server)
+
+        try:
+            request = VI.RetrievePropertiesExRequestMsg()
+            _this = request.new__this(collector)
+            _this.set_attribute_type(MORTypes.PropertyCollector)
+            request.set_element__this(_this)
+
+            spec = request.new_specSet()
+            self._fill_filter_spec(spec, view, MORTypes.VirtualMachine, property_names, container_view=True)
+            request.set_element_specSet([spec])
+            request.set_element_options(request.new_options())
+
+            objects, token = self._retrieve_properties_page(request, VI.RetrievePropertiesExResponseMsg, vs_server)
+
+            while True:
+                for mor, vm_props in objects:
+                    if not vm_props:
+                        continue
+
+                    vm_props[VSPHERE_CONST_VM_MOR] = str(mor)
+
+                    # vms without a config (e.g. inaccessible ones) can't be addressed by a vmx path
+                    if not vm_props.get(VSPHERE_CONST_PROP_VMX_PATH):
+                        continue
+
+                    yield vm_props
+
+                if not token:
+                    break
+
+                if deadline and (time.time() > deadline):
+                    raise TimeoutError(VSPHERE_ERR_DATACENTER_TIMEOUT.format(timeout=self._datacenter_timeout))
+
+                if self._cancel and self._cancel.is_set():
+                    raise CancelledError()
+
+                request = VI.ContinueRetrievePropertiesExRequestMsg()
+                _this = request.new__this(collector)
+                _this.set_attribute_type(MORTypes.PropertyCollector)
+                request.set_element__this(_this)
+                request.set_element_token(token)
+
+                objects, token = self._retrieve_properties_page(request, VI.ContinueRetrievePropertiesExResponseMsg, vs_server)
+        finally:
+            self._destroy_view(view, vs_server)
+
+    def _retrieve_datacenters_vms(self, property_names=VSPHERE_CONST_VM_PROPERTIES):
+        """Function that fetches the properties of the vms of all the datacenters in bulk. The datacenters are fetched
+        at the same time by a pool of workers, each on a server leased from the server pool, a datacenter that fails,
+        or takes longer than the datacenter timeout, does not stop the others.
+
+        Args:
+            property_names: The list of vm properties to fetch
+
+        Return:
+            A list of (datacenter name, list of vm properties) tuples, in the order of the datacenters,
+            and a dictionary of the datacenters that failed to their error.
+            Raises CancelledError if the inventory was stopped.
+        """
+
+        datacenters = list(self._datacenters)
+        if not datacenters:
+            return [], {}
+
+        timeout = self._datacenter_timeout or None
+        workers = min(len(datacenters), VSPHERE_CONST_INVENTORY_WORKERS)
+        server_pool = self._get_server_pool()
+
+        def fetch(datacenter):
+            if self._cancel and self._cancel.is_set():
+                raise CancelledError()
+
+            with server_pool.lease(call_timeout=timeout) as vs_server:
+                deadline = (time.time() + timeout) if timeout else None
+                return list(self._iter_vm_properties(datacenter, property_names, vs_server, deadline))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fetch, datacenter) for datacenter in datacenters]
+
+        datacenter_vms = []
+        failed = {}
+        for datacenter, future in zip(datacenters, futures):
+            try:
+                datacenter_vms.append((datacenter, future.result()))
+            except CancelledError:
+                # the inventory was stopped, which is not a failure of the datacenter
+                raise
+            except Exception as e:
+                self.debug_print(VSPHERE_ERR_GET_VMS.format(datacenter=datacenter), e)
+                failed[datacenter] = e
+
+        return datacenter_vms, failed
+
+    def _get_vm_properties(self, vm_mor, property_names=VSPHERE_CONST_VM_PROPERTIES):
+        """Function that fetches the properties of a single vm in one round trip
+
+        Args:
+            vm_mor: The managed object reference id of the vm, e.g. 'vm-42'
+            property_names: The list of vm properties to fetch
+
+        Return:
+            A dictionary of property name to value, None if the vm does not exist anymore
+        """
+
+        try:
+            obj_content = self._vs_server._get_object_properties(VIMor(vm_mor, MORTypes.VirtualMachine), property_names=list(property_names))
+        except Exception as e:
+            # most probably a ManagedObjectNotFound, the vm was removed since the mor was saved
+            self.debug_print(f"Unable to get the properties of vm {vm_mor}", e)
+            return None
+
+        prop_set = getattr(obj_content, "PropSet", None)
+        if not prop_set:
+            return None
+
+        vm_props = {prop.Name: prop.Val for prop in prop_set}
+        vm_props[VSPHERE_CONST_VM_MOR] = vm_mor
+
+        if not vm_props.get(VSPHERE_CONST_PROP_VMX_PATH):
+            return None
+
+        return vm_props
+
+    def _create_property_collector(self):
+        """Function that creates a property collector of the session.
+        Filters and update versions are kept per collector, a dedicated one makes sure
+        they are not mixed up with the ones of the default collector.
+
+        Return:
+            The mor of the property collector
+        """
+
+        request = VI.CreatePropertyCollectorRequestMsg()
+        _this = request.new__this(self._vs_server._do_service_content.PropertyCollector)
+        _this.set_attribute_type(MORTypes.PropertyCollector)
+        request.set_element__this(_this)
+
+        return self._vs_server._proxy.CreatePropertyCollector(request)._returnval
+
+    def _destroy_property_collector(self, collector):
+        """Function that destroys a property collector along with its filters, errors are ignored
+
+        Args:
+            collector: The mor of the property collector
+        """
+
+        try:
+            request = VI.DestroyPropertyCollectorRequestMsg()
+            _this = request.new__this(collector)
+            _this.set_attribute_type(MORTypes.PropertyCollector)
+            request.set_element__this(_this)
+            self._vs_server._proxy.DestroyPropertyCollector(request)
+        except Exception as e:
+            self.debug_print("Unable to destroy the property collector", e)
+
+    def _create_container_view(self, container, obj_type, vs_server=None):
+        """Function that creates a view of all the objects of a type under a container, recursively
+
+        Args:
+            container: The mor of the container, e.g. a datacenter
+            obj_type: The type of the objects in the view, e.g. VirtualMachine
+            vs_server: The vsphere server object to create the view with, None for the one of the connector
+
+        Return:
+            The mor of the container view
+        """
+
+        vs_server = vs_server or self._vs_server
+        view_manager = vs_server._do_service_content.ViewManager
+
+        request = VI.CreateContainerViewRequestMsg()
+        _this = request.new__this(view_manager)
+        _this.set_attribute_type(view_manager.get_attribute_type())
+        request.set_element__this(_this)
+
+        mor_container = request.new_container(container)
+        mor_container.set_attribute_type(container.get_attribute_type())
+        request.set_element_container(mor_container)
+        request.set_element_type([obj_type])
+        request.set_element_recursive(True)
+
+        return vs_server._proxy.CreateContainerView(request)._returnval
+
+    def _destroy_view(self, view, vs_server=None):
+        """Function that destroys a view, errors are ignored
+
+        Args:
+            view: The mor of the view
+            vs_server: The vsphere server object to destroy the view with, None for the one of the connector
+        """
+
+        vs_server = vs_server or self._vs_server
+
+        try:
+            request = VI.DestroyViewRequestMsg()
+            _this = request.new__this(view)
+            _this.set_attribute_type(view.get_attribute_type())
+            request.set_element__this(_this)
+            vs_server._proxy.DestroyView(request)
+        except Exception as e:
+            self.debug_print("Unable to destroy the view", e)
+
+    def _fill_filter_spec(self, spec, obj, obj_type, property_names, container_view=False):
+        """Function that fills the property filter spec of a CreateFilter or RetrievePropertiesEx request
+
+        Args:
+            spec: The PropertyFilterSpec of the request
+            obj: The mor (or list of mors) of the object, or of the container view to get the objects of
+            obj_type: The type of the object(s)
+            property_names: The list of properties
+            container_view: True if obj is a container view
+        """
+
+        prop_set = spec.new_propSet()
+        prop_set.set_element_type(obj_type)
+        prop_set.set_element_pathSet(list(property_names))
+        prop_set.set_element_all(False)
+        spec.set_element_propSet([prop_set])
+
+        object_sets = []
+        for mor in obj if isinstance(obj, list) else [obj]:
+            object_set = spec.new_objectSet()
+            mor_obj = object_set.new_obj(mor)
+            mor_obj.set_attribute_type(mor.get_attribute_type())
+            object_set.set_element_obj(mor_obj)
+
+            if container_view:
+                # skip the view itself, report the objects it contains
+                object_set.set_element_skip(True)
+                traverse_view = VI.ns0.TraversalSpec_Def("traverseView").pyclass()
+                traverse_view.set_element_name("traverseView")
+                traverse_view.set_element_type(MORTypes.ContainerView)
+                traverse_view.set_element_path("view")
+                traverse_view.set_element_skip(False)
+                object_set.set_element_selectSet([traverse_view])
+            else:
+                object_set.set_element_skip(False)
+
+            object_sets.append(object_set)
+
+        spec.set_element_objectSet(object_sets)
+
+    def _create_filter(self, collector, obj, obj_type, property_names, container_view=False):
+        """Function that creates a property filter on a property collector
+
+        Args:
+            collector: The mor of the property collector
+            obj: The mor (or list of mors) of the object to watch, or of the container view to watch the objects of
+            obj_type: The type of the object(s) to watch
+            property_names: The list of properties to watch
+            container_view: True if obj is a container view
+
+        Return:
+            The mor of the filter
+        """
+
+        request = VI.CreateFilterRequestMsg()
+        _this = request.new__this(collector)
+        _this.set_attribute_type(MORTypes.PropertyCollector)
+        request.set_element__this(_this)
+
+        spec = request.new_spec()
+        self._fill_filter_spec(spec, obj, obj_type, property_names, container_view)
+        request.set_element_spec(spec)
+        request.set_element_partialUpdates(False)
+
+        return self._vs_server._proxy.CreateFilter(request)._returnval
+
+    def _wait_for_updates(self, collector, version, max_wait_seconds=0):
+        """Function that calls WaitForUpdatesEx on a property collector
+
+        Args:
+            collector: The mor of the property collector
+            version: The version returned by the previous call, empty for the initial full update
+            max_wait_seconds: How long the server waits for a change, 0 just checks for updates
+
+        Return:
+            The UpdateSet object, None if nothing changed within max_wait_seconds
+        """
+
+        request = VI.WaitForUpdatesExRequestMsg()
+        _this = request.new__this(collector)
+        _this.set_attribute_type(MORTypes.PropertyCollector)
+        request.set_element__this(_this)
+        request.set_element_version(version)
+
+        options = request.new_options()
+        options.set_element_maxWaitSeconds(max_wait_seconds)
+        request.set_element_options(options)
+
+        return self._vs_server._proxy.WaitForUpdatesEx(request)._returnval
+
+    def _collect_updates(self, collector, version):
+        """Function that gets all the pending updates of a property collector, without waiting.
+        The server truncates big update sets, keep asking until all of them are in.
+
+        Args:
+            collector: The mor of the property collector
+            version: The version to get the updates since
+
+        Return:
+            The list of UpdateSet objects and the new version
+        """
+
+        update_sets = []
+        while True:
+            update_set = self._wait_for_updates(collector, version)
+            if not update_set:
+                break
+            update_sets.append(update_set)
+            version = update_set.Version
+            if not getattr(update_set, "Truncated", False):
+                break
+
+        return update_sets, version
+
+    def _build_inventory_index(self, config):
+        """Function that builds the ip and hostname to vm index with one bulk pass over the inventory.
+        Only the datacenter and the mor are indexed, the vm properties are fetched live on a hit.
+
+        Args:
+            config: The json object containing config
+
+        Return:
+            The index dictionary
+        """
+
+        self.save_progress(VSPHERE_PROG_BUILDING_INDEX)
+
+        index = {
+            VSPHERE_CONST_INDEX_SERVER: config[phantom.APP_JSON_SERVER],
+            VSPHERE_CONST_INDEX_TIMESTAMP: int(time.time()),
+            VSPHERE_CONST_INDEX_TOTAL_VMS: 0,
+            VSPHERE_CONST_INDEX_IPS: {},
+            VSPHERE_CONST_INDEX_HOSTNAMES: {},
+        }
+
+        datacenter_vms, failed = self._retrieve_datacenters_vms()
+        if failed and not datacenter_vms:
+            raise next(iter(failed.values()))
+
+        index[VSPHERE_CONST_INDEX_FAILED_DATACENTERS] = list(failed)
+
+        for datacenter, vm_list in datacenter_vms:
+            index[VSPHERE_CONST_INDEX_TOTAL_VMS] += len(vm_list)
+
+            for vm_props in vm_list:
+                entry = [datacenter, vm_props[VSPHERE_CONST_VM_MOR]]
+
+                # the first vm found wins, like the linear search used to
+                ip = vm_props.get(VSPHERE_CONST_PROP_IP)
+                if ip:
+                    index[VSPHERE_CONST_INDEX_IPS].setdefault(ip, entry)
+
+                hostname = vm_props.get(VSPHERE_CONST_PROP_HOSTNAME)
+                if hostname:
+                    index[VSPHERE_CONST_INDEX_HOSTNAMES].setdefault(hostname, entry)
+
+        self._index_refreshed = True
+
+        # a ttl of 0 disables the caching of the index across runs, a partial one is rebuilt by the next run
+        if self._index_ttl and not failed:
+            self._state.setdefault(VSPHERE_CONST_STATE_INVENTORY_INDEXES, {})[config[phantom.APP_JSON_SERVER]] = index
+
+        return index
+
+    def _get_inventory_index(self, config):
+        """Function that returns the ip and hostname index from the state, building it if expired
+
+        Args:
+            config: The json object containing config
+
+        Return:
+            The index dictionary
+        """
+
+        index = self._state.get(VSPHERE_CONST_STATE_INVENTORY_INDEXES, {}).get(config[phantom.APP_JSON_SERVER])
+
+        if (
+            isinstance(index, dict)
+            and index.get(VSPHERE_CONST_INDEX_SERVER) == config[phantom.APP_JSON_SERVER]
+            and (time.time() - index.get(VSPHERE_CONST_INDEX_TIMESTAMP, 0)) < self._index_ttl
+        ):
+            return index
+
+        return self._build_inventory_index(config)
+
+    def _lookup_inventory_index(self, index, ip_hostname):
+        """Function that looks up a vm in the index and verifies it against its live properties
+
+        Args:
+            index: The index dictionary
+            ip_hostname: The ip or hostname to look for
+
+        Return:
+            The datacenter and the vm properties, (None, None) if not found
+        """
+
+        entry = index[VSPHERE_CONST_INDEX_IPS].get(ip_hostname) or index[VSPHERE_CONST_INDEX_HOSTNAMES].get(ip_hostname)
+        if not entry:
+            return None, None
+
+        datacenter, vm_mor = entry
+
+        vm_props = self._get_vm_properties(vm_mor)
+        if not vm_props:
+            return None, None
+
+        # the guest could have been given another ip or hostname since the index was built
+        if ip_hostname not in (vm_props.get(VSPHERE_CONST_PROP_IP), vm_props.get(VSPHERE_CONST_PROP_HOSTNAME)):
+            return None, None
+
+        return datacenter, vm_props
+
+    def _create_vm_data(self, datacenter, vm_props):
+        """Function that creates the action data of a vm from its bulk fetched properties
+
+        Args:
+            datacenter: The name of the datacenter the vm belongs to
+            vm_props: The dictionary of vm properties returned by _retrieve_datacenters_vms
+
+        Return:
+            The data dictionary
+        """
+
+        curr_data = {}
+        curr_data[VSPHERE_JSON_VMX_PATH] = f"[{datacenter}]" + vm_props[VSPHERE_CONST_PROP_VMX_PATH]
+        curr_data[phantom.APP_JSON_IP] = vm_props.get(VSPHERE_CONST_PROP_IP)
+        curr_data[VSPHERE_JSON_GUEST_NAME] = vm_props.get(VSPHERE_CONST_PROP_NAME)
+        curr_data[VSPHERE_JSON_GUEST_HOST_NAME] = vm_props.get(VSPHERE_CONST_PROP_HOSTNAME)
+        curr_data[VSPHERE_JSON_GUEST_FULL_NAME] = vm_props.get(VSPHERE_CONST_PROP_FULL_NAME)
+
+        # a pending question blocks the vm, pysphere does not report it as powered on either
+        if (vm_props.get(VSPHERE_CONST_PROP_POWER_STATE) == VSPHERE_CONST_POWERED_ON) and (VSPHERE_CONST_PROP_QUESTION not in vm_props):
+            curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_RUNNING
+        else:
+            curr_data[phantom.APP_JSON_STATE] = VSPHERE_CONST_VM_STATE_NOT_RUNNING
+
+        return curr_data
+
+    def _create_server_connector(self, cancel):
+        """Function that creates a copy of the connector to run an inventory action on one of the servers of the asset,
+        in a worker thread. The copy has a vsphere server object, datacenters, http session and per server entries of
+        the state of its own, see _merge_server_state, its progress is queued for the thread of the action run.
+        It must not add action results.
+
+        Args:
+            cancel: The threading.Event that stops the inventory of the server once set
+
+        Return:
+            The copy of the connector
+        """
+
+        connector = copy.copy(self)
+        connector._vs_server = VIServer()
+        connector._datacenters = list()
+        connector._datacenter_mors = dict()
+        connector._server_pool = None
+        connector._index_refreshed = False
+        connector._cancel = cancel
+        connector._session = self._create_http_session()
+        connector._state = dict(self._state, **{key: dict(self._state.get(key, {})) for key in VSPHERE_CONST_STATE_SERVER_KEYS})
+
+        return connector
+
+    def _merge_server_state(self, server, connector):
+        """Function that copies the entries of a server from the state of its copy of the connector to the state
+        of the action run, once the copy is done with it
+
+        Args:
+            server: The server of the copy
+            connector: The copy of the connector, see _create_server_connector
+        """
+
+        for key in VSPHERE_CONST_STATE_SERVER_KEYS:
+            entry = connector._state.get(key, {}).get(server)
+            if entry is None:
+                self._state.get(key, {}).pop(server, None)
+            else:
+                self._state.setdefault(key, {})[server] = entry
+
+    def _fan_out_servers(self, config, run, stop=None):
+        """Function that runs an inventory function on all the servers of the asset at the same time, each on a copy
+        of the connector connected to it
+
+        Args:
+            config: The json object containing config
+            run: The function to call with the copy of the connector and the config of the server, in a worker thread
+            stop: The function to call with the result of a server, returns True when the other servers are not needed
+                anymore, their inventory is then stopped at the next page of vms
+
+        Return:
+            A list of (server, result) tuples, in the order of the servers, and a dictionary of the servers
+            that failed to their error, the servers that were stopped are in neither
+        """
+
+        cancel = threading.Event()
+        connectors = {server: self._create_server_connector(cancel) for server in self._servers}
+
+        def call(server):
+            connector = connectors[server]
+            server_config = dict(config, **{phantom.APP_JSON_SERVER: server})
+
+            try:
+                if phantom.is_fail(connector._connect_to_server(server_config)):
+                    raise Exception(connector.get_status_message())
+
+                return run(connector, server_config)
+            finally:
+                if connector._server_pool:
+                    connector._server_pool.close()
+                if not self._reuse_session:
+                    try:
+                        connector._vs_server.disconnect()
+                    except Exception as e:
+                        self.debug_print(f"Unable to disconnect from {server}", e)
+                connector._session.close()
+
+        results = {}
+        failed = {}
+
+        executor = ThreadPoolExecutor(max_workers=min(len(self._servers), VSPHERE_CONST_MAX_SERVER_WORKERS))
+        futures = {executor.submit(call, server): server for server in self._servers}
+
+        try:
+            pending = set(futures)
+            stopped = False
+            while pending and not stopped:
+                done, pending = wait(pending, timeout=VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                self._flush_progress()
+
+                for future in done:
+                    server = futures[future]
+                    try:
+                        results[server] = future.result()
+                    except CancelledError:
+                        continue
+                    except Exception as e:
+                        self.debug_print(f"The inventory of server {server} failed", e)
+                        failed[server] = e
+                        continue
+
+                    if stop and stop(results[server]):
+                        stopped = True
+                        break
+        finally:
+            # the workers still running stop at their next page of vms and log out of their server, they are waited
+            # for a bounded time, a worker stuck in a call is left to finish in the background
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            done, running = wait(futures, timeout=VSPHERE_CONST_SERVER_STOP_TIMEOUT)
+            self._flush_progress()
+            if running:
+                self.debug_print(f"The inventory of servers {', '.join(futures[x] for x in running)} did not stop in time")
+
+            # a worker left running keeps its copy of the state to itself
+            for future in done:
+                self._merge_server_state(futures[future], connectors[futures[future]])
+
+        return [(server, results[server]) for server in self._servers if server in results], failed
+
+    def _search_server_inventory(self, config, ip_hostname):
+        """Function that looks for a vm by ip or hostname in the inventory index of the server
+
+        Args:
+            config: The json object containing config
+            ip_hostname: The ip or hostname to look for
+
+        Return:
+            The datacenter and the vm properties ((None, None) if not found) and the index
+        """
+
+        index = self._get_inventory_index(config)
+        datacenter, vm_props = self._lookup_inventory_index(index, ip_hostname)
+
+        # a miss on an index from an earlier run could be a new or changed vm, refresh it once.
+        # Do not rebuild an index that was built moments ago, the endpoint is most probably not a vm
+        if (
+            (vm_props is None)
+            and (not self._index_refreshed)
+            and ((time.time() - index[VSPHERE_CONST_INDEX_TIMESTAMP]) > VSPHERE_CONST_INDEX_MIN_REFRESH_INTERVAL)
+        ):
+            index = self._build_inventory_index(config)
+            datacenter, vm_props = self._lookup_inventory_index(index, ip_hostname)
+
+        return datacenter, vm_props, index
+
+    def _get_failed_datacenters(self, server, datacenters):
+        """Function that returns the names of the failed datacenters of a server for the summary,
+        prefixed with the server when the asset has several
+
+        Args:
+            server: The server of the datacenters
+            datacenters: The list of the names of the failed datacenters
+
+        Return:
+            The list of names
+        """
+
+        if len(self._servers) > 1:
+            return [f"{server}/{x}" for x in datacenters]
+
+        return list(datacenters)
+
+    def _get_system_info(self, config, param):
+        # Add the action result
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ip_hostname = param[VSPHERE_JSON_IP_HOSTNAME]
+
+        # the first server that finds the vm stops the search on the others
+        results, failed = self._fan_out_servers(
+            config,
+            lambda connector, server_config: connector._search_server_inventory(server_config, ip_hostname),
+            stop=lambda result: result[1] is not None,
+        )
+
+        if not results:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SEARCH_INVENTORY, next(iter(failed.values()), None))
+
+        total_vms = 0
+        matched = False
+        failed_datacenters = []
+
+        for server, (datacenter, vm_props, index) in results:
+            total_vms += index[VSPHERE_CONST_INDEX_TOTAL_VMS]
+            failed_datacenters.extend(self._get_failed_datacenters(server, index.get(VSPHERE_CONST_INDEX_FAILED_DATACENTERS) or []))
+
+            if (vm_props is not None) and (not matched):
+                matched = True
+                curr_data = self._create_vm_data(datacenter, vm_props)
+                curr_data[phantom.APP_JSON_SERVER] = server
+                action_result.add_data(curr_data)
+
+        # update the summary value about the total guests
+        action_result.update_summary({"total_vms_searched": total_vms})
+        action_result.update_summary({"found_endpoint": matched})
+
+        if failed_datacenters:
+            action_result.update_summary({VSPHERE_JSON_FAILED_DATACENTERS: failed_datacenters})
+        if failed:
+            action_result.update_summary({VSPHERE_JSON_FAILED_SERVERS: list(failed)})
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _list_server_vms(self, action, config):
+        """Function that fetches the vms of all the datacenters of the server for ACTION_ID_GET_REGISTERED_GUESTS
+        and ACTION_ID_GET_RUNNING_GUESTS
+
+        Args:
+            action: The action identifier
+            config: The json object containing config
+
+        Return:
+            The list of data dictionaries of the vms, the number of datacenters listed and the list of the names
+            of the datacenters that failed, raises the error of a datacenter if none could be listed
+        """
+
+        # fetch the properties of all the vms of each datacenter in one go
+        datacenter_vms, failed = self._retrieve_datacenters_vms()
+        if failed and not datacenter_vms:
+            datacenter, error = next(iter(failed.items()))
+            raise Exception(f"{VSPHERE_ERR_GET_VMS.format(datacenter=datacenter)}: {error}")
+
+        vms = []
+        for datacenter, vm_list in datacenter_vms:
+            if action == self.ACTION_ID_GET_RUNNING_GUESTS:
+                vm_list = [x for x in vm_list if x.get(VSPHERE_CONST_PROP_POWER_STATE) == VSPHERE_CONST_POWERED_ON]
+
+            for vm_props in vm_list:
+                curr_data = self._create_vm_data(datacenter, vm_props)
+                curr_data[phantom.APP_JSON_SERVER] = config[phantom.APP_JSON_SERVER]
+                vms.append(curr_data)
+
+        return vms, len(datacenter_vms), list(failed)
+
+    def _get_vms(self, action, config, param):
+        """Function that handles ACTION_ID_GET_REGISTERED_GUESTS and
+        ACTION_ID_GET_RUNNING_GUESTS
+
+         Args:
+
+         Return:
+             A status code
+        """
+
+        if param.get(VSPHERE_JSON_DELTA, False):
+            if len(self._servers) > 1:
+                return self.set_status(phantom.APP_ERROR, VSPHERE_ERR_DELTA_SERVERS)
+
+            # Connect to the server
+            status_code = self._connect_to_server(config)
+
+            if phantom.is_fail(status_code):
+                return status_code
+
+        # Add the action result
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        if param.get(VSPHERE_JSON_DELTA, False):
+            return self._get_vms_delta(action, config, param, action_result)
+
+        results, failed = self._fan_out_servers(config, lambda connector, server_config: connector._list_server_vms(action, server_config))
+
+        if not results:
+            if (len(self._servers) == 1) and failed:
+                return action_result.set_status(phantom.APP_ERROR, str(next(iter(failed.values()))))
+            return action_result.set_status(
+                phantom.APP_ERROR, VSPHERE_ERR_SERVERS_FAILED.format(servers="; ".join(f"{k}: {v}" for k, v in failed.items()))
+            )
+
+        total_vms = 0
+        total_running = 0
+        total_datacenters = 0
+        failed_datacenters = []
+
+        for server, (vms, listed_datacenters, server_failed_datacenters) in results:
+            total_vms += len(vms)
+            total_datacenters += listed_datacenters
+            failed_datacenters.extend(self._get_failed_datacenters(server, server_failed_datacenters))
+
+            for curr_data in vms:
+                action_result.add_data(curr_data)
+
+                if curr_data[phantom.APP_JSON_STATE] == VSPHERE_CONST_VM_STATE_RUNNING:
+                    total_running += 1
+
+        # update the summary value about the total guests
+        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS: total_vms})
+        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS_RUNNING: total_running})
+
+        messages = []
+        if failed_datacenters:
+            action_result.update_summary({VSPHERE_JSON_FAILED_DATACENTERS: failed_datacenters})
+            messages.append(
+                VSPHERE_SUCC_PARTIAL_DATACENTERS.format(
+                    succeeded=total_datacenters, total=total_datacenters + len(failed_datacenters), datacenters=", ".join(failed_datacenters)
+                )
+            )
+        if failed:
+            action_result.update_summary({VSPHERE_JSON_FAILED_SERVERS: list(failed)})
+            messages.append(VSPHERE_SUCC_PARTIAL_SERVERS.format(succeeded=len(results), total=len(self._servers), servers=", ".join(failed)))
+
+        if messages:
+            return action_result.set_status(phantom.APP_SUCCESS, ". ".join(messages))
+
+        action_result.set_status(phantom.APP_SUCCESS)
+
+    def _start_vms_delta(self, config):
+        """Function that sets up the property collector used by the delta mode of list vms.
+        A filter over a container view of the vms is created per datacenter, so that the datacenter
+        of a vm can be told from the filter that reported it. The collector and the views of the
+        previous delta are destroyed first, they would live on in the session otherwise.
+
+        Args:
+            config: The json object containing config
+
+        Return:
+            The delta dictionary that is kept in the state
+        """
+
+        old_delta = self._state.get(VSPHERE_CONST_STATE_VMS_DELTA)
+        if isinstance(old_delta, dict):
+            self._destroy_vms_delta(old_delta)
+
+        collector = self._create_property_collector()
+
+        filters = {}
+        views = []
+        try:
+            for datacenter in self._datacenters:
+                view = self._create_container_view(self._datacenter_mors[datacenter], MORTypes.VirtualMachine)
+                views.append(str(view))
+                vm_filter = self._create_filter(collector, view, MORTypes.VirtualMachine, VSPHERE_CONST_VM_PROPERTIES, container_view=True)
+                filters[str(vm_filter)] = datacenter
+        except Exception:
+            self._destroy_vms_delta({VSPHERE_CONST_DELTA_COLLECTOR: str(collector), VSPHERE_CONST_DELTA_VIEWS: views})
+            raise
+
+        return {
+            VSPHERE_CONST_DELTA_SERVER: config[phantom.APP_JSON_SERVER],
+            VSPHERE_CONST_DELTA_COLLECTOR: str(collector),
+            VSPHERE_CONST_DELTA_FILTERS: filters,
+            VSPHERE_CONST_DELTA_VIEWS: views,
+            VSPHERE_CONST_DELTA_VERSION: "",
+            VSPHERE_CONST_DELTA_VMS: {},
+        }
+
+    def _destroy_vms_delta(self, delta):
+        """Function that destroys the property collector and the container views of a delta, errors are ignored
+
+        Args:
+            delta: The delta dictionary
+        """
+
+        for view in delta.get(VSPHERE_CONST_DELTA_VIEWS) or []:
+            self._destroy_view(VIMor(view, MORTypes.ContainerView))
+
+        if delta.get(VSPHERE_CONST_DELTA_COLLECTOR):
+            self._destroy_property_collector(VIMor(delta[VSPHERE_CONST_DELTA_COLLECTOR], MORTypes.PropertyCollector))
+
+    def _get_vms_delta(self, action, config, param, action_result):
+        """Function that handles the delta mode of ACTION_ID_GET_REGISTERED_GUESTS.
+        The property collector created by an earlier run is asked for the changes since the version
+        kept in the state. The collector lives in the server session, so the delta needs the session
+        to be reused, a full resync is done whenever the collector or the version is not valid anymore.
+        A full resync lists the whole inventory again, which is diffed against the vms known before it,
+        so that the vms added, changed and removed in between are still reported as such.
+
+        Args:
+            action: The action identifier
+            config: The json object containing config
+            param: The action parameters
+            action_result: The ActionResult object to add the vms to
+
+        Return:
+            A status code
+        """
+
+        full_resync = param.get(VSPHERE_JSON_FULL_RESYNC, False)
+        delta = self._state.get(VSPHERE_CONST_STATE_VMS_DELTA)
+
+        if (
+            (not isinstance(delta, dict))
+            or (delta.get(VSPHERE_CONST_DELTA_SERVER) != config[phantom.APP_JSON_SERVER])
+            or (not delta.get(VSPHERE_CONST_DELTA_VERSION))
+            # a datacenter was added or removed since the filters were created
+            or (sorted((delta.get(VSPHERE_CONST_DELTA_FILTERS) or {}).values()) != sorted(self._datacenters))
+        ):
+            full_resync = True
+
+        if not full_resync:
+            try:
+                collector = VIMor(delta[VSPHERE_CONST_DELTA_COLLECTOR], MORTypes.PropertyCollector)
+                update_sets, version = self._collect_updates(collector, delta[VSPHERE_CONST_DELTA_VERSION])
+            except Exception as e:
+                # InvalidCollectorVersion or ManagedObjectNotFound once the session that owned it is gone
+                self.debug_print("Unable to get the updates since the last run, doing a full resync", e)
+                self.save_progress(VSPHERE_PROG_FULL_RESYNC)
+                full_resync = True
+
+        # the vms known before a full resync, with the digests of their data
+        previous_vms = None
+        if full_resync:
+            previous_vms = {}
+            if isinstance(delta, dict) and (delta.get(VSPHERE_CONST_DELTA_SERVER) == config[phantom.APP_JSON_SERVER]):
+                previous_vms = dict(delta.get(VSPHERE_CONST_DELTA_VMS) or {})
+
+            try:
+                delta = self._start_vms_delta(config)
+                collector = VIMor(delta[VSPHERE_CONST_DELTA_COLLECTOR], MORTypes.PropertyCollector)
+                update_sets, version = self._collect_updates(collector, "")
+            except Exception as e:
+                # the vms known before are kept, for the next resync to diff against
+                self._state[VSPHERE_CONST_STATE_VMS_DELTA] = {
+                    VSPHERE_CONST_DELTA_SERVER: config[phantom.APP_JSON_SERVER],
+                    VSPHERE_CONST_DELTA_VMS: previous_vms,
+                }
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_GET_VMS_DELTA, e)
+
+        # path and data digest of the vms seen so far, needed to report the vms that have been removed
+        known_vms = delta[VSPHERE_CONST_DELTA_VMS]
+        filters = delta[VSPHERE_CONST_DELTA_FILTERS]
+
+        changes = []
+        for update_set in update_sets:
+            for filter_update in getattr(update_set, "FilterSet", None) or []:
+                datacenter = filters.get(str(filter_update.Filter))
+                for object_update in getattr(filter_update, "ObjectSet", None) or []:
+                    vm_props = {}
+                    for change in getattr(object_update, "ChangeSet", None) or []:
+                        if hasattr(change, "Val"):
+                            vm_props[change.Name] = change.Val
+                    vm_props[VSPHERE_CONST_VM_MOR] = str(object_update.Obj)
+                    changes.append((str(object_update.Kind), datacenter, vm_props))
+
+        # a modify only carries the properties that changed, get all of them in one go
+        modified_mors = [VIMor(props[VSPHERE_CONST_VM_MOR], MORTypes.VirtualMachine) for kind, _, props in changes if kind == "modify"]
+        modified_props = {}
+        if modified_mors:
+            try:
+                obj_contents = self._vs_server._get_object_properties_bulk(
+                    modified_mors, {MORTypes.VirtualMachine: list(VSPHERE_CONST_VM_PROPERTIES)}
+                )
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_GET_VMS_DELTA, e)
+            for obj_content in obj_contents or []:
+                modified_props[str(obj_content.Obj)] = {prop.Name: prop.Val for prop in getattr(obj_content, "PropSet", None) or []}
+
+        change_types = {"enter": VSPHERE_CONST_CHANGE_ADDED, "modify": VSPHERE_CONST_CHANGE_MODIFIED, "leave": VSPHERE_CONST_CHANGE_REMOVED}
+        total_vms = 0
+        total_running = 0
+
+        for kind, datacenter, vm_props in changes:
+            vm_mor = vm_props[VSPHERE_CONST_VM_MOR]
+
+            if kind == "leave":
+                vmx_path, _ = self._get_known_vm(known_vms.pop(vm_mor, None))
+                if not vmx_path:
+                    continue
+                curr_data = {VSPHERE_JSON_VMX_PATH: vmx_path}
+                change_type = VSPHERE_CONST_CHANGE_REMOVED
+            else:
+                if kind == "modify":
+                    vm_props.update(modified_props.get(vm_mor, {}))
+
+                if not vm_props.get(VSPHERE_CONST_PROP_VMX_PATH):
+                    continue
+
+                if (action == self.ACTION_ID_GET_RUNNING_GUESTS) and (vm_props.get(VSPHERE_CONST_PROP_POWER_STATE) != VSPHERE_CONST_POWERED_ON):
+                    continue
+
+                curr_data = self._create_vm_data(datacenter, vm_props)
+                digest = self._get_vm_data_digest(curr_data)
+                known_vms[vm_mor] = [curr_data[VSPHERE_JSON_VMX_PATH], digest]
+                change_type = change_types.get(kind, kind)
+
+                # a resync lists every vm, only the ones that changed since the last run are reported as such
+                if (previous_vms is not None) and (vm_mor in previous_vms):
+                    _, previous_digest = self._get_known_vm(previous_vms.pop(vm_mor))
+                    change_type = VSPHERE_CONST_CHANGE_UNCHANGED if (previous_digest == digest) else VSPHERE_CONST_CHANGE_MODIFIED
+                    if (change_type == VSPHERE_CONST_CHANGE_UNCHANGED) and (not param.get(VSPHERE_JSON_FULL_RESYNC, False)):
+                        continue
+
+                if curr_data[phantom.APP_JSON_STATE] == VSPHERE_CONST_VM_STATE_RUNNING:
+                    total_running += 1
+
+            curr_data[VSPHERE_JSON_CHANGE_TYPE] = change_type
+            action_result.add_data(curr_data)
+            total_vms += 1
+
+        # the vms known before the resync that it did not list anymore were removed in between
+        for vm_mor, known_vm in (previous_vms or {}).items():
+            vmx_path, _ = self._get_known_vm(known_vm)
+            if vmx_path:
+                action_result.add_data({VSPHERE_JSON_VMX_PATH: vmx_path, VSPHERE_JSON_CHANGE_TYPE: VSPHERE_CONST_CHANGE_REMOVED})
+                total_vms += 1
+
+        delta[VSPHERE_CONST_DELTA_VERSION] = version
+        self._state[VSPHERE_CONST_STATE_VMS_DELTA] = delta
+
+        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS: total_vms})
+        action_result.update_summary({VSPHERE_JSON_TOTAL_GUESTS_RUNNING: total_running})
+        action_result.update_summary({VSPHERE_JSON_FULL_RESYNC: full_resync})
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _get_vm_data_digest(self, curr_data):
+        """Function that returns a digest of the data of a vm, to tell whether it changed between two listings
+
+        Args:
+            curr_data: The data dictionary of the vm
+
+        Return:
+            The hex digest
+        """
+
+        return hashlib.sha256(json.dumps(curr_data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _get_known_vm(self, known_vm):
+        """Function that returns the vmx path and the data digest of a vm of the delta state,
+        the state of older versions only holds the vmx path
+
+        Args:
+            known_vm: The value of the vm in the delta state, None if the vm is not known
+
+        Return:
+            The vmx path and the digest, None for the ones that are not known
+        """
+
+        if isinstance(known_vm, list) and len(known_vm) == 2:
+            return known_vm[0], known_vm[1]
+
+        return known_vm, None
+
+    def _list_vms(self, action, config, param):
+        """Function that handles ACTION_ID_GET_REGISTERED_GUESTS
+        Args:
+
+        Return:
+            A status code
+        """
+        return self._get_vms(action, config, param)
+
+    def _wait_for_async_task(self, task, action, action_result):
+        """Function that asynchronously manages the task object
+
+        Args:
+            task: The task object to monitor.
+            action: The action that is currently being carried out.
+            action_result: The ActionResult object to hold the status
+
+        Return:
+            A status code of the type phantom.APP_[SUCC|ERR]_XXX.
+        """
+
+        status = self._wait_for_tasks([task], action)[0]
+
+        if status == VITask.STATE_ERROR:
+            action_result.set_status(phantom.APP_ERROR, phantom.APP_ERR_CMD_EXEC)
+            action_result.append_to_message(task.get_error_message())
+        elif status == VITask.STATE_SUCCESS:
+            action_result.set_status(phantom.APP_SUCCESS, phantom.APP_SUCC_CMD_EXEC)
+        else:
+            action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_TASK_TIMED_OUT, timeout=self._task_timeout)
+
+        return action_result.get_status()
+
+    def _wait_for_tasks(self, tasks, action):
+        """Function that waits for tasks to finish, or for the task timeout of the asset to expire.
+        The tasks are watched through a property collector, so the server reports the changes as soon
+        as they happen. Polling is used if the server does not support it.
+
+        Args:
+            tasks: The list of task objects to monitor
+            action: The action that is currently being carried out
+
+        Return:
+            The list of the final states of the tasks, None for the ones that did not finish in time
+        """
+
+        deadline = (time.time() + self._task_timeout) if self._task_timeout else None
+        progress = {"task_name": action.replace("_", " "), "displayed_once": False}
+        states = [None] * len(tasks)
+
+        try:
+            self._wait_for_task_updates(tasks, deadline, states, progress)
+        except Exception as e:
+            self.debug_print("Unable to monitor the tasks through a property collector, polling them", e)
+            self._poll_tasks(tasks, deadline, states, progress)
+
+        return [x if x in (VITask.STATE_SUCCESS, VITask.STATE_ERROR) else None for x in states]
+
+    def _wait_for_task_updates(self, tasks, deadline, states, progress):
+        """Function that waits for tasks to finish with WaitForUpdatesEx on a filter over their info
+
+        Args:
+            tasks: The list of task objects to monitor
+            deadline: The time at which to stop waiting, None to wait indefinitely
+            states: The list of the task states, updated in place
+            progress: The dictionary holding the progress display state
+        """
+
+        collector = self._create_property_collector()
+
+        try:
+            self._create_filter(collector, [x._mor for x in tasks], MORTypes.Task, VSPHERE_CONST_TASK_PROPERTIES)
+
+            task_index = {str(x._mor): i for i, x in enumerate(tasks)}
+            percents = [None] * len(tasks)
+            version = ""
+
+            while not self._tasks_finished(states):
+                max_wait = VSPHERE_CONST_TASK_MAX_WAIT
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    max_wait = max(1, min(max_wait, int(remaining)))
+
+                update_set = self._wait_for_updates(collector, version, max_wait)
+                if not update_set:
+                    continue
+
+                version = update_set.Version
+                for filter_update in getattr(update_set, "FilterSet", None) or []:
+                    for object_update in getattr(filter_update, "ObjectSet", None) or []:
+                        i = task_index.get(str(object_update.Obj))
+                        if i is None:
+                            continue
+                        for change in getattr(object_update, "ChangeSet", None) or []:
+                            if change.Name == VSPHERE_CONST_TASK_PROP_STATE:
+                                states[i] = getattr(change, "Val", None)
+                            elif change.Name == VSPHERE_CONST_TASK_PROP_PROGRESS:
+                                percents[i] = getattr(change, "Val", None)
+
+                self._send_tasks_progress(states, percents, progress)
+        finally:
+            self._destroy_property_collector(collector)
+
+    def _poll_tasks(self, tasks, deadline, states, progress):
+        """Function that polls the state of tasks, starting with a short interval that grows
+        while the tasks are running, so that quick tasks are not delayed by a fixed sleep
+
+        Args:
+            tasks: The list of task objects to monitor
+            deadline: The time at which to stop waiting, None to wait indefinitely
+            states: The list of the task states, updated in place
+            progress: The dictionary holding the progress display state
+        """
+
+        interval = VSPHERE_CONST_TASK_POLL_MIN_INTERVAL
+        percents = [None] * len(tasks)
+
+        while True:
+            for i, task in enumerate(tasks):
+                if states[i] in (VITask.STATE_SUCCESS, VITask.STATE_ERROR):
+                    continue
+                # get_state refreshes task.info, progress comes with it
+                states[i] = task.get_state()
+                percents[i] = getattr(task.info, "progress", None)
+
+            self._send_tasks_progress(states, percents, progress)
+
+            if self._tasks_finished(states):
+                break
+
+            if deadline and ((time.time() + interval) > deadline):
+                break
+
+            time.sleep(interval)
+            interval = min(interval * 2, VSPHERE_CONST_TASK_POLL_MAX_INTERVAL)
+
+    def _tasks_finished(self, states):
+        return all(x in (VITask.STATE_SUCCESS, VITask.STATE_ERROR) for x in states)
+
+    def _send_tasks_progress(self, states, percents, progress):
+        """Function that sends the progress of the tasks being waited on
+
+        Args:
+            states: The list of the task states
+            percents: The list of the task progress percentages
+            progress: The dictionary holding the progress display state
+        """
+
+        if len(states) > 1:
+            finished = len([x for x in states if x in (VITask.STATE_SUCCESS, VITask.STATE_ERROR)])
+            self.send_progress(VSPHERE_PROG_TASKS_COMPLETED, finished=finished, total=len(states))
+            return
+
+        status = states[0]
+        if status == VITask.STATE_QUEUED:
+            self.send_progress(VSPHERE_PROG_TASK_QUEUED)
+        elif status == VITask.STATE_RUNNING:
+            if percents[0]:
+                self.send_progress(VSPHERE_PROG_TASK_COMPLETED_PERCENT, task_name=progress["task_name"], progress=percents[0])
+            elif not progress["displayed_once"]:
+                self.send_progress(VSPHERE_PROG_TASK_RUNNING)
+                progress["displayed_once"] = True
+
+    def _parse_vm_path(self, full_vmx_path):
+        # The full_vmx_path will be of the format
+        # [datacenter_name][datastore_name] <vm_folder>.<vmname>.vmx
+        # for e.g. [Datacenter][DAS_labesxi1_1] OpenVAS/OpenVAS.vmx
+
+        search = re.search(r"\[(.*)\](\[.*)", full_vmx_path)
+        if not search:
+            return VSPHERE_CONST_DEFAULT_DATACENTER, full_vmx_path
+
+        datacenter = search.group(1)
+        vmx_path = search.group(2)
+
+        return datacenter, vmx_path
+
+    def _get_cached_vm_mor(self, vmx_path, datacenter):
+        """Function that returns the mor of the vm of a vmx path from the vm cache of the state
+
+        Args:
+            vmx_path: The vmx path of the vm, without the datacenter
+            datacenter: The name of the datacenter
+
+        Return:
+            The managed object reference id of the vm, None if it is not cached or the entry expired
+        """
+
+        entry = self._state.get(VSPHERE_CONST_STATE_VM_CACHE, {}).get(f"[{datacenter}]{vmx_path}")
+
+        if isinstance(entry, dict) and ((time.time() - entry.get(VSPHERE_CONST_VM_CACHE_TIMESTAMP, 0)) < VSPHERE_CONST_VM_CACHE_TTL):
+            return entry.get(VSPHERE_CONST_VM_CACHE_VM)
+
+        return None
+
+    def _find_vm_mor(self, vmx_path, datacenter):
+        """Function that looks up the mor of the vm of a vmx path in the search index of the datacenter, without
+        creating the vm object, and caches it in the state
+
+        Args:
+            vmx_path: The vmx path of the vm, without the datacenter
+            datacenter: The name of the datacenter
+
+        Return:
+            The managed object reference id of the vm, raises an exception if the vm can't be found
+        """
+
+        # passing the datacenter mor saves a lookup of all the datacenters
+        datacenter_mor = self._datacenter_mors.get(datacenter)
+        if datacenter_mor:
+            datacenter_mors = [datacenter_mor]
+        else:
+            datacenter_mors = [k for k, v in self._vs_server.get_datacenters().items() if v == datacenter]
+
+        vm_mor = None
+        for mor in datacenter_mors:
+            request = VI.FindByDatastorePathRequestMsg()
+            _this = request.new__this(self._vs_server._do_service_content.SearchIndex)
+            _this.set_attribute_type(MORTypes.SearchIndex)
+            request.set_element__this(_this)
+            mor_datacenter = request.new_datacenter(mor)
+            mor_datacenter.set_attribute_type(MORTypes.Datacenter)
+            request.set_element_datacenter(mor_datacenter)
+            request.set_element_path(vmx_path)
+
+            try:
+                vm_mor = self._vs_server._proxy.FindByDatastorePath(request)._returnval
+            except VI.ZSI.FaultException as e:
+                self.debug_print(f"Unable to search datacenter {mor} for {vmx_path}", e)
+                continue
+
+            if vm_mor:
+                break
+
+        if not vm_mor:
+            raise VIException(f"Could not find a VM with path '{vmx_path}'", FaultTypes.OBJECT_NOT_FOUND)
+
+        # drop the expired entries while at it, so that the state does not keep growing
+        vm_cache = self._state.setdefault(VSPHERE_CONST_STATE_VM_CACHE, {})
+        now = time.time()
+        for k in [k for k, v in vm_cache.items() if (now - v.get(VSPHERE_CONST_VM_CACHE_TIMESTAMP, 0)) >= VSPHERE_CONST_VM_CACHE_TTL]:
+            vm_cache.pop(k, None)
+
+        vm_cache[f"[{datacenter}]{vmx_path}"] = {
+            VSPHERE_CONST_VM_CACHE_VM: str(vm_mor),
+            VSPHERE_CONST_VM_CACHE_DATACENTER: str(datacenter_mor) if datacenter_mor else None,
+            VSPHERE_CONST_VM_CACHE_TIMESTAMP: int(now),
+        }
+
+        return str(vm_mor)
+
+    def _get_vm_by_path(self, vmx_path, datacenter):
+        """Function that returns the vm object of a vmx path.
+        The vm and datacenter mors are cached in the state, so that the inventory search done by
+        pysphere's get_vm_by_path is skipped on the next runs. Creating the vm object from a
+        cached mor fetches its properties, a stale mor fails there and the vm is searched again.
+
+        Args:
+            vmx_path: The vmx path of the vm, without the datacenter
+            datacenter: The name of the datacenter
+
+        Return:
+            The pysphere vm object, raises an exception if the vm can't be found
+        """
+
+        key = f"[{datacenter}]{vmx_path}"
+        vm_mor = self._get_cached_vm_mor(vmx_path, datacenter)
+
+        if vm_mor:
+            try:
+                vm = VIVirtualMachine(self._vs_server, VIMor(vm_mor, MORTypes.VirtualMachine))
+                if vm.get_property("path") == vmx_path:
+                    return vm
+                self.debug_print(f"The cached mor of {key} now points to {vm.get_property('path')}")
+            except Exception as e:
+                # ManagedObjectNotFound, the vm was unregistered or re-registered with a new mor
+                self.debug_print(f"Discarding the cached mor of {key}", e)
+            self._state.get(VSPHERE_CONST_STATE_VM_CACHE, {}).pop(key, None)
+
+        return VIVirtualMachine(self._vs_server, VIMor(self._find_vm_mor(vmx_path, datacenter), MORTypes.VirtualMachine))
+
+    def _handle_start_stop_guest(self, action, config, param):
+        """Function that handles ACTION_ID_STOP_GUEST and ACTION_ID_START_GUEST action
+
+        Args:
+
+        Return:
+            A status code
+        """
+
+        # Connect to the server
+        status_code = self._connect_to_server(config)
+
+        if phantom.is_fail(status_code):
+            return status_code
+
+        vmx_paths = self._get_vmx_paths(param)
+        if len(vmx_paths) > 1:
+            return self._handle_power_guests(action, config, param, vmx_paths)
+
+        # create an action_result
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        # get the config
+        # The path will contain the datacenter also
+        datacenter, vmx_path = self._parse_vm_path(param[VSPHERE_JSON_VMX_PATH])
+
+        # Get the vm from the path
+        try:
+            vm = self._get_vm_by_path(vmx_path, datacenter)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
+
+        task = None
+        # Only stop if powered on, else the API returns back an error
+        if (action == self.ACTION_ID_STOP_GUEST) and vm.is_powered_on():
+            task = vm.power_off(sync_run=False)
+        # Only start if it can be, else the API returns back an error
+        elif (action == self.ACTION_ID_START_GUEST) and (not vm.is_powered_on()):
+            task = vm.power_on(sync_run=False)
+
+        if task:
+            status_code = self._wait_for_async_task(task, action, action_result)
+        else:
+            # Most probably we don't have to change the state right now, treat this
+            # as a success case (debatable)
+            action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_CANT_EXEC, action=action, state=vm.get_status())
+
+        return action_result.get_status()
+
+    def _get_vmx_paths(self, param):
+        """Function that returns the list of vmx paths of the comma separated vmx_path parameter. Only a comma
+        followed by the '[' of the next path separates two paths, a vmx path can hold commas itself."""
+
+        return [x.strip() for x in VMX_PATH_SEPARATOR_REGEX.split(param[VSPHERE_JSON_VMX_PATH]) if x.strip()]
+
+    def _run_task_window(self, pending, action):
+        """Function that runs tasks in a sliding window of at most VSPHERE_CONST_MAX_CONCURRENT_TASKS tasks, watched
+        by a single monitoring loop, the next task is started as soon as one of the window finishes or times out.
+        The tasks come in chains, the tasks of a chain run one after the other, e.g. the snapshot removals of a vm,
+        which can only run one snapshot task at a time, while the chains share the window.
+        Each task gets the task timeout of the asset from the time it was started, the outcome of each task is
+        recorded in its data row. The tasks are watched through a property collector, polled if that fails.
+
+        Args:
+            pending: The list of chains, lists of (data dictionary, function that starts the task and returns the task object) tuples
+            action: The action that is currently being carried out
+        """
+
+        # the chains whose next task can be started
+        ready = deque(deque(chain) for chain in pending if chain)
+        total = sum(len(chain) for chain in ready)
+        running = {}
+        states = {}
+        version = ""
+        interval = VSPHERE_CONST_TASK_POLL_MIN_INTERVAL
+
+        try:
+            collector = self._create_property_collector()
+        except Exception as e:
+            self.debug_print("Unable to monitor the tasks through a property collector, polling them", e)
+            collector = None
+
+        try:
+            while ready or running:
+                # fill the window
+                while ready and (len(running) < VSPHERE_CONST_MAX_CONCURRENT_TASKS):
+                    chain = ready.popleft()
+                    curr_data, start_task = chain.popleft()
+                    try:
+                        task = start_task()
+                    except Exception as e:
+                        curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_FAILED
+                        curr_data[phantom.APP_JSON_MESSAGE] = str(e)
+                        if chain:
+                            ready.append(chain)
+                        continue
+
+                    running[str(task._mor)] = (curr_data, task, time.time(), chain)
+                    if collector:
+                        try:
+                            self._create_filter(collector, task._mor, MORTypes.Task, [VSPHERE_CONST_TASK_PROP_STATE])
+                        except Exception as e:
+                            self.debug_print("Unable to monitor the tasks through a property collector, polling them", e)
+                            self._destroy_property_collector(collector)
+                            collector = None
+
+                if not running:
+                    break
+
+                # wait for the next change, at most until the first task of the window times out
+                remaining = None
+                if self._task_timeout:
+                    remaining = min(x[2] for x in running.values()) + self._task_timeout - time.time()
+
+                if collector:
+                    max_wait = VSPHERE_CONST_TASK_MAX_WAIT if remaining is None else max(1, min(VSPHERE_CONST_TASK_MAX_WAIT, int(remaining) + 1))
+                    try:
+                        update_set = self._wait_for_updates(collector, version, max_wait)
+                    except Exception as e:
+                        self.debug_print("Unable to monitor the tasks through a property collector, polling them", e)
+                        self._destroy_property_collector(collector)
+                        collector = None
+                        continue
+
+                    if update_set:
+                        version = update_set.Version
+                        for filter_update in getattr(update_set, "FilterSet", None) or []:
+                            for object_update in getattr(filter_update, "ObjectSet", None) or []:
+                                for change in getattr(object_update, "ChangeSet", None) or []:
+                                    if change.Name == VSPHERE_CONST_TASK_PROP_STATE:
+                                        states[str(object_update.Obj)] = getattr(change, "Val", None)
+                else:
+                    time.sleep(interval if remaining is None else max(0, min(interval, remaining)))
+                    interval = min(interval * 2, VSPHERE_CONST_TASK_POLL_MAX_INTERVAL)
+                    for mor, (_, task, _, _) in running.items():
+                        states[mor] = task.get_state()
+
+                # free the slots of the tasks that finished or timed out, the next task of their chain can start
+                now = time.time()
+                for mor, (curr_data, task, start_time, chain) in list(running.items()):
+                    status = states.get(mor)
+                    if status == VITask.STATE_SUCCESS:
+                        curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_SUCCEEDED
+                        curr_data[phantom.APP_JSON_MESSAGE] = phantom.APP_SUCC_CMD_EXEC
+                        curr_data[VSPHERE_JSON_TASK_DURATION] = round(now - start_time, 3)
+                        interval = VSPHERE_CONST_TASK_POLL_MIN_INTERVAL
+                    elif status == VITask.STATE_ERROR:
+                        curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_FAILED
+                        curr_data[phantom.APP_JSON_MESSAGE] = task.get_error_message()
+                        curr_data[VSPHERE_JSON_TASK_DURATION] = round(now - start_time, 3)
+                        interval = VSPHERE_CONST_TASK_POLL_MIN_INTERVAL
+                    elif self._task_timeout and ((now - start_time) >= self._task_timeout):
+                        curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_FAILED
+                        curr_data[phantom.APP_JSON_MESSAGE] = VSPHERE_ERR_TASK_TIMED_OUT.format(timeout=self._task_timeout)
+                    else:
+                        continue
+
+                    del running[mor]
+                    if chain:
+                        ready.append(chain)
+
+                queued = sum(len(chain) for chain in ready) + sum(len(x[3]) for x in running.values())
+                self.send_progress(VSPHERE_PROG_TASKS_COMPLETED, finished=total - queued - len(running), total=total)
+        finally:
+            if collector:
+                self._destroy_property_collector(collector)
+
+    def _handle_power_guests(self, action, config, param, vmx_paths):
+        """Function that starts, stops or suspends several vms in one run.
+        The power tasks run in a sliding window of at most VSPHERE_CONST_MAX_CONCURRENT_TASKS tasks,
+        see _run_task_window.
+
+        Args:
+            action: The action identifier
+            config: The json object containing config
+            param: The action parameters
+            vmx_paths: The list of vmx paths, including the datacenter
+
+        Return:
+            A status code
+        """
+
+        # Connect to the server
+        status_code = self._connect_to_server(config)
+
+        if phantom.is_fail(status_code):
+            return status_code
+
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        pending = []
+        rows = []
+
+        for full_vmx_path in vmx_paths:
+            curr_data = {VSPHERE_JSON_VMX_PATH: full_vmx_path, VSPHERE_JSON_TASK_DURATION: None}
+            rows.append(curr_data)
+
+            datacenter, vmx_path = self._parse_vm_path(full_vmx_path)
+
+            try:
+                vm = self._get_vm_by_path(vmx_path, datacenter)
+            except Exception as e:
+                curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_FAILED
+                curr_data[phantom.APP_JSON_MESSAGE] = f"{VSPHERE_ERR_VM_FROM_VMX_PATH}. Error: {e}"
+                continue
+
+            # same checks as the single vm handlers, the API returns back an error otherwise
+            status = vm.get_status()
+            if (
+                ((action == self.ACTION_ID_STOP_GUEST) and (status == VMPowerState.POWERED_ON))
+                or ((action == self.ACTION_ID_START_GUEST) and (status != VMPowerState.POWERED_ON))
+                or ((action == self.ACTION_ID_SUSPEND_GUEST) and (status != VMPowerState.SUSPENDED))
+            ):
+                pending.append((curr_data, vm))
+            else:
+                curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_SKIPPED
+                curr_data[phantom.APP_JSON_MESSAGE] = VSPHERE_SUCC_CANT_EXEC.format(action=action, state=status)
+
+        if action == self.ACTION_ID_STOP_GUEST:
+            pending = [(curr_data, partial(vm.power_off, sync_run=False)) for curr_data, vm in pending]
+        elif action == self.ACTION_ID_START_GUEST:
+            pending = [(curr_data, partial(vm.power_on, sync_run=False)) for curr_data, vm in pending]
+        else:
+            pending = [(curr_data, partial(vm.suspend, sync_run=False)) for curr_data, vm in pending]
+
+        # one task per vm, each vm is a chain of its own
+        self._run_task_window([[x] for x in pending], action)
+
+        for curr_data in rows:
+            action_result.add_data(curr_data)
+
+        failed = len([x for x in rows if x[phantom.APP_JSON_STATUS] == VSPHERE_CONST_TASK_FAILED])
+        action_result.update_summary({VSPHERE_JSON_TOTAL_VMS_FAILED: failed, VSPHERE_JSON_TOTAL_VMS_SUCCEEDED: len(rows) - failed})
+
+        if failed == len(rows):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_ALL_VMS_FAILED)
+
+        return action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_VMS_PROCESSED, succeeded=len(rows) - failed, total=len(rows))
+
+    def _handle_start_guest(self, action, config, param):
+        """Function that handles ACTION_ID_START_GUEST action
+
+        Args:
+
+        Return:
+            A status code
+        """
+
+        return self._handle_start_stop_guest(action, config, param)
+
+    def _handle_stop_guest(self, action, config, param):
+        """Function that handles ACTION_ID_STOP_GUEST action
+
+        Args:
+
+        Return:
+            A status code
+        """
+        return self._handle_start_stop_guest(action, config, param)
+
+    def _acquire_service_ticket(self, url):
+        """Function that acquires a one-time service ticket of the vCenter session, to get a url of an ESXi host
+
+        Args:
+            url: The url to get
+
+        Return:
+            The id of the ticket
+        """
+
+        request = VI.AcquireGenericServiceTicketRequestMsg()
+        _this = request.new__this(self._vs_server._do_service_content.SessionManager)
+        _this.set_attribute_type(MORTypes.SessionManager)
+        request.set_element__this(_this)
+
+        spec = VI.ns0.SessionManagerHttpServiceRequestSpec_Def("spec").pyclass()
+        spec.set_element_method(VSPHERE_CONST_HTTP_GET)
+        spec.set_element_url(url)
+        request.set_element_spec(spec)
+
+        return self._vs_server._proxy.AcquireGenericServiceTicket(request)._returnval.Id
+
+    def _get_file_host(self, vm_mor, ds_name):
+        """Function that finds the ESXi host to download a file of a vm from, the host of the vm if it mounts
+        the datastore of the file, else another connected host that does
+
+        Args:
+            vm_mor: The managed object reference id of the vm
+            ds_name: The name of the datastore of the file
+
+        Return:
+            The name of the host, None if the server is not a vCenter or no host was found
+        """
+
+        if self._vs_server.get_api_type() != VSPHERE_CONST_API_TYPE_VCENTER:
+            return None
+
+        vm_props = self._get_vm_properties(vm_mor, [VSPHERE_CONST_PROP_VMX_PATH, VSPHERE_CONST_PROP_RUNTIME_HOST, VSPHERE_CONST_PROP_DATASTORES])
+        if not vm_props:
+            return None
+
+        datastores = [VIMor(str(x), MORTypes.Datastore) for x in self._get_array(vm_props.get(VSPHERE_CONST_PROP_DATASTORES))]
+        if not datastores:
+            return None
+
+        obj_contents = self._vs_server._get_object_properties_bulk(
+            datastores, {MORTypes.Datastore: [VSPHERE_CONST_PROP_NAME, VSPHERE_CONST_PROP_DATASTORE_HOSTS]}
+        )
+
+        hosts = []
+        for obj_content in obj_contents or []:
+            ds_props = {prop.Name: prop.Val for prop in getattr(obj_content, "PropSet", None) or []}
+            if ds_props.get(VSPHERE_CONST_PROP_NAME) != ds_name:
+                continue
+            for mount in self._get_array(ds_props.get(VSPHERE_CONST_PROP_DATASTORE_HOSTS)):
+                if getattr(mount.MountInfo, "Accessible", True):
+                    hosts.append(str(mount.Key))
+
+        owner = str(vm_props.get(VSPHERE_CONST_PROP_RUNTIME_HOST) or "")
+        if owner in hosts:
+            hosts.remove(owner)
+            hosts.insert(0, owner)
+
+        if not hosts:
+            return None
+
+        obj_contents = self._vs_server._get_object_properties_bulk(
+            [VIMor(x, MORTypes.HostSystem) for x in hosts], {MORTypes.HostSystem: [VSPHERE_CONST_PROP_NAME, VSPHERE_CONST_PROP_CONNECTION_STATE]}
+        )
+
+        host_props = {}
+        for obj_content in obj_contents or []:
+            host_props[str(obj_content.Obj)] = {prop.Name: prop.Val for prop in getattr(obj_content, "PropSet", None) or []}
+
+        for host in hosts:
+            props = host_props.get(host, {})
+            if props.get(VSPHERE_CONST_PROP_CONNECTION_STATE) == VSPHERE_CONST_HOST_CONNECTED:
+                return props.get(VSPHERE_CONST_PROP_NAME)
+
+        return None
+
+    def _create_url_from_path(self, server, vm_file_path, datacenter, vm_mor=None):
+        """Function that creates a url from the path
+
+        Args:
+        server: The ip or machine name of the esx host
+        vm_file_path: The path of the file, it is expected to be of the format
+            [<datastore_name>] <folder>/<name>-<random_chars>.<extension>
+        datacenter: The text that tell which datacenter to use while creating the url
+        vm_mor: The managed object reference id of the vm of the file, if given the url is of the ESXi host
+            that mounts the datastore of the file, with the url on the server as the fallback, see _get_file_host
+
+        Return:
+        The url of the file on success.
+        """
+
+        # it's always in the following format
+        # [datastore1] WXP3x86/WXP3x86-<random_chars>.<extension>
+
+        # print "Got vm_file_path: {}".format(vm_file_path)
+        # extract the dsName part
+        start = vm_file_path.find("[") + 1
+        end = vm_file_path.find("]")
+        ds_name = vm_file_path[start:end]
+        # print "dsName: '%s'" % ds_name
+
+        # Get the file path after the datastore
+        start = vm_file_path.find("]") + 2
+
+        file_path = vm_file_path[start:]
+
+        # now create the query url, which is of the fomat 'https://{}/folder/{}?dcPath={}&dsName={}'
+
+        file_url = {}
+        file_url[VSPHERE_CONST_URL] = f"https://{server}/folder/{file_path}"
+        file_url[VSPHERE_CONST_DATACENTER] = datacenter
+        file_url[VSPHERE_CONST_DATASTORE] = ds_name
+
+        if not vm_mor or not self._download_from_host:
+            return file_url
+
+        # big files proxied through vCenter make it the bottleneck, get them straight from the host
+        try:
+            host = self._get_file_host(vm_mor, ds_name)
+        except Exception as e:
+            self.debug_print("Unable to find the host of the file", e)
+            host = None
+
+        if not host:
+            return file_url
+
+        self.save_progress(VSPHERE_PROG_DOWNLOADING_FROM_HOST, host=host)
+
+        return {
+            VSPHERE_CONST_URL: f"https://{host}/folder/{file_path}",
+            VSPHERE_CONST_DATACENTER: VSPHERE_CONST_HOST_DATACENTER,
+            VSPHERE_CONST_DATASTORE: ds_name,
+            VSPHERE_CONST_URL_AUTH: ServiceTicketAuth(self._acquire_service_ticket),
+            VSPHERE_CONST_URL_FALLBACK: file_url,
+        }
+
+    def _create_url_of_file(self, server, file_type, vm, datacenter, file_name=None):
+        """Function that creates a url of a given file that is present on the vm.
+
+        Args:
+            server: The ip or machine name of the esx host
+            file_type: The file type that must match the type returned using the 'files' property of the vm.
+            file_name: The file name that must match the name returned using the 'files' property of the vm.
+
+        Return:
+            The url of the file on success, None otherwise.
+        """
+
+        # get the files for this vm
+        files = vm.get_property("files", from_cache=False)
+        # self.debug_print("files data", files)
+        vm_file = None
+
+        for k, v in list(files.items()):
+            # first match file type
+            if v["type"] != file_type:
+                continue
+
+            # file type matched
+            if not file_name:
+                # no need to match the name, since type matched, file is found
+                vm_file = v["name"]
+                break
+
+            if (file_name) and (v["name"].find(file_name) != -1):
+                # file_name is specified and it matched
+                vm_file = v["name"]
+                break
+
+        if vm_file is None:
+            # Not found
+            return None
+
+        return self._create_url_from_path(server, vm_file, datacenter, str(vm._mor))
+
+    def _move_file_to_vault(self, host, container_id, file_size, type_str, local_file_path, result, info, contains, file_info=None):
+        """Function that creates a url from the path
+
+        Args:
+            host: The ip or machine name of the esx host
+            container_id: The container_id to add the file to
+            vmx_path: The vmx_path of the vm
+            file_size: Size of the file in bytes that is to be added to vault, the original size if it was compressed
+            type_str: A string representing the type of the file
+            local_file_path: The local file path that is to be added to the vault
+            result: The ActionResult object to hold the status
+            file_info: The hashes and vault index key of the file, as filled by _download_file
+
+        Return:
+            A status code of the type phantom.APP_[SUCC|ERR]_XXX
+        """
+
+        self.save_progress(phantom.APP_PROG_ADDING_TO_VAULT)
+
+        # lets move the data into the vault
+        vault_attach_dict = {}
+        vault_attach_dict[phantom.APP_JSON_HOST] = host
+        vault_attach_dict[phantom.APP_JSON_INFO] = info
+        vault_attach_dict[phantom.APP_JSON_CONTAINS] = contains
+        vault_attach_dict[phantom.APP_JSON_SIZE] = file_size
+        vault_attach_dict[phantom.APP_JSON_TYPE] = type_str
+        vault_attach_dict[phantom.APP_JSON_ACTION_NAME] = self.get_action_name()
+        vault_attach_dict[phantom.APP_JSON_APP_RUN_ID] = self.get_app_run_id()
+        if file_info:
+            vault_attach_dict[VSPHERE_JSON_SHA256] = file_info.get(VSPHERE_JSON_SHA256)
+            if file_info.get(VSPHERE_JSON_COMPRESSION):
+                for key in (VSPHERE_JSON_COMPRESSION, VSPHERE_JSON_ORIGINAL_SIZE, VSPHERE_JSON_COMPRESSED_SIZE):
+                    vault_attach_dict[key] = file_info.get(key)
+                # the size is the one of the file in the vault, the compressed one, the downloaded size is the original size
+                vault_attach_dict[phantom.APP_JSON_SIZE] = file_info.get(VSPHERE_JSON_COMPRESSED_SIZE) or os.path.getsize(local_file_path)
+                vault_attach_dict[VSPHERE_JSON_ORIGINAL_SIZE] = file_info.get(VSPHERE_JSON_ORIGINAL_SIZE) or file_size
+            for key in VSPHERE_CONST_DISK_DELTA_KEYS:
+                if key in file_info:
+                    vault_attach_dict[key] = file_info[key]
+
+        curr_data = vault_attach_dict
+
+        file_name = os.path.basename(local_file_path)
+
+        try:
+            os.chmod(os.path.dirname(local_file_path), 0o770)
+            success, message, vault_id = ph_rules.vault_add(
+                file_location=local_file_path, container=container_id, file_name=file_name, metadata=vault_attach_dict
+            )
+
+        except Exception as e:
+            return result.set_status(phantom.APP_ERROR, phantom.APP_ERR_FILE_ADD_TO_VAULT, e)
+
+        if success:
+            curr_data[phantom.APP_JSON_VAULT_ID] = vault_id
+            curr_data[phantom.APP_JSON_NAME] = file_name
+            result.add_data(curr_data)
+            if file_info and file_info.get(VSPHERE_CONST_VAULT_INDEX_KEY):
+                self._update_vault_index(file_info[VSPHERE_CONST_VAULT_INDEX_KEY], vault_id)
+            wanted_keys = [phantom.APP_JSON_VAULT_ID, phantom.APP_JSON_NAME, phantom.APP_JSON_SIZE]
+            summary = dict([(x, curr_data[x]) for x in wanted_keys if x in curr_data])
+            result.update_summary(summary)
+            result.set_status(phantom.APP_SUCCESS)
+        else:
+            result.set_status(phantom.APP_ERROR, phantom.APP_ERR_FILE_ADD_TO_VAULT)
+            result.append_to_message(message)
+
+        return result.get_status()
+
+    def _update_vault_index(self, key, vault_id):
+        """Function that records the vault item a datastore file was added as, in the vault index of the state
+
+        Args:
+            key: The key of the file in the vault index, see _get_vault_index_key
+            vault_id: The vault id of the file
+        """
+
+        vault_index = self._state.setdefault(VSPHERE_CONST_STATE_VAULT_INDEX, {})
+
+        # drop the expired entries while at it, so that the state does not keep growing
+        now = time.time()
+        for k in [k for k, v in vault_index.items() if (now - v.get(VSPHERE_CONST_VAULT_INDEX_TIMESTAMP, 0)) >= VSPHERE_CONST_VAULT_INDEX_TTL]:
+            vault_index.pop(k, None)
+
+        vault_index[key] = {VSPHERE_CONST_VAULT_INDEX_VAULT_ID: vault_id, VSPHERE_CONST_VAULT_INDEX_TIMESTAMP: int(now)}
+
+    def _get_vault_index_key(self, url, params, size, modified, codec):
+        """Function that returns the key of a datastore file in the vault index
+
+        Args:
+            url: The url of the file
+            params: The query parameters (datacenter and datastore) of the url
+            size: The size of the file
+            modified: The Last-Modified (or ETag) value of the file
+            codec: The compression of the file in the vault
+
+        Return:
+            The key
+        """
+
+        return hashlib.sha256(json.dumps([url, params, size, modified, codec], sort_keys=True).encode()).hexdigest()
+
+    def _link_vault_file(self, key, local_file_path, file_info):
+        """Function that looks up a datastore file in the vault index and, if the vault item it was added as
+        still exists, links (or copies) the vault file to the local file path, so that it can be added to
+        the container without downloading it again. Only the download is saved, the vault still hashes and
+        stores the file again when it is added, there is no way to attach an existing vault item to another container.
+
+        Args:
+            key: The key of the file in the vault index
+            local_file_path: The local file path to link the vault file to
+            file_info: The dictionary to fill with the hashes of the file
+
+        Return:
+            True if the file was linked, False otherwise
+        """
+
+        vault_index = self._state.get(VSPHERE_CONST_STATE_VAULT_INDEX, {})
+        entry = vault_index.get(key)
+        if not isinstance(entry, dict):
+            return False
+
+        vault_id = entry.get(VSPHERE_CONST_VAULT_INDEX_VAULT_ID)
+        try:
+            success, _, vault_info = ph_rules.vault_info(vault_id=vault_id)
+            vault_path = vault_info[0]["path"] if (success and vault_info) else None
+        except Exception as e:
+            self.debug_print("Handled exception", e)
+            vault_path = None
+
+        if not vault_path or not os.path.exists(vault_path):
+            self.debug_print(f"Vault item {vault_id} is gone, dropping it from the vault index")
+            vault_index.pop(key, None)
+            return False
+
+        try:
+            os.link(vault_path, local_file_path)
+        except OSError:
+            # not on the same filesystem
+            shutil.copyfile(vault_path, local_file_path)
+
+        metadata = vault_info[0].get("metadata") or {}
+        for key in (VSPHERE_JSON_SHA256, VSPHERE_JSON_COMPRESSION, VSPHERE_JSON_ORIGINAL_SIZE, VSPHERE_JSON_COMPRESSED_SIZE):
+            if metadata.get(key) is not None:
+                file_info[key] = metadata[key]
+        file_info[VSPHERE_CONST_VAULT_INDEX_DEDUPLICATED] = True
+
+        self.save_progress(VSPHERE_PROG_FILE_IN_VAULT, vault_id=vault_id)
+
+        return True
+
+    def _download_file(self, url_to_download, action_result, local_file_path, file_info=None):
+        """Function that downloads the file from a url. The file is written to a partial file in the download
+        folder of the vault tmp dir, with a checkpoint next to it, so that an interrupted download is retried
+        and, if it still fails, picked up from where it stopped by the next run of the action.
+        The file is hashed while it is downloaded. If file_info is given, a file that was already
+        added to the vault, and has not changed since, is linked from the vault instead of downloaded,
+        and the file is compressed while it is downloaded if the asset is configured to.
+
+        Args:
+            url_to_download: the url of the file to download
+            action_result: The ActionResult object to hold the status
+            local_file_path: The local file path that was created, see _get_vault_file_name for compressed files
+            file_info: The dictionary to fill with the hashes, compression and vault index key of the file
+
+        Return:
+            A status code of the type phantom.APP_[SUCC|ERR]_XXX.
+            The size in bytes of the file downloaded.
+        """
+
+        content_size = 0
+
+        self.save_progress(phantom.APP_PROG_DOWNLOADING_FILE_FROM_TO, src=url_to_download[VSPHERE_CONST_URL], dest=local_file_path)
+
+        self.debug_print("Complete URL", url_to_download)
+
+        # Create the param dictionary, the urls of an export lease have none
+        keys = [VSPHERE_CONST_DATACENTER, VSPHERE_CONST_DATASTORE]
+        params = {x: url_to_download[x] for x in keys if x in url_to_download}
+        url = url_to_download[VSPHERE_CONST_URL]
+        auth = url_to_download.get(VSPHERE_CONST_URL_AUTH) or self._auth
+        stream_optimized = url_to_download.get(VSPHERE_CONST_URL_STREAM_OPTIMIZED, False)
+
+        # a file of an ESXi host is known by its url on the server, so that both download it to the same
+        # partial file and vault index entry, see _create_url_from_path. A url that changes from one run to the
+        # next, e.g. one of an export lease, comes with a key to be known by instead
+        fallback = url_to_download.get(VSPHERE_CONST_URL_FALLBACK)
+        origin_url = url_to_download.get(VSPHERE_CONST_URL_KEY) or (fallback[VSPHERE_CONST_URL] if fallback else url)
+        origin_params = {x: fallback[x] for x in keys if x in fallback} if fallback else params
+
+        try:
+            r = self._session.get(url, params=params, verify=self._verify, auth=auth, stream=True, timeout=30)
+        except Exception as e:
+            if fallback:
+                self.debug_print("Unable to connect to the host of the file", e)
+                self.save_progress(VSPHERE_PROG_HOST_NOT_REACHABLE)
+                return self._download_file(fallback, action_result, local_file_path, file_info)
+            return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_CONNECTION, e), content_size)
+
+        with r:
+            if r.status_code != requests.codes.ok:  # pylint: disable=E1101
+                if fallback:
+                    self.debug_print(f"The host of the file returned error code: {r.status_code}")
+                    self.save_progress(VSPHERE_PROG_HOST_NOT_REACHABLE)
+                    r.close()
+                    return self._download_file(fallback, action_result, local_file_path, file_info)
+                return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_RETURNED_STATUS_CODE, code=r.status_code), content_size)
+
+            # get the content length, a stream-optimized disk is sent as it is generated, without one
+            content_size = r.headers.get("content-length")
+
+            if content_size:
+                self.save_progress(phantom.APP_PROG_FILE_SIZE, value=content_size, type="bytes")
+            elif not stream_optimized:
+                return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_GET_CONTENT_LENGTH), content_size)
+
+            bytes_to_download = int(content_size) if content_size else None
+
+            # a download can only be resumed if the server supports ranges and tells the version of the file
+            validator = None
+            accept_ranges = r.headers.get("accept-ranges", "").lower() == "bytes"
+            if accept_ranges:
+                validator = r.headers.get("etag") or r.headers.get("last-modified")
+
+            # the datastore path, size and modification time identify a file already added to the vault
+            modified = r.headers.get("last-modified") or r.headers.get("etag")
+            if (file_info is not None) and modified:
+                file_info[VSPHERE_CONST_VAULT_INDEX_KEY] = self._get_vault_index_key(
+                    origin_url, origin_params, bytes_to_download, modified, self._compression
+                )
+                try:
+                    if self._link_vault_file(file_info[VSPHERE_CONST_VAULT_INDEX_KEY], local_file_path, file_info):
+                        return (action_result.set_status(phantom.APP_SUCCESS, phantom.APP_SUCC_FILE_DOWNLOAD), content_size)
+                except Exception as e:
+                    self.debug_print("Handled exception", e)
+
+            try:
+                lock_fd, partial_path, checkpoint_path = self._lock_download(origin_url, origin_params)
+            except BlockingIOError:
+                return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_DOWNLOAD_IN_PROGRESS), content_size)
+            except Exception as e:
+                return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_MAKE_TEMP_FOLDER, e), content_size)
+
+            compressor = None
+            try:
+                checkpoint = self._load_download_checkpoint(checkpoint_path, partial_path, origin_url, bytes_to_download, validator)
+                hashers = {VSPHERE_JSON_SHA256: hashlib.sha256()}
+                # stream-optimized disks are compressed already
+                if (file_info is not None) and (self._compression != VSPHERE_CONST_COMPRESSION_NONE) and (not stream_optimized):
+                    compressor = StreamCompressor(local_file_path, self._compression, os.cpu_count() or 1)
+
+                # big files are fetched in parallel segments, if the server supports ranges
+                if accept_ranges and bytes_to_download and (bytes_to_download > VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE):
+                    r.close()
+                    self._download_file_segments(url, params, partial_path, checkpoint_path, checkpoint, hashers, compressor, auth)
+                else:
+                    # the response is of use only if the download starts from the beginning
+                    if checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES]:
+                        r.close()
+                        r = None
+                    self._download_file_stream(url, params, partial_path, checkpoint_path, checkpoint, hashers, compressor, r, auth)
+
+                if not content_size:
+                    content_size = os.path.getsize(partial_path)
+
+                if compressor:
+                    file_info[VSPHERE_JSON_COMPRESSION] = compressor.codec
+                    file_info[VSPHERE_JSON_ORIGINAL_SIZE] = compressor.original_size
+                    file_info[VSPHERE_JSON_COMPRESSED_SIZE] = compressor.close()
+                    compressor = None
+                    os.remove(partial_path)
+                else:
+                    os.replace(partial_path, local_file_path)
+
+                for path in (checkpoint_path, f"{os.path.splitext(checkpoint_path)[0]}.lock"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            except Exception as e:
+                return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_DOWNLOAD_INTERRUPTED, e), content_size)
+            finally:
+                os.close(lock_fd)
+                if compressor:
+                    compressor.abort()
+
+        if file_info is not None:
+            file_info.update({name: hasher.hexdigest() for name, hasher in hashers.items()})
+
+        self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, 1.0)
+
+        return (action_result.set_status(phantom.APP_SUCCESS, phantom.APP_SUCC_FILE_DOWNLOAD), content_size)
+
+    def _get_vault_tmp_dir(self):
+        """Function that returns the tmp dir of the vault, files of this dir can be moved into the vault
+
+        Return:
+            The path of the dir
+        """
+
+        if hasattr(Vault, "get_vault_tmp_dir"):
+            return Vault.get_vault_tmp_dir()
+
+        return "/vault/tmp"
+
+    def _get_vault_file_name(self, file_name):
+        """Function that returns the name a file downloaded to the vault is stored as,
+        with the extension of the compression the asset is configured with
+
+        Args:
+            file_name: The name of the file on the datastore
+
+        Return:
+            The file name
+        """
+
+        return f"{file_name}{VSPHERE_CONST_COMPRESSION_EXTENSIONS[self._compression]}"
+
+    def _get_download_path(self, url, params):
+        """Function that returns the path, without extension, of the partial file and checkpoint of a url in the download folder
+
+        Args:
+            url: The url of the file to download
+            params: The query parameters (datacenter and datastore) of the url
+
+        Return:
+            The path
+        """
+
+        key = hashlib.sha256(json.dumps([url, params], sort_keys=True).encode()).hexdigest()
+
+        return os.path.join(self._get_vault_tmp_dir(), VSPHERE_CONST_DOWNLOAD_DIR, key)
+
+    def _lock_download(self, url, params):
+        """Function that locks the partial file and checkpoint of a url in the download folder,
+        so that two action runs never write to the same partial file. Stale downloads are removed.
+
+        Args:
+            url: The url of the file to download
+            params: The query parameters (datacenter and datastore) of the url
+
+        Return:
+            The file descriptor of the lock, to be closed once done
+            The path of the partial file
+            The path of the checkpoint file
+        """
+
+        path = self._get_download_path(url, params)
+        download_dir = os.path.dirname(path)
+        os.makedirs(download_dir, mode=0o770, exist_ok=True)
+        self._remove_stale_downloads(download_dir)
+
+        lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except Exception:
+            os.close(lock_fd)
+            raise
+
+        return lock_fd, f"{path}.part", f"{path}.checkpoint"
+
+    def _remove_stale_downloads(self, download_dir):
+        """Function that removes the partial files, checkpoints and locks of the downloads
+        that have not been touched for VSPHERE_CONST_DOWNLOAD_CHECKPOINT_TTL seconds
+
+        Args:
+            download_dir: The download folder
+        """
+
+        last_modified = defaultdict(float)
+        try:
+            for file_name in os.listdir(download_dir):
+                key = file_name.split(".")[0]
+                last_modified[key] = max(last_modified[key], os.path.getmtime(os.path.join(download_dir, file_name)))
+        except Exception as e:
+            self.debug_print("Handled exception", e)
+            return
+
+        for key, mtime in last_modified.items():
+            if (time.time() - mtime) < VSPHERE_CONST_DOWNLOAD_CHECKPOINT_TTL:
+                continue
+
+            path = os.path.join(download_dir, key)
+            try:
+                lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o660)
+            except Exception as e:
+                self.debug_print("Handled exception", e)
+                continue
+
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                for ext in ("part", "checkpoint", "lock"):
+                    if os.path.exists(f"{path}.{ext}"):
+                        os.remove(f"{path}.{ext}")
+            except Exception as e:
+                self.debug_print("Handled exception", e)
+            finally:
+                os.close(lock_fd)
+
+    def _load_download_checkpoint(self, checkpoint_path, partial_path, url, bytes_to_download, validator):
+        """Function that loads the checkpoint of an earlier download of the url. The checkpoint is reset
+        if there is none, or if the file on the server is not the one the partial file is a part of.
+
+        Args:
+            checkpoint_path: The path of the checkpoint file
+            partial_path: The path of the partial file
+            url: The url of the file to download
+            bytes_to_download: The size of the file
+            validator: The ETag or Last-Modified value of the file, None if the download cannot be resumed
+
+        Return:
+            The checkpoint dictionary
+        """
+
+        checkpoint = {
+            VSPHERE_CONST_CHECKPOINT_URL: url,
+            VSPHERE_CONST_CHECKPOINT_SIZE: bytes_to_download,
+            VSPHERE_CONST_CHECKPOINT_VALIDATOR: validator,
+            VSPHERE_CONST_CHECKPOINT_BYTES: 0,
+            VSPHERE_CONST_CHECKPOINT_SEGMENTS: [],
+        }
+
+        if not validator:
+            return checkpoint
+
+        try:
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            partial_size = os.path.getsize(partial_path)
+        except Exception:
+            return checkpoint
+
+        if any(
+            saved.get(x) != checkpoint[x]
+            for x in (VSPHERE_CONST_CHECKPOINT_URL, VSPHERE_CONST_CHECKPOINT_SIZE, VSPHERE_CONST_CHECKPOINT_VALIDATOR)
+        ):
+            self.debug_print("The file changed on the server since the last download attempt, starting over")
+            return checkpoint
+
+        checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES] = min(saved.get(VSPHERE_CONST_CHECKPOINT_BYTES, 0), partial_size)
+        checkpoint[VSPHERE_CONST_CHECKPOINT_SEGMENTS] = saved.get(VSPHERE_CONST_CHECKPOINT_SEGMENTS, [])
+
+        if checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES] or checkpoint[VSPHERE_CONST_CHECKPOINT_SEGMENTS]:
+            self.save_progress(VSPHERE_PROG_DOWNLOAD_RESUMING)
+
+        return checkpoint
+
+    def _save_download_checkpoint(self, checkpoint_path, partial_path, checkpoint):
+        """Function that saves the checkpoint of a download. The partial file is synced to disk first,
+        so the checkpoint never claims bytes that could still be lost.
+
+        Args:
+            checkpoint_path: The path of the checkpoint file
+            partial_path: The path of the partial file
+            checkpoint: The checkpoint dictionary
+        """
+
+        if os.path.exists(partial_path):
+            fd = os.open(partial_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        with open(f"{checkpoint_path}.tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+    def _get_download_retry_delay(self, retries):
+        """Function that returns the number of seconds to wait before a download retry, doubling on every retry
+
+        Args:
+            retries: The number of the retry, starting at 1
+
+        Return:
+            The delay in seconds
+        """
+
+        return min(VSPHERE_CONST_DOWNLOAD_RETRY_DELAY * (2 ** (retries - 1)), VSPHERE_CONST_DOWNLOAD_MAX_RETRY_DELAY)
+
+    def _hash_file_range(self, hashers, compressor, path, start, end):
+        """Function that feeds the bytes start to end (exclusive) of a local file to the hashers and compressor
+
+        Args:
+            hashers: The dictionary of the hashlib objects
+            compressor: The StreamCompressor, None if the file is not compressed
+            path: The path of the file
+            start: The offset of the first byte
+            end: The offset after the last byte
+        """
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            offset = start
+            while offset < end:
+                data = os.pread(fd, min(self._download_chunk_size, end - offset), offset)
+                if not data:
+                    raise Exception(VSPHERE_ERR_INCOMPLETE_DOWNLOAD.format(received=offset, size=end))
+                for hasher in hashers.values():
+                    hasher.update(data)
+                if compressor:
+                    compressor.update(data)
+                offset += len(data)
+        finally:
+            os.close(fd)
+
+    def _download_file_stream(self, url, params, partial_path, checkpoint_path, checkpoint, hashers, compressor, r=None, auth=None):
+        """Function that downloads a file in a single stream, through a fixed size buffer so memory stays flat
+        whatever the size of the file. On a dropped connection the download is retried from the last byte
+        written, if the file can be resumed. Raises an exception on failure, with the checkpoint saved.
+
+        Args:
+            url: The url of the file to download
+            params: The query parameters (datacenter and datastore) of the url
+            partial_path: The path of the partial file
+            checkpoint_path: The path of the checkpoint file
+            checkpoint: The checkpoint dictionary
+            hashers: The dictionary of the hashlib objects to feed the file to
+            compressor: The StreamCompressor to feed the file to, None if the file is not compressed
+            r: The response of a request of the whole file, if already made
+            auth: The requests authentication of the url, None for the basic authentication of the asset
+        """
+
+        bytes_to_download = checkpoint[VSPHERE_CONST_CHECKPOINT_SIZE]
+        validator = checkpoint[VSPHERE_CONST_CHECKPOINT_VALIDATOR]
+        retries = 0
+        hashed = 0
+        last_progress = last_checkpoint = time.time()
+
+        while True:
+            offset = checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES] if validator else 0
+            try:
+                if r is None:
+                    headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+                    r = self._session.get(
+                        url, params=params, headers=headers, verify=self._verify, auth=auth or self._auth, stream=True, timeout=30
+                    )
+
+                with r:
+                    if r.status_code == requests.codes.ok:  # pylint: disable=E1101
+                        # the whole file, either asked for or sent because it changed since the checkpoint
+                        offset = 0
+                    elif (r.status_code != requests.codes.partial_content) or (not offset):  # pylint: disable=E1101
+                        raise Exception(VSPHERE_ERR_SERVER_RETURNED_STATUS_CODE.format(code=r.status_code))
+
+                    with open(partial_path, "ab") as file_handle:
+                        file_handle.truncate(offset)
+
+                        # the bytes of an earlier attempt are hashed once, the rest as it streams in
+                        if hashed != offset:
+                            for name in hashers:
+                                hashers[name] = hashlib.new(name)
+                            if compressor:
+                                compressor.reset()
+                            self._hash_file_range(hashers, compressor, partial_path, 0, offset)
+                            hashed = offset
+
+                        for chunk in r.iter_content(chunk_size=self._download_chunk_size):
+                            if chunk:
+                                file_handle.write(chunk)
+                                for hasher in hashers.values():
+                                    hasher.update(chunk)
+                                if compressor:
+                                    compressor.update(chunk)
+                                offset += len(chunk)
+                                hashed = offset
+
+                                if (time.time() - last_progress) >= VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL:
+                                    if bytes_to_download:
+                                        self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, float(offset) / float(bytes_to_download))
+                                    else:
+                                        self.send_progress(VSPHERE_PROG_DOWNLOADED_BYTES, offset)
+                                    last_progress = time.time()
+
+                                if validator and ((time.time() - last_checkpoint) >= VSPHERE_CONST_DOWNLOAD_CHECKPOINT_INTERVAL):
+                                    file_handle.flush()
+                                    checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES] = offset
+                                    self._save_download_checkpoint(checkpoint_path, partial_path, checkpoint)
+                                    last_checkpoint = time.time()
+
+                        file_handle.flush()
+                        os.fsync(file_handle.fileno())
+
+                if (bytes_to_download is not None) and (offset != bytes_to_download):
+                    raise Exception(VSPHERE_ERR_INCOMPLETE_DOWNLOAD.format(received=offset, size=bytes_to_download))
+
+                return
+            except Exception as e:
+                checkpoint[VSPHERE_CONST_CHECKPOINT_BYTES] = offset
+                if validator:
+                    self._save_download_checkpoint(checkpoint_path, partial_path, checkpoint)
+
+                retries += 1
+                if retries > VSPHERE_CONST_DOWNLOAD_RETRIES:
+                    raise
+
+                delay = self._get_download_retry_delay(retries)
+                self.save_progress(VSPHERE_PROG_DOWNLOAD_RETRYING, error=e, delay=delay)
+                time.sleep(delay)
+                r = None
+
+    def _download_file_segments(self, url, params, partial_path, checkpoint_path, checkpoint, hashers, compressor, auth=None):
+        """Function that downloads a file in fixed size segments, using HTTP Range requests over a bounded
+        pool of threads. The partial file is preallocated and each segment is written at its offset,
+        so the file is reassembled in place. The segments already in the checkpoint are skipped.
+        While the workers download, the contiguous prefix of finished segments is hashed and compressed in order,
+        from the page cache the segments were just written to, so the file is never read back once it is complete.
+        Raises an exception on failure, with the checkpoint saved.
+
+        Args:
+            url: The url of the file to download
+            params: The query parameters (datacenter and datastore) of the url
+            partial_path: The path of the partial file
+            checkpoint_path: The path of the checkpoint file
+            checkpoint: The checkpoint dictionary
+            hashers: The dictionary of the hashlib objects to feed the file to
+            compressor: The StreamCompressor to feed the file to, None if the file is not compressed
+            auth: The requests authentication of the url, None for the basic authentication of the asset
+        """
+
+        bytes_to_download = checkpoint[VSPHERE_CONST_CHECKPOINT_SIZE]
+        validator = checkpoint[VSPHERE_CONST_CHECKPOINT_VALIDATOR]
+        completed = set(checkpoint[VSPHERE_CONST_CHECKPOINT_SEGMENTS])
+        hashed = 0
+
+        fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT, 0o660)
+        try:
+            if not completed:
+                os.ftruncate(fd, 0)
+                try:
+                    os.posix_fallocate(fd, 0, bytes_to_download)
+                except (AttributeError, OSError):
+                    # not supported by the platform or the filesystem, a sparse file will do
+                    os.ftruncate(fd, bytes_to_download)
+
+            segments = [
+                (start, min(start + VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE, bytes_to_download) - 1)
+                for start in range(0, bytes_to_download, VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE)
+            ]
+
+            downloaded = [sum(end + 1 - start for start, end in segments if start in completed)]
+            lock = threading.Lock()
+            failure = None
+            last_checkpoint = time.time()
+
+            with ThreadPoolExecutor(max_workers=VSPHERE_CONST_DOWNLOAD_WORKERS) as executor:
+                futures = {
+                    executor.submit(self._download_segment, url, params, validator, fd, start, end, downloaded, lock, None, auth): start
+                    for start, end in segments
+                    if start not in completed
+                }
+
+                pending = set(futures)
+                while pending and not failure:
+                    done, pending = wait(pending, timeout=VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+                    for future in done:
+                        if future.exception():
+                            failure = failure or future.exception()
+                        else:
+                            completed.add(futures[future])
+                    self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, float(downloaded[0]) / float(bytes_to_download))
+
+                    while (hashed < len(segments)) and (segments[hashed][0] in completed) and (not failure):
+                        self._hash_file_range(hashers, compressor, partial_path, segments[hashed][0], segments[hashed][1] + 1)
+                        hashed += 1
+
+                    if (time.time() - last_checkpoint) >= VSPHERE_CONST_DOWNLOAD_CHECKPOINT_INTERVAL:
+                        checkpoint[VSPHERE_CONST_CHECKPOINT_SEGMENTS] = sorted(completed)
+                        self._save_download_checkpoint(checkpoint_path, partial_path, checkpoint)
+                        last_checkpoint = time.time()
+
+                for future in pending:
+                    future.cancel()
+
+            # the segments that were running when a segment failed are finished by now
+            for future in pending:
+                if (not future.cancelled()) and (not future.exception()):
+                    completed.add(futures[future])
+
+            if failure:
+                checkpoint[VSPHERE_CONST_CHECKPOINT_SEGMENTS] = sorted(completed)
+                self._save_download_checkpoint(checkpoint_path, partial_path, checkpoint)
+                raise failure
+
+            # the segments that finished last
+            for start, end in segments[hashed:]:
+                self._hash_file_range(hashers, compressor, partial_path, start, end + 1)
+
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _download_segment(self, url, params, validator, fd, start, end, downloaded, lock, write_offset=None, auth=None):
+        """Function that downloads the bytes start to end (inclusive) of a file and writes them at the same
+        offset of the local file, or from write_offset. A dropped connection is retried from the last byte written.
+        Runs in a worker thread, raises an exception on failure.
+
+        Args:
+            url: The url of the file to download
+            params: The query parameters (datacenter and datastore) of the url
+            validator: The ETag or Last-Modified value of the file
+            fd: The file descriptor of the local file
+            start: The offset of the first byte
+            end: The offset of the last byte
+            downloaded: Single item list, the count of bytes downloaded by all the workers
+            lock: The lock protecting downloaded
+            write_offset: The offset of the local file to write the first byte at, None for start
+            auth: The requests authentication of the url, None for the basic authentication of the asset
+        """
+
+        offset = start
+        shift = (write_offset - start) if (write_offset is not None) else 0
+        retries = 0
+
+        while True:
+            try:
+                headers = {"Range": f"bytes={offset}-{end}"}
+                if validator:
+                    headers["If-Range"] = validator
+
+                with self._session.get(
+                    url, params=params, headers=headers, verify=self._verify, auth=auth or self._auth, stream=True, timeout=30
+                ) as r:
+                    if r.status_code != requests.codes.partial_content:  # pylint: disable=E1101
+                        raise Exception(VSPHERE_ERR_SERVER_RETURNED_STATUS_CODE.format(code=r.status_code))
+
+                    for chunk in r.iter_content(chunk_size=self._download_chunk_size):
+                        if chunk:
+                            os.pwrite(fd, chunk, offset + shift)
+                            offset += len(chunk)
+                            with lock:
+                                downloaded[0] += len(chunk)
+
+                if offset != end + 1:
+                    raise Exception(VSPHERE_ERR_INCOMPLETE_SEGMENT.format(start=start, end=end, received=offset - start))
+
+                return
+            except Exception as e:
+                retries += 1
+                if retries > VSPHERE_CONST_DOWNLOAD_RETRIES:
+                    raise
+
+                delay = self._get_download_retry_delay(retries)
+                self.debug_print(f"Download of the bytes {start}-{end} interrupted at {offset}, retrying in {delay} seconds", e)
+                time.sleep(delay)
+
+    def _get_array(self, value):
+        """Function that returns the items of a property value that is an array (ArrayOf<type>), or a list
+
+        Args:
+            value: The property value
+
+        Return:
+            A list of the items
+        """
+
+        if value is None:
+            return []
+
+        if isinstance(value, (list, tuple)):
+            return list(value)
+
+        type_name = value.typecode.type[1]
+        if type_name.startswith("ArrayOf"):
+            return list(getattr(value, type_name[len("ArrayOf") :], None) or [])
+
+        return [value]
+
+    def _create_snapshot_table(self, vm_props):
+        """Function that flattens the snapshot tree of a vm and maps each snapshot to its files, using the
+        extended file layout of the vm. The tree is walked iteratively, parents before their children.
+        The size of a snapshot is the size of its data and memory files and of the delta disk files it added
+        to the disk chains of its parent, its own delta disks, which is about the space its removal reclaims.
+
+        Args:
+            vm_props: The dictionary of the VSPHERE_CONST_SNAPSHOT_PROPERTIES properties of the vm
+
+        Return:
+            A list of dictionaries, one per snapshot
+        """
+
+        files = {x.Key: x for x in self._get_array(vm_props.get(VSPHERE_CONST_PROP_LAYOUT_FILES))}
+        layouts = {str(x.Key): x for x in self._get_array(vm_props.get(VSPHERE_CONST_PROP_LAYOUT_SNAPSHOTS))}
+
+        snapshots = []
+        stack = [(x, set()) for x in reversed(self._get_array(vm_props.get(VSPHERE_CONST_PROP_SNAPSHOTS)))]
+        while stack:
+            tree, parent_disk_keys = stack.pop()
+
+            mor = str(tree.Snapshot)
+            create_time = calendar.timegm(tuple(int(x) for x in tree.CreateTime[:6]))
+            layout = layouts.get(mor)
+            data_file = files.get(layout.DataKey) if layout else None
+            memory_file = files.get(getattr(layout, "MemoryKey", None)) if layout else None
+
+            # the first unit of a chain is the base disk, which is not the snapshot's to reclaim
+            disk_keys = set()
+            base_keys = set()
+            for disk in (getattr(layout, "Disk", None) or []) if layout else []:
+                for index, unit in enumerate(getattr(disk, "Chain", None) or []):
+                    (disk_keys if index else base_keys).update(unit.FileKey or [])
+            disk_files = [
+                files[x] for x in disk_keys - parent_disk_keys - base_keys if (x in files) and (files[x].Type in VSPHERE_CONST_DISK_FILE_TYPES)
+            ]
+
+            stack.extend((x, disk_keys) for x in reversed(self._get_array(getattr(tree, "ChildSnapshotList", None))))
+
+            snapshots.append(
+                {
+                    VSPHERE_JSON_NAME: tree.Name,
+                    VSPHERE_JSON_SNAPSHOT_ID: mor,
+                    VSPHERE_JSON_DESCRIPTION: tree.Description,
+                    VSPHERE_JSON_CREATE_TIME: time.strftime(VSPHERE_CONST_TIME_FORMAT, time.gmtime(create_time)),
+                    VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH: create_time,
+                    VSPHERE_JSON_MEMORY: tree.State == VSPHERE_CONST_POWERED_ON,
+                    VSPHERE_JSON_QUIESCED: bool(tree.Quiesced),
+                    VSPHERE_CONST_SNAPSHOT_DATA_FILE: data_file.Name if data_file else None,
+                    VSPHERE_CONST_SNAPSHOT_MEMORY_FILE: memory_file.Name if memory_file else None,
+                    VSPHERE_JSON_SIZE: sum(x.Size or 0 for x in (data_file, memory_file, *disk_files) if x) if layout else None,
+                }
+            )
+
+        return snapshots
+
+    def _find_snapshot(self, snapshots, snap_name, id):
+        """Function that finds a snapshot by name, and id if given, in a snapshot table
+
+        Args:
+            snapshots: The list of snapshot dictionaries
+            snap_name: The name of the snapshot
+            id: The number of the snapshot mor (e.g. 42 of snapshot-42), None to match on the name only
+
+        Return:
+            The snapshot dictionary, None if not found
+        """
+
+        for snapshot in snapshots:
+            if snapshot[VSPHERE_JSON_NAME] != snap_name:
+                continue
+            if (id is None) or (str(snapshot[VSPHERE_JSON_SNAPSHOT_ID]).split("-")[-1] == str(id)):
+                return snapshot
+
+        return None
+
+    def _filter_snapshots(self, snapshots, name_prefix=None, older_than=None, container_id=None):
+        """Function that filters a snapshot table
+
+        Args:
+            snapshots: The list of snapshot dictionaries
+            name_prefix: Keep the snapshots whose name starts with it
+            older_than: Keep the snapshots created more than this many hours ago
+            container_id: Keep the snapshots taken by the app for this container
+
+        Return:
+            The list of the snapshot dictionaries kept
+        """
+
+        now = time.time()
+        description = VSPHERE_CONST_SNAPSHOT_DESCRIPTION.format(container_id=container_id) if (container_id is not None) else None
+
+        return [
+            x
+            for x in snapshots
+            if ((not name_prefix) or (x[VSPHERE_JSON_NAME] or "").startswith(name_prefix))
+            and ((older_than is None) or ((now - x[VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH]) >= (older_than * 3600)))
+            and ((description is None) or (x[VSPHERE_JSON_DESCRIPTION] == description))
+        ]
+
+    def _retrieve_snapshot_properties(self, vmx_paths):
+        """Function that fetches the snapshot tree and file layout of a set of vms in bulk. The mors of the vms of
+        the vmx paths are taken from the vm cache, or looked up in the search index, and their properties fetched
+        in one request, without vmx paths the properties of all the vms are fetched in one traversal per datacenter.
+
+        Args:
+            vmx_paths: The list of vmx paths (with the datacenter), empty for all the vms
+
+        Return:
+            A list of (datacenter name, dictionary of vm properties) tuples
+        """
+
+        property_names = [VSPHERE_CONST_PROP_NAME, *VSPHERE_CONST_SNAPSHOT_PROPERTIES]
+
+        if not vmx_paths:
+            # the snapshots are pruned from the whole list, all the datacenters have to be there
+            datacenter_vms, failed = self._retrieve_datacenters_vms(property_names)
+            if failed:
+                raise next(iter(failed.values()))
+            return [(datacenter, vm_props) for datacenter, vm_list in datacenter_vms for vm_props in vm_list]
+
+        paths = list(dict.fromkeys(self._parse_vm_path(x) for x in vmx_paths))
+
+        # the cached mors are checked by the fetch itself, which returns the vmx path of each vm, the vms that
+        # are not cached, or whose cached mor turns out stale, are looked up in the search index
+        vms = {}
+        mors = {path: self._get_cached_vm_mor(path[1], path[0]) for path in paths}
+        for attempt in range(2):
+            missing = [path for path in paths if path not in vms]
+            if not missing:
+                break
+
+            for path in missing:
+                if attempt or not mors.get(path):
+                    mors[path] = self._find_vm_mor(path[1], path[0])
+
+            try:
+                obj_contents = self._vs_server._get_object_properties_bulk(
+                    [VIMor(mors[x], MORTypes.VirtualMachine) for x in missing], {MORTypes.VirtualMachine: property_names}
+                )
+            except Exception as e:
+                # a ManagedObjectNotFound fails the whole fetch, the vms are all looked up again
+                if attempt:
+                    raise
+                self.debug_print("Unable to fetch the vms by their cached mors", e)
+                continue
+
+            fetched = {}
+            for obj_content in obj_contents or []:
+                prop_set = getattr(obj_content, "PropSet", None)
+                if not prop_set:
+                    continue
+
+                vm_props = {prop.Name: prop.Val for prop in prop_set}
+                vm_props[VSPHERE_CONST_VM_MOR] = str(obj_content.Obj)
+                fetched[vm_props[VSPHERE_CONST_VM_MOR]] = vm_props
+
+            for path in missing:
+                vm_props = fetched.get(mors[path])
+                # a mor fresh from the search index is taken as is
+                if vm_props and (attempt or (vm_props.get(VSPHERE_CONST_PROP_VMX_PATH) == path[1])):
+                    vms[path] = vm_props
+
+        return [(path[0], vms[path]) for path in paths if path in vms]
+
+    def _create_snapshot_data(self, datacenter, vm_props, snapshot):
+        """Function that creates the action data of a snapshot
+
+        Args:
+            datacenter: The name of the datacenter the vm belongs to
+            vm_props: The dictionary of vm properties
+            snapshot: The snapshot dictionary
+
+        Return:
+            The data dictionary
+        """
+
+        curr_data = {x: snapshot.get(x) for x in VSPHERE_CONST_SNAPSHOT_DATA_KEYS}
+        curr_data[VSPHERE_JSON_VMX_PATH] = f"[{datacenter}]" + vm_props[VSPHERE_CONST_PROP_VMX_PATH]
+        curr_data[VSPHERE_JSON_GUEST_NAME] = vm_props.get(VSPHERE_CONST_PROP_NAME)
+
+        return curr_data
+
+    def _handle_list_snapshots(self, config, param):
+        """Function that handles ACTION_ID_LIST_SNAPSHOTS
+
+        Args:
+            config: The config given to the connector
+            param: The parameters of the action
+
+        Return:
+            A status code
+        """
+
+        # Connect to the server
+        status_code = self._connect_to_server(config)
+
+        if phantom.is_fail(status_code):
+            return status_code
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ret_val, older_than = self._validate_integer(action_result, param.get(VSPHERE_JSON_OLDER_THAN), VSPHERE_JSON_OLDER_THAN, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, container_id = self._validate_integer(action_result, param.get(VSPHERE_JSON_CONTAINER_ID), VSPHERE_JSON_CONTAINER_ID)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        vmx_paths = self._get_vmx_paths(param) if param.get(VSPHERE_JSON_VMX_PATH) else []
+
+        try:
+            vms = self._retrieve_snapshot_properties(vmx_paths)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_GET_SNAPSHOTS, e)
+
+        total_size = 0
+        for datacenter, vm_props in vms:
+            snapshots = self._filter_snapshots(
+                self._create_snapshot_table(vm_props), param.get(VSPHERE_JSON_NAME_PREFIX), older_than, container_id
+            )
+            for snapshot in snapshots:
+                action_result.add_data(self._create_snapshot_data(datacenter, vm_props, snapshot))
+                total_size += snapshot[VSPHERE_JSON_SIZE] or 0
+
+        action_result.update_summary({VSPHERE_JSON_TOTAL_SNAPSHOTS: action_result.get_data_size(), VSPHERE_JSON_TOTAL_SIZE: total_size})
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _select_snapshots_to_prune(self, snapshots, keep_last=None, max_age=None):
+        """Function that selects the snapshots of a vm to remove according to a retention policy. Only the snapshots
+        taken by the app, recognized by their name prefix and description, are considered.
+
+        Args:
+            snapshots: The snapshot table of the vm
+            keep_last: Keep this many of the latest snapshots taken by the app, None to not limit the count
+            max_age: Remove the snapshots taken by the app more than this many hours ago, None to not limit the age
+
+        Return:
+            The list of the snapshot dictionaries to remove, oldest first
+        """
+
+        owned = [
+            x
+            for x in snapshots
+            if (x[VSPHERE_JSON_NAME] or "").startswith(VSPHERE_CONST_SNAPSHOT_NAME_PREFIX)
+            and (x[VSPHERE_JSON_DESCRIPTION] or "").startswith(VSPHERE_CONST_SNAPSHOT_DESCRIPTION_PREFIX)
+        ]
+        owned.sort(key=lambda x: x[VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH], reverse=True)
+
+        now = time.time()
+
+        return [
+            x
+            for i, x in reversed(list(enumerate(owned)))
+            if ((keep_last is not None) and (i >= keep_last))
+            or ((max_age is not None) and ((now - x[VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH]) >= (max_age * 3600)))
+        ]
+
+    def _remove_snapshot(self, snapshot_id):
+        """Function that starts the removal of a snapshot, its changes are consolidated into its child (or the vm)
+
+        Args:
+            snapshot_id: The managed object reference id of the snapshot, e.g. 'snapshot-42'
+
+        Return:
+            The pysphere task object
+        """
+
+        request = VI.RemoveSnapshot_TaskRequestMsg()
+        mor_snap = request.new__this(VIMor(snapshot_id, MORTypes.VirtualMachineSnapshot))
+        mor_snap.set_attribute_type(MORTypes.VirtualMachineSnapshot)
+        request.set_element__this(mor_snap)
+        request.set_element_removeChildren(False)
+        request.set_element_consolidate(True)
+
+        task = self._vs_server._proxy.RemoveSnapshot_Task(request)._returnval
+
+        return VITask(task, self._vs_server)
+
+    def _prune_snapshots(self, vms, keep_last, max_age, dry_run=False):
+        """Function that removes the snapshots taken by the app that fall out of a retention policy.
+        A vm can only run one snapshot task at a time, so the removals of a vm are chained, and the chains
+        of the vms share a sliding window of at most VSPHERE_CONST_MAX_CONCURRENT_TASKS tasks, see _run_task_window.
+
+        Args:
+            vms: The list of (datacenter name, dictionary of VSPHERE_CONST_SNAPSHOT_PROPERTIES properties) of the vms
+            keep_last: Keep this many of the latest snapshots taken by the app, None to not limit the count
+            max_age: Remove the snapshots taken by the app more than this many hours ago, None to not limit the age
+            dry_run: Only report the snapshots that would be removed
+
+        Return:
+            The list of data dictionaries, one per snapshot
+        """
+
+        rows = []
+        chains = []
+
+        for datacenter, vm_props in vms:
+            chain = []
+            for snapshot in self._select_snapshots_to_prune(self._create_snapshot_table(vm_props), keep_last, max_age):
+                curr_data = self._create_snapshot_data(datacenter, vm_props, snapshot)
+                curr_data[VSPHERE_JSON_TASK_DURATION] = None
+                rows.append(curr_data)
+
+                if dry_run:
+                    curr_data[phantom.APP_JSON_STATUS] = VSPHERE_CONST_TASK_SKIPPED
+                    curr_data[phantom.APP_JSON_MESSAGE] = VSPHERE_SUCC_DRY_RUN
+                else:
+                    chain.append((curr_data, partial(self._remove_snapshot, curr_data[VSPHERE_JSON_SNAPSHOT_ID])))
+
+            if chain:
+                chains.append(chain)
+
+        self._run_task_window(chains, self.ACTION_ID_PRUNE_SNAPSHOTS)
+
+        return rows
+
+    def _handle_prune_snapshots(self, config, param):
+        """Function that handles ACTION_ID_PRUNE_SNAPSHOTS
+
+        Args:
+            config: The config given to the connector
+            param: The parameters of the action
+
+        Return:
+            A status code
+        """
+
+        # Connect to the server
+        status_code = self._connect_to_server(config)
+
+        if phantom.is_fail(status_code):
+            return status_code
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ret_val, keep_last = self._validate_integer(action_result, param.get(VSPHERE_JSON_KEEP_LAST), VSPHERE_JSON_KEEP_LAST, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, max_age = self._validate_integer(action_result, param.get(VSPHERE_JSON_OLDER_THAN), VSPHERE_JSON_OLDER_THAN, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        # fall back to the retention policy of the asset
+        if (keep_last is None) and (max_age is None):
+            keep_last, max_age = self._snapshot_keep_last, self._snapshot_max_age
+
+        if (keep_last is None) and (max_age is None):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_NO_RETENTION)
+
+        vmx_paths = self._get_vmx_paths(param) if param.get(VSPHERE_JSON_VMX_PATH) else []
+
+        try:
+            vms = self._retrieve_snapshot_properties(vmx_paths)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_GET_SNAPSHOTS, e)
+
+        dry_run = param.get(VSPHERE_JSON_DRY_RUN, False)
+        rows = self._prune_snapshots(vms, keep_last, max_age, dry_run)
+
+        for curr_data in rows:
+            action_result.add_data(curr_data)
+
+        failed = len([x for x in rows if x[phantom.APP_JSON_STATUS] == VSPHERE_CONST_TASK_FAILED])
+        removed = [x for x in rows if x[phantom.APP_JSON_STATUS] == VSPHERE_CONST_TASK_SUCCEEDED]
+
+        # on a dry run, report the space the removal would reclaim
+        action_result.update_summary(
+            {
+                VSPHERE_JSON_TOTAL_SNAPSHOTS_REMOVED: len(removed),
+                VSPHERE_JSON_TOTAL_SNAPSHOTS_FAILED: failed,
+                VSPHERE_JSON_SPACE_RECLAIMED: sum(x[VSPHERE_JSON_SIZE] or 0 for x in (rows if dry_run else removed)),
+            }
+        )
+
+        if dry_run:
+            return action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_SNAPSHOTS_TO_REMOVE, total=len(rows))
+
+        if rows and (failed == len(rows)):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_ALL_SNAPSHOTS_FAILED)
+
+        return action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_SNAPSHOTS_REMOVED, removed=len(removed), total=len(rows))
+
+    def _parse_snap_list_file(self, local_file_path):
+        """Function that parses the snapshot list (.vmsd) file in a single pass
+
+        Args:
+            local_file_path: The local path of the snapshot list file
+
+        Return:
+            A list of dictionaries, one per snapshot, in the same format as _create_snapshot_table.
+            The id is the uid of the snapshot in the file.
+        """
+
+        entries = defaultdict(dict)
+        with open(local_file_path) as f:
+            for line in f:
+                m = VMSD_LINE_REGEX.match(line)
+                if m:
+                    entries[m.group(1)][m.group(2)] = m.group(3)
+
+        return [
+            {
+                VSPHERE_JSON_NAME: entry.get("displayName"),
+                VSPHERE_JSON_SNAPSHOT_ID: entry.get("uid"),
+                VSPHERE_CONST_SNAPSHOT_DATA_FILE: entry.get("filename"),
+            }
+            for entry in entries.values()
+        ]
+
+    def _get_snapshot_file_url(self, server, snap_name, vm, datacenter, temp_dir, action_result, id=None):
+        """Function that returns the urls of the data (.vmsn) and memory (.vmem) files of a snapshot. The files are
+        looked up in the snapshot tree and extended file layout of the vm, fetched in one property retrieval.
+        If that does not work out (e.g. the layout is not filled in), the snapshot list file is
+        downloaded to the temp dir and parsed instead.
+
+        Args:
+            server: The ip or machine name of the esx host
+            snap_name: The name of the snapshot
+            vm: The pyshpere vm object
+            datacenter: The name of the datacenter of the vm
+            temp_dir: The folder to download the snapshot list file to
+            action_result: ActionResult object to update the status to
+            id: The number of the snapshot mor, None to match on the name only
+
+        Return:
+            The url of the data file, None on failure with the status set in the action_result
+            The url of the memory file, None if the memory of the vm is kept in the data file
+        """
+
+        vm_props = self._get_vm_properties(str(vm._mor), VSPHERE_CONST_SNAPSHOT_PROPERTIES)
+        if vm_props:
+            snapshot = self._find_snapshot(self._create_snapshot_table(vm_props), snap_name, id)
+            if snapshot and snapshot[VSPHERE_CONST_SNAPSHOT_DATA_FILE]:
+                memory_file = snapshot[VSPHERE_CONST_SNAPSHOT_MEMORY_FILE]
+                return (
+                    self._create_url_from_path(server, snapshot[VSPHERE_CONST_SNAPSHOT_DATA_FILE], datacenter, str(vm._mor)),
+                    self._create_url_from_path(server, memory_file, datacenter, str(vm._mor)) if memory_file else None,
+                )
+
+        self.debug_print(f"Snapshot '{snap_name}' not found in the file layout of the vm, parsing the snapshot list file")
+
+        # Create the url to the snapshot list file
+        snap_list_url = self._create_url_of_file(server, "snapshotList", vm, datacenter)
+        if not snap_list_url:
+            action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_FIND_SNAPSHOT_LIST_FILE)
+            return None, None
+
+        # download the file that contains all the snapshots
+        self.save_progress(VSPHERE_PROG_SNAPSHOT_INFO_DOWNLOADING, snap_name=snap_name)
+        local_file_path = f"{temp_dir}/{phantom.get_file_name_from_url(snap_list_url[VSPHERE_CONST_URL])}"
+        status_code, _ = self._download_file(snap_list_url, action_result, local_file_path)
+
+        if phantom.is_fail(status_code):
+            return None, None
+
+        # parse the downloaded file and get the file_name that our snapshot represents
+        snapshot = self._find_snapshot(self._parse_snap_list_file(local_file_path), snap_name, id)
+        os.remove(local_file_path)
+
+        if not snapshot or not snapshot[VSPHERE_CONST_SNAPSHOT_DATA_FILE]:
+            action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SNAPSHOT_PATH, snap_name)
+            return None, None
+
+        # got the file name, now get the url of this file_name
+        data_file = snapshot[VSPHERE_CONST_SNAPSHOT_DATA_FILE]
+        snap_file_url = self._create_url_of_file(server, "snapshotData", vm, datacenter, data_file)
+        if not snap_file_url:
+            action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SNAPSHOT_URL, snap_name)
+            return None, None
+
+        # the memory file, if any, is named after the data file
+        memory_file = f"{os.path.splitext(data_file)[0]}{VSPHERE_CONST_VMEM_EXTENSION}"
+        return snap_file_url, self._create_url_of_file(server, "snapshotMemory", vm, datacenter, memory_file)
+
+    def _get_memory_regions(self, checkpoint):
+        """Function that finds the memory of the vm, and its regions, in a checkpoint file
+
+        Args:
+            checkpoint: The CheckpointFile
+
+        Return:
+            The offset and the size of the memory in the file, None if the memory is kept in a separate .vmem file
+            The list of (physical page number, page number in the memory, number of pages) of the regions, sorted
+        """
+
+        if VSPHERE_CONST_CHECKPOINT_MEMORY_GROUP not in checkpoint.groups:
+            raise ValueError(VSPHERE_ERR_NO_MEMORY_IN_CHECKPOINT)
+
+        memory = None
+        values = {}
+        for name, indices, offset, size in checkpoint.tags(VSPHERE_CONST_CHECKPOINT_MEMORY_GROUP):
+            if name == VSPHERE_CONST_CHECKPOINT_MEMORY_TAG:
+                memory = (offset, size)
+            elif size <= 8:
+                values[(name, indices)] = checkpoint.read_int(offset, size)
+
+        regions = []
+        for index in range(values.get((VSPHERE_CONST_CHECKPOINT_REGIONS_COUNT_TAG, ()), 0)):
+            regions.append(
+                (
+                    values[(VSPHERE_CONST_CHECKPOINT_REGION_PPN_TAG, (index,))],
+                    values[(VSPHERE_CONST_CHECKPOINT_REGION_PAGE_NUM_TAG, (index,))],
+                    values[(VSPHERE_CONST_CHECKPOINT_REGION_SIZE_TAG, (index,))],
+                )
+            )
+
+        return (memory if memory and memory[1] else None), sorted(regions)
+
+    def _write_memory_image(self, checkpoint, memory_offset, memory_size, regions, path):
+        """Function that writes the memory of the vm as a raw physical memory image, each region at its physical
+        address. The data is written from the mapped file, the gaps between the regions are left sparse.
+
+        Args:
+            checkpoint: The CheckpointFile, or the MappedFile of the .vmem file
+            memory_offset: The offset of the memory in the file
+            memory_size: The size of the memory in bytes
+            regions: The regions of the memory, as returned by _get_memory_regions
+            path: The path of the image
+
+        Return:
+            The sha256 of the image
+        """
+
+        hasher = hashlib.sha256()
+        zeros = bytes(VSPHERE_CONST_MEMORY_CHUNK_SIZE)
+
+        with open(path, "wb") as f:
+            position = 0
+            for ppn, page_num, pages in regions:
+                address = ppn * VSPHERE_CONST_MEMORY_PAGE_SIZE
+                start = page_num * VSPHERE_CONST_MEMORY_PAGE_SIZE
+                end = min(start + (pages * VSPHERE_CONST_MEMORY_PAGE_SIZE), memory_size)
+                if address < position:
+                    raise ValueError(VSPHERE_ERR_CHECKPOINT_TRUNCATED)
+
+                # the gap reads as zeros, which the hash has to account for
+                gap = address - position
+                while gap:
+                    hasher.update(zeros[: min(gap, len(zeros))])
+                    gap -= min(gap, len(zeros))
+                f.seek(address)
+
+                for chunk_start in range(start, end, VSPHERE_CONST_MEMORY_CHUNK_SIZE):
+                    with checkpoint.view(memory_offset + chunk_start, min(VSPHERE_CONST_MEMORY_CHUNK_SIZE, end - chunk_start)) as chunk:
+                        f.write(chunk)
+                        hasher.update(chunk)
+
+                position = address + max(0, end - start)
+
+            f.truncate(position)
+
+        return hasher.hexdigest()
+
+    def _extract_memory(self, server, container_id, vmx_path, local_file_path, file_info, memory_url, action_result):
+        """Function that extracts the memory of the vm from a downloaded suspend or snapshot file and adds it to
+        the vault, as a raw physical memory image, with the table of its regions. If the memory is not in the
+        file, as is the case since vSphere 6.0, it is read from the .vmem file, which is downloaded for it.
+
+        Args:
+            server: The ip or machine name of the server
+            container_id: The container_id to add the file to
+            vmx_path: The vmx_path of the vm
+            local_file_path: The local file path of the downloaded file
+            file_info: The dictionary filled by _download_file for the downloaded file
+            memory_url: The url of the .vmem file of the suspend or snapshot file, None if there is none
+            action_result: ActionResult object to update the status to
+
+        Return:
+            A status code
+        """
+
+        file_name = os.path.basename(local_file_path)
+        self.save_progress(VSPHERE_PROG_EXTRACTING_MEMORY, file_name=file_name)
+
+        # a compressed file has to be decompressed before it can be mapped
+        checkpoint_path = local_file_path
+        codec = file_info.get(VSPHERE_JSON_COMPRESSION) if file_info else None
+        if codec:
+            checkpoint_path = local_file_path[: -len(VSPHERE_CONST_COMPRESSION_EXTENSIONS[codec])]
+            file_name = os.path.basename(checkpoint_path)
+
+        memory_path = f"{os.path.splitext(checkpoint_path)[0]}{VSPHERE_CONST_MEMORY_EXTENSION}"
+        vmem_path = None
+
+        try:
+            if codec:
+                with open(checkpoint_path, "wb") as out:
+                    if codec == VSPHERE_CONST_COMPRESSION_ZSTD:
+                        with open(local_file_path, "rb") as f:
+                            zstandard.ZstdDecompressor().copy_stream(f, out)
+                    else:
+                        with gzip.open(local_file_path, "rb") as f:
+                            shutil.copyfileobj(f, out, VSPHERE_CONST_MEMORY_CHUNK_SIZE)
+
+            with CheckpointFile(checkpoint_path) as checkpoint:
+                memory, regions = self._get_memory_regions(checkpoint)
+                if memory:
+                    # memory that is not split into regions starts at physical address 0
+                    regions = regions or [(0, 0, memory[1] // VSPHERE_CONST_MEMORY_PAGE_SIZE)]
+                    sha256 = self._write_memory_image(checkpoint, memory[0], memory[1], regions, memory_path)
+
+            if not memory:
+                if not memory_url:
+                    raise ValueError(VSPHERE_ERR_NO_MEMORY_IN_CHECKPOINT)
+
+                vmem_path = f"{os.path.dirname(local_file_path)}/{phantom.get_file_name_from_url(memory_url[VSPHERE_CONST_URL])}"
+                if phantom.is_fail(self._download_file(memory_url, action_result, vmem_path)[0]):
+                    raise ValueError(action_result.get_message())
+
+                with MappedFile(vmem_path) as vmem:
+                    regions = regions or [(0, 0, vmem.size // VSPHERE_CONST_MEMORY_PAGE_SIZE)]
+                    sha256 = self._write_memory_image(vmem, 0, vmem.size, regions, memory_path)
+        except Exception as e:
+            if os.path.exists(memory_path):
+                os.remove(memory_path)
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_EXTRACT_MEMORY, e, file_name=file_name)
+        finally:
+            if codec and os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            if vmem_path and os.path.exists(vmem_path):
+                os.remove(vmem_path)
+
+        info = {
+            VSPHERE_JSON_VMX_PATH: vmx_path,
+            VSPHERE_JSON_SOURCE_FILE: file_name,
+            VSPHERE_JSON_MEMORY_REGIONS: [
+                {
+                    VSPHERE_JSON_ADDRESS: ppn * VSPHERE_CONST_MEMORY_PAGE_SIZE,
+                    VSPHERE_JSON_SIZE: pages * VSPHERE_CONST_MEMORY_PAGE_SIZE,
+                }
+                for ppn, _, pages in regions
+            ],
+        }
+
+        return self._move_file_to_vault(
+            server,
+            container_id,
+            os.path.getsize(memory_path),
+            VSPHERE_CONST_MEMORY_FILE_TYPE,
+            memory_path,
+            action_result,
+            info,
+            ["os memory dump", VSPHERE_CONST_MEMORY_FILE_TYPE],
+            {VSPHERE_JSON_SHA256: sha256},
+        )
+
+    def _add_checkpoint_file_to_vault(
+        self,
+        server,
+        container_id,
+        vmx_path,
+        type_str,
+        local_file_path,
+        content_size,
+        file_info,
+        memory_url,
+        extract_memory,
+        memory_only,
+        action_result,
+    ):
+        """Function that adds a downloaded suspend or snapshot file, and/or the memory of the vm extracted from it, to
+        the vault. If the memory cannot be extracted, the file is still added, with the error as a warning.
+
+        Args:
+            server: The ip or machine name of the esx host
+            container_id: The container_id to add the files to
+            vmx_path: The vmx_path of the vm
+            type_str: The type of the file
+            local_file_path: The local file path of the downloaded file
+            content_size: The size in bytes of the downloaded file
+            file_info: The dictionary filled by _download_file for the downloaded file
+            memory_url: The url of the .vmem file of the downloaded file, None if there is none
+            extract_memory: Also add the memory of the vm, extracted from the file, to the vault
+            memory_only: Add only the memory of the vm to the vault, not the file
+            action_result: ActionResult object to update the status to
+
+        Return:
+            A status code
+        """
+
+        error = None
+        if extract_memory or memory_only:
+            status_code = self._extract_memory(server, container_id, vmx_path, local_file_path, file_info, memory_url, action_result)
+            if phantom.is_success(status_code) and memory_only:
+                os.remove(local_file_path)
+                return action_result.get_status()
+            if phantom.is_fail(status_code):
+                error = action_result.get_message()
+
+        status_code = self._move_file_to_vault(
+            server,
+            container_id,
+            content_size,
+            type_str,
+            local_file_path,
+            action_result,
+            {VSPHERE_JSON_VMX_PATH: vmx_path},
+            ["os memory dump", type_str],
+            file_info,
+        )
+
+        if phantom.is_success(status_code) and error:
+            action_result.set_status(
+                phantom.APP_SUCCESS, VSPHERE_SUCC_MEMORY_NOT_EXTRACTED, file_name=os.path.basename(local_file_path), error=error
+            )
+
+        return action_result.get_status()
+
+    def _download_snapshot_file(
+        self, snap_name, vmx_path, config, vm, action_result, datacenter, id=None, extract_memory=False, memory_only=False
+    ):
+        """Function that downloads the suspend file from the esx host
+
+        Args:
+            snap_name: The name of the snapshot that is to be downloaded
+            vmx_path: The vmx_path of the vm
+            config: The config given to the connector
+            vm: The pyshpere vm object
+            action_result: ActionResult object to update the status to
+            extract_memory: Also add the memory of the vm, extracted from the file, to the vault
+            memory_only: Add only the memory of the vm to the vault, not the file
+
+        Return:
+            A status code
+        """
+
+        # Progress and config
+        server = config[phantom.APP_JSON_SERVER]
+
+        # we will be downloading files for this action, so create a tmp folder for it
+        temp_dir = mkdtemp(prefix="vsphere-", dir=self._get_vault_tmp_dir())
+
+        if not os.path.exists(temp_dir):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_MAKE_TEMP_FOLDER)
+
+        # map the snapshot name to the url of its file on the datastore
+        snap_file_url, memory_url = self._get_snapshot_file_url(server, snap_name, vm, datacenter, temp_dir, action_result, id)
+        if not snap_file_url:
+            return action_result.get_status()
+
+        # Set the status to failure, this is to override the successfull download status of the snapshot list file,
+        action_result.set_status(phantom.APP_ERROR)
+
+        local_file_path = self._get_vault_file_name(
+            f"{temp_dir}/{phantom.get_valid_file_name(phantom.get_valid_file_name(snap_name))}-{phantom.get_file_name_from_url(snap_file_url[VSPHERE_CONST_URL])}"
+        )
+
+        self.save_progress(VSPHERE_PROG_SNAPSHOT_DOWNLOADING, snap_name=snap_name)
+        file_info = {}
+        status_code, content_size = self._download_file(snap_file_url, action_result, local_file_path, file_info)
+        if phantom.is_fail(status_code):
+            return action_result.get_status()
+
+        # move it to the vault
+        try:
+            status_code = self._add_checkpoint_file_to_vault(
+                server,
+                self.get_container_id(),
+                vmx_path,
+                VSPHERE_CONST_SNAPSHOT_FILE_TYPE,
+                local_file_path,
+                content_size,
+                file_info,
+                memory_url,
+                extract_memory,
+                memory_only,
+                action_result,
+            )
+
+        # remove the temp folder
+        finally:
+            try:
+                os.rmdir(temp_dir)
+            except Exception as e:
+                self.debug_print("Handled exception", e)
+        return action_result.get_status()
+
+    def _download_suspend_file(self, vmx_path, config, action_result, vm, container_id, datacenter, extract_memory=False, memory_only=False):
+        """Function that downloads the suspend file from the esx host
+
+        Args:
+            vmx_path: The vmx_path of the vm
+            config: The config given to the connector
+            action_result: ActionResult object to update the status to
+            vm: The pyshpere vm object
+            extract_memory: Also add the memory of the vm, extracted from the file, to the vault
+            memory_only: Add only the memory of the vm to the vault, not the file
+
+        Return:
+            A status code
+        """
+
+        # Init the status to failure
+        action_result.set_status(phantom.APP_ERROR)
+
+        # Progress and config
+        self.save_progress(VSPHERE_PROG_SUSPEND_FILE_DOWNLOADING)
+        server = config[phantom.APP_JSON_SERVER]
+
+        vm_suspend_url = self._create_url_of_file(server, "suspend", vm, datacenter)
+
+        if not vm_suspend_url:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_FIND_SUSPEND_FILE)
+
+        # the memory of the vm is in a separate file since vSphere 6.0, it is only downloaded if it has to be extracted
+        memory_url = self._create_url_of_file(server, "suspendMemory", vm, datacenter) if (extract_memory or memory_only) else None
+
+        # we will be downloading file for this action, so create a tmp folder for it
+        temp_dir = mkdtemp(prefix="vsphere-", dir=self._get_vault_tmp_dir())
+
+        if not os.path.exists(temp_dir):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_MAKE_TEMP_FOLDER)
+
+        # download it
+        local_file_path = self._get_vault_file_name(f"{temp_dir}/{phantom.get_file_name_from_url(vm_suspend_url[VSPHERE_CONST_URL])}")
+        file_info = {}
+        status_code, content_size = self._download_file(vm_suspend_url, action_result, local_file_path, file_info)
+
+        if phantom.is_fail(status_code):
+            return action_result.get_status()
+
+        # move it to the vault
+        try:
+            status_code = self._add_checkpoint_file_to_vault(
+                server,
+                container_id,
+                vmx_path,
+                VSPHERE_CONST_SUSPEND_FILE_TYPE,
+                local_file_path,
+                content_size,
+                file_info,
+                memory_url,
+                extract_memory,
+                memory_only,
+                action_result,
+            )
+        finally:
+            try:
+                # remove the temp folder
+                os.rmdir(temp_dir)
+            except Exception as e:
+                self.debug_print("Handled exception", e)
+        return action_result.get_status()
+
+    def _get_latest_snapshot_info(self, vm):
+        """Function that returns the name and id of the latest snapshot of a vm
+
+        Args:
+            vm: The pyshpere vm object
+
+        Return:
+            The name and the number of the mor (e.g. 42 of snapshot-42) of the snapshot, None, None if there are none
+        """
+
+        vm_props = self._get_vm_properties(str(vm._mor), VSPHERE_CONST_SNAPSHOT_PROPERTIES)
+        snapshots = self._create_snapshot_table(vm_props) if vm_props else []
+
+        if not snapshots:
+            return None, None
+
+        last_snap = max(snapshots, key=lambda x: x[VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH])
+        self.debug_print("last create time epoch", last_snap[VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH])
+        self.debug_print("last snap name", last_snap[VSPHERE_JSON_NAME])
+
+        return last_snap[VSPHERE_JSON_NAME], last_snap[VSPHERE_JSON_SNAPSHOT_ID].split("-")[-1]
+
+    def _handle_take_snapshot(self, action, config, param, container_id):
+        """Function that handles ACTION_ID_TAKE_SNAPSHOT
 
         Args:
 
@@ -292,578 +4390,882 @@ class VsphereConnector(BaseConnector):
         if phantom.is_fail(status_code):
             return status_code
 
-        # create an action_result
-        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        # create an action_result to represent this item
         action_result = self.add_action_result(ActionResult(dict(param)))
 
-        # get the config
         # The path will contain the datacenter also
         datacenter, vmx_path = self._parse_vm_path(param[VSPHERE_JSON_VMX_PATH])
 
-        # Get the vm from the path
+        self.debug_print("datacenter", datacenter)
+        self.debug_print("vmx_path", vmx_path)
+
+        # Get the vm object from the vmx path
         try:
-            vm = self._vs_server.get_vm_by_path(vmx_path, datacenter)
+            vm = self._get_vm_by_path(vmx_path, datacenter)
         except Exception as e:
             return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
 
-        task = None
-        # Only stop if powered on, else the API returns back an error
-        if (action == self.ACTION_ID_STOP_GUEST) and vm.is_powered_on():
-            task = vm.power_off(sync_run=False)
-        # Only start if it can be, else the API returns back an error
-        elif (action == self.ACTION_ID_START_GUEST) and (not vm.is_powered_on()):
-            task = vm.power_on(sync_run=False)
+        snap_name = VSPHERE_CONST_SNAPSHOT_NAME_PREFIX + phantom.get_random_chars()
+        snap_desc = VSPHERE_CONST_SNAPSHOT_DESCRIPTION.format(container_id=self.get_container_id())
 
-        if task:
-            status_code = self._wait_for_async_task(task, action, action_result)
-        else:
-            # Most probably we don't have to change the state right now, treat this
-            # as a success case (debatable)
-            action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_CANT_EXEC, action=action, state=vm.get_status())
+        self.save_progress(VSPHERE_PROG_SNAPSHOT_NAME, snap_name=snap_name)
 
-        return action_result.get_status()
+        task = vm.create_snapshot(snap_name, description=snap_desc, memory=True, sync_run=False)
+        status_code = self._wait_for_async_task(task, action, action_result)
 
-    def _handle_start_guest(self, action, config, param):
-        """Function that handles ACTION_ID_START_GUEST action
+        state_not_changed = False
 
-        Args:
+        if action_result.get_message().find(VSPHERE_VIRTUAL_MACHINE_NOT_CHANGED) != -1:
+            state_not_changed = True
 
-        Return:
-            A status code
-        """
+        if phantom.is_fail(status_code) and (not state_not_changed):
+            return status_code
+        else:
+            message = VSPHERE_VIRTUAL_MACHINE_NOT_CHANGED if (state_not_changed) else VSPHERE_PROG_SNAPSHOT_TAKEN
 
-        return self._handle_start_stop_guest(action, config, param)
+            self.save_progress(message)
+            action_result.set_status(phantom.APP_SUCCESS, message)
 
-    def _handle_stop_guest(self, action, config, param):
-        """Function that handles ACTION_ID_STOP_GUEST action
+        # now check if it needs to be downloaded
+        download = bool(param[phantom.APP_JSON_DOWNLOAD]) if (phantom.APP_JSON_DOWNLOAD in param) else True
+        if download:
+            # set the action result to failure
+            self.set_status(phantom.APP_ERROR)
+            id = None
+            if state_not_changed:
+                snap_name, id = self._get_latest_snapshot_info(vm)
+                if not snap_name or not id:
+                    return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_FAILED_TO_GET_SNAPSHOT_INFO)
+                self.debug_print(f"Latest snapshot: {snap_name} with id {id}")
 
-        Args:
+            status_code = self._download_snapshot_file(
+                snap_name,
+                vmx_path,
+                config,
+                vm,
+                action_result,
+                datacenter,
+                id,
+                param.get(VSPHERE_JSON_EXTRACT_MEMORY, False),
+                param.get(VSPHERE_JSON_MEMORY_ONLY, False),
+            )
 
-        Return:
-            A status code
-        """
-        return self._handle_start_stop_guest(action, config, param)
+        # apply the retention policy of the asset, a failure to prune does not fail the action
+        if (self._snapshot_keep_last is not None) or (self._snapshot_max_age is not None):
+            vm_props = self._get_vm_properties(str(vm._mor), VSPHERE_CONST_SNAPSHOT_PROPERTIES)
+            try:
+                rows = self._prune_snapshots([(datacenter, vm_props)], self._snapshot_keep_last, self._snapshot_max_age) if vm_props else []
+            except Exception as e:
+                self.debug_print("Unable to apply the snapshot retention policy", e)
+                rows = []
+            pruned = len([x for x in rows if x[phantom.APP_JSON_STATUS] == VSPHERE_CONST_TASK_SUCCEEDED])
+            for curr_data in rows:
+                if curr_data[phantom.APP_JSON_STATUS] != VSPHERE_CONST_TASK_SUCCEEDED:
+                    self.debug_print(f"Unable to remove snapshot {curr_data[VSPHERE_JSON_SNAPSHOT_ID]}", curr_data[phantom.APP_JSON_MESSAGE])
+            action_result.update_summary({VSPHERE_JSON_SNAPSHOTS_PRUNED: pruned})
 
-    def _create_url_from_path(self, server, vm_file_path, datacenter):
-        """Function that creates a url from the path
+        return action_result.get_status()
+
+    def _take_disk_snapshot(self, vm, action, action_result, property_names):
+        """Function that takes a snapshot of the disks of a vm, without its memory. The snapshot is named and
+        described as the ones of 'snapshot vm', so that 'prune snapshots' removes it if it is left behind.
 
         Args:
-        server: The ip or machine name of the esx host
-        vm_file_path: The path of the file, it is expected to be of the format
-            [<datastore_name>] <folder>/<name>-<random_chars>.<extension>
-        datacenter: The text that tell which datacenter to use while creating the url
+            vm: The pysphere vm object
+            action: The action identifier
+            action_result: The ActionResult object to hold the status
+            property_names: The list of vm properties to fetch once the snapshot is taken
 
         Return:
-        The url of the file on success.
+            The managed object reference id of the snapshot, None on failure
+            The dictionary of vm properties
         """
 
-        # it's always in the following format
-        # [datastore1] WXP3x86/WXP3x86-<random_chars>.<extension>
+        snap_name = VSPHERE_CONST_SNAPSHOT_NAME_PREFIX + phantom.get_random_chars()
+        snap_desc = VSPHERE_CONST_SNAPSHOT_DESCRIPTION.format(container_id=self.get_container_id())
 
-        # print "Got vm_file_path: {}".format(vm_file_path)
-        # extract the dsName part
-        start = vm_file_path.find("[") + 1
-        end = vm_file_path.find("]")
-        ds_name = vm_file_path[start:end]
-        # print "dsName: '%s'" % ds_name
+        self.save_progress(VSPHERE_PROG_SNAPSHOT_NAME, snap_name=snap_name)
 
-        # Get the file path after the datastore
-        start = vm_file_path.find("]") + 2
+        try:
+            task = vm.create_snapshot(snap_name, description=snap_desc, memory=False, sync_run=False)
+        except Exception as e:
+            action_result.set_status(phantom.APP_ERROR, phantom.APP_ERR_CMD_EXEC, e)
+            return None, None
 
-        file_path = vm_file_path[start:]
+        if phantom.is_fail(self._wait_for_async_task(task, action, action_result)):
+            return None, None
 
-        # now create the query url, which is of the fomat 'https://{}/folder/{}?dcPath={}&dsName={}'
+        property_names = list(dict.fromkeys([VSPHERE_CONST_PROP_VMX_PATH, VSPHERE_CONST_PROP_CURRENT_SNAPSHOT, *property_names]))
+        vm_props = self._get_vm_properties(str(vm._mor), property_names)
+        snapshot_id = str(vm_props.get(VSPHERE_CONST_PROP_CURRENT_SNAPSHOT) or "") if vm_props else ""
+        if not snapshot_id:
+            action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_FAILED_TO_GET_SNAPSHOT_INFO)
+            return None, None
 
-        file_url = {}
-        file_url[VSPHERE_CONST_URL] = f"https://{server}/folder/{file_path}"
-        file_url[VSPHERE_CONST_DATACENTER] = datacenter
-        file_url[VSPHERE_CONST_DATASTORE] = ds_name
+        return snapshot_id, vm_props
 
-        return file_url
+    def _discard_snapshot(self, snapshot_id, action):
+        """Function that removes a snapshot taken by _take_disk_snapshot. A failure is only logged,
+        'prune snapshots' removes the snapshot later on.
 
-    def _create_url_of_file(self, server, file_type, vm, datacenter, file_name=None):
-        """Function that creates a url of a given file that is present on the vm.
+        Args:
+            snapshot_id: The managed object reference id of the snapshot
+            action: The action identifier
+        """
+
+        try:
+            if self._wait_for_tasks([self._remove_snapshot(snapshot_id)], action)[0] != VITask.STATE_SUCCESS:
+                self.debug_print(f"Unable to remove snapshot {snapshot_id}")
+        except Exception as e:
+            self.debug_print(f"Unable to remove snapshot {snapshot_id}", e)
+
+    def _query_changed_disk_areas(self, vm_mor, snapshot_id, device_key, capacity, change_id):
+        """Function that queries the areas of a disk that changed between a change id and a snapshot.
+        The server answers for a window of the disk at a time, so it is queried until the end of the disk.
 
         Args:
-            server: The ip or machine name of the esx host
-            file_type: The file type that must match the type returned using the 'files' property of the vm.
-            file_name: The file name that must match the name returned using the 'files' property of the vm.
+            vm_mor: The managed object reference id of the vm, e.g. 'vm-42'
+            snapshot_id: The managed object reference id of the snapshot, e.g. 'snapshot-42'
+            device_key: The device key of the disk
+            capacity: The capacity of the disk in bytes
+            change_id: The change id to query the changes since, '*' for all the allocated areas
 
         Return:
-            The url of the file on success, None otherwise.
+            A list of [offset, length] of the changed areas, in order, adjacent areas merged
         """
 
-        # get the files for this vm
-        files = vm.get_property("files", from_cache=False)
-        # self.debug_print("files data", files)
-        vm_file = None
-
-        for k, v in list(files.items()):
-            # first match file type
-            if v["type"] != file_type:
-                continue
+        extents = []
+        offset = 0
+
+        while offset < capacity:
+            request = VI.QueryChangedDiskAreasRequestMsg()
+            mor_vm = request.new__this(vm_mor)
+            mor_vm.set_attribute_type(MORTypes.VirtualMachine)
+            request.set_element__this(mor_vm)
+            mor_snap = request.new_snapshot(snapshot_id)
+            mor_snap.set_attribute_type(MORTypes.VirtualMachineSnapshot)
+            request.set_element_snapshot(mor_snap)
+            request.set_element_deviceKey(device_key)
+            request.set_element_startOffset(offset)
+            request.set_element_changeId(change_id)
+
+            info = self._vs_server._proxy.QueryChangedDiskAreas(request)._returnval
+
+            for area in self._get_array(getattr(info, "ChangedArea", None)):
+                if extents and (extents[-1][0] + extents[-1][1] == area.Start):
+                    extents[-1][1] += area.Length
+                else:
+                    extents.append([area.Start, area.Length])
 
-            # file type matched
-            if not file_name:
-                # no need to match the name, since type matched, file is found
-                vm_file = v["name"]
+            if not info.Length:
                 break
+            offset = info.StartOffset + info.Length
 
-            if (file_name) and (v["name"].find(file_name) != -1):
-                # file_name is specified and it matched
-                vm_file = v["name"]
-                break
+        return extents
 
-        if vm_file is None:
-            # Not found
-            return None
+    def _write_disk_delta_header(self, path, header):
+        """Function that creates a disk delta file with its header, see VSPHERE_CONST_DISK_DELTA_MAGIC
 
-        return self._create_url_from_path(server, vm_file, datacenter)
+        Args:
+            path: The path of the file
+            header: The header dictionary
 
-    def _move_file_to_vault(self, host, container_id, file_size, type_str, local_file_path, result, info, contains):
-        """Function that creates a url from the path
+        Return:
+            The offset of the data of the extents
+        """
+
+        data = json.dumps(header).encode()
+        prefix = VSPHERE_CONST_DISK_DELTA_MAGIC + len(data).to_bytes(8, "big") + data
+
+        with open(path, "wb") as f:
+            f.write(prefix)
+
+        return -(-len(prefix) // VSPHERE_CONST_DISK_DELTA_ALIGNMENT) * VSPHERE_CONST_DISK_DELTA_ALIGNMENT
+
+    def _read_disk_delta_header(self, path):
+        """Function that reads the header of a disk delta file
 
         Args:
-            host: The ip or machine name of the esx host
-            container_id: The container_id to add the file to
-            vmx_path: The vmx_path of the vm
-            file_size: Size of the file in bytes that is to be added to vault
-            type_str: A string representing the type of the file
-            local_file_path: The local file path that is to be added to the vault
-            result: The ActionResult object to hold the status
+            path: The path of the file
 
         Return:
-            A status code of the type phantom.APP_[SUCC|ERR]_XXX
+            The header dictionary and the offset of the data of the extents, None, None if the file is not a disk delta
         """
 
-        self.save_progress(phantom.APP_PROG_ADDING_TO_VAULT)
+        with open(path, "rb") as f:
+            if f.read(len(VSPHERE_CONST_DISK_DELTA_MAGIC)) != VSPHERE_CONST_DISK_DELTA_MAGIC:
+                return None, None
+            length = int.from_bytes(f.read(8), "big")
+            header = json.loads(f.read(length))
 
-        # lets move the data into the vault
-        vault_attach_dict = {}
-        vault_attach_dict[phantom.APP_JSON_HOST] = host
-        vault_attach_dict[phantom.APP_JSON_INFO] = info
-        vault_attach_dict[phantom.APP_JSON_CONTAINS] = contains
-        vault_attach_dict[phantom.APP_JSON_SIZE] = file_size
-        vault_attach_dict[phantom.APP_JSON_TYPE] = type_str
-        vault_attach_dict[phantom.APP_JSON_ACTION_NAME] = self.get_action_name()
-        vault_attach_dict[phantom.APP_JSON_APP_RUN_ID] = self.get_app_run_id()
+        prefix = len(VSPHERE_CONST_DISK_DELTA_MAGIC) + 8 + length
 
-        curr_data = vault_attach_dict
+        return header, -(-prefix // VSPHERE_CONST_DISK_DELTA_ALIGNMENT) * VSPHERE_CONST_DISK_DELTA_ALIGNMENT
 
-        file_name = os.path.basename(local_file_path)
+    def _download_disk_extents(self, file_url, extents, path, data_offset):
+        """Function that downloads areas of a datastore file, with HTTP Range requests over a bounded pool of threads,
+        and writes them one after the other from an offset of a local file. Raises an exception on failure.
 
-        try:
-            os.chmod(os.path.dirname(local_file_path), 0o770)
-            success, message, vault_id = ph_rules.vault_add(
-                file_location=local_file_path, container=container_id, file_name=file_name, metadata=vault_attach_dict
-            )
+        Args:
+            file_url: The url dictionary of the datastore file, see _create_url_from_path
+            extents: The list of [offset, length] of the areas to download
+            path: The path of the local file
+            data_offset: The offset of the local file to write the first area at
+        """
 
-        except Exception as e:
-            return result.set_status(phantom.APP_ERROR, phantom.APP_ERR_FILE_ADD_TO_VAULT, e)
+        params = {x: file_url[x] for x in [VSPHERE_CONST_DATACENTER, VSPHERE_CONST_DATASTORE]}
 
-        if success:
-            curr_data[phantom.APP_JSON_VAULT_ID] = vault_id
-            curr_data[phantom.APP_JSON_NAME] = file_name
-            result.add_data(curr_data)
-            wanted_keys = [phantom.APP_JSON_VAULT_ID, phantom.APP_JSON_NAME, phantom.APP_JSON_SIZE]
-            summary = dict([(x, curr_data[x]) for x in wanted_keys if x in curr_data])
-            result.update_summary(summary)
-            result.set_status(phantom.APP_SUCCESS)
-        else:
-            result.set_status(phantom.APP_ERROR, phantom.APP_ERR_FILE_ADD_TO_VAULT)
-            result.append_to_message(message)
+        # big areas are split in segments, so that they are spread over the workers
+        segments = []
+        write_offset = data_offset
+        for start, length in extents:
+            for segment_start in range(start, start + length, VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE):
+                segment_end = min(segment_start + VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE, start + length) - 1
+                segments.append((segment_start, segment_end, write_offset))
+                write_offset += segment_end + 1 - segment_start
+
+        bytes_to_download = write_offset - data_offset
+        downloaded = [0]
+        lock = threading.Lock()
 
-        return result.get_status()
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.ftruncate(fd, write_offset)
+
+            with ThreadPoolExecutor(max_workers=VSPHERE_CONST_DOWNLOAD_WORKERS) as executor:
+                pending = {
+                    executor.submit(self._download_segment, file_url[VSPHERE_CONST_URL], params, None, fd, start, end, downloaded, lock, offset)
+                    for start, end, offset in segments
+                }
+
+                while pending:
+                    done, pending = wait(pending, timeout=VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+                    for future in done:
+                        if future.exception():
+                            for x in pending:
+                                x.cancel()
+                            raise future.exception()
+                    if bytes_to_download:
+                        self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, float(downloaded[0]) / float(bytes_to_download))
+
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
-    def _download_file(self, url_to_download, action_result, local_file_path):
-        """Function that downloads the file from a url
+    def _get_disk_extent_file(self, vm_props, snapshot_id, disk, action_result):
+        """Function that finds the extent file to read the data of a disk at a snapshot from. The changed areas
+        are offsets in the whole disk, so only the flat extent of a disk without delta files can be read as is,
+        the sparse delta files of earlier snapshots are not read.
 
         Args:
-            url_to_download: the url of the file to download
+            vm_props: The dictionary of the VSPHERE_CONST_CBT_PROPERTIES properties of the vm
+            snapshot_id: The managed object reference id of the snapshot
+            disk: The VirtualDisk device of the snapshot
             action_result: The ActionResult object to hold the status
-            local_file_path: The local file path that was created.
 
         Return:
-            A status code of the type phantom.APP_[SUCC|ERR]_XXX.
-            The size in bytes of the file downloaded.
+            A status code, and the file of the extended file layout of the vm
         """
 
-        content_size = 0
+        label = disk.DeviceInfo.Label
 
-        # Which percent chunks will the download happen for big files
-        percent_block = 10
+        if not getattr(disk.Backing, "ChangeId", None):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CBT_NOT_ACTIVE.format(disk=label)), None
 
-        # size that sets a file as big.
-        # A big file will be downloaded in chunks of percent_block else it will be a synchronous download
-        big_file_size_bytes = 20 * (1024 * 1024)
+        files = {x.Key: x for x in self._get_array(vm_props.get(VSPHERE_CONST_PROP_LAYOUT_FILES))}
+        layout = next((x for x in self._get_array(vm_props.get(VSPHERE_CONST_PROP_LAYOUT_SNAPSHOTS)) if str(x.Key) == snapshot_id), None)
+        disk_layout = next((x for x in self._get_array(getattr(layout, "Disk", None)) if x.Key == disk.Key), None)
+        chain = self._get_array(getattr(disk_layout, "Chain", None))
+        if len(chain) != 1:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_DISK_CHAIN.format(disk=label)), None
 
-        self.save_progress(phantom.APP_PROG_DOWNLOADING_FILE_FROM_TO, src=url_to_download[VSPHERE_CONST_URL], dest=local_file_path)
+        extent_file = next(
+            (files[x] for x in self._get_array(chain[0].FileKey) if (x in files) and (files[x].Type == VSPHERE_CONST_DISK_EXTENT)), None
+        )
+        if not extent_file:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_DISK_EXTENT_FILE.format(disk=label)), None
 
-        self.debug_print("Complete URL", url_to_download)
+        return phantom.APP_SUCCESS, extent_file
 
-        # Create the param dictionary
-        keys = [VSPHERE_CONST_DATACENTER, VSPHERE_CONST_DATASTORE]
-        params = {x: url_to_download[x] for x in keys}
+    def _export_disk_changes(self, server, datacenter, vm_props, snapshot_id, disk, extent_file, full, temp_dir, action_result):
+        """Function that exports the areas of a disk that changed since its last export, as of a snapshot,
+        to a disk delta file added to the vault. The areas are read from the extent file of the disk, which
+        is read-only while the snapshot exists. The change id of the snapshot is kept as the starting point
+        of the next export.
+
+        Args:
+            server: The ip or machine name of the esx host
+            datacenter: The name of the datacenter of the vm
+            vm_props: The dictionary of the VSPHERE_CONST_CBT_PROPERTIES properties of the vm
+            snapshot_id: The managed object reference id of the snapshot
+            disk: The VirtualDisk device of the snapshot
+            extent_file: The extent file of the disk, see _get_disk_extent_file
+            full: Export all the allocated areas, instead of the changes since the last export
+            temp_dir: The folder to create the file in
+            action_result: The ActionResult object to hold the status
+
+        Return:
+            A status code, and the number of bytes exported
+        """
+
+        label = disk.DeviceInfo.Label
+        device_key = disk.Key
+        capacity = getattr(disk, "CapacityInBytes", None) or (disk.CapacityInKB * 1024)
+        change_id = disk.Backing.ChangeId
+
+        vm_mor = vm_props[VSPHERE_CONST_VM_MOR]
+        change_ids = self._state.setdefault(VSPHERE_CONST_STATE_CHANGE_IDS, {}).setdefault(vm_mor, {})
+        previous_change_id = (None if full else change_ids.get(str(device_key))) or VSPHERE_CONST_CBT_ALL_AREAS
+
+        full_vmx_path = f"[{datacenter}]" + vm_props[VSPHERE_CONST_PROP_VMX_PATH]
+        local_file_path = "{}/{}{}".format(
+            temp_dir,
+            phantom.get_valid_file_name(f"{vm_props.get(VSPHERE_CONST_PROP_NAME)}-{device_key}-{change_id}"),
+            VSPHERE_CONST_DISK_DELTA_EXTENSION,
+        )
 
         try:
-            r = requests.get(url_to_download[VSPHERE_CONST_URL], params=params, verify=self._verify, auth=self._auth, stream=True, timeout=30)
+            self.save_progress(VSPHERE_PROG_QUERYING_CHANGES, disk=label)
+            try:
+                extents = self._query_changed_disk_areas(vm_mor, snapshot_id, device_key, capacity, previous_change_id)
+            except Exception as e:
+                if previous_change_id == VSPHERE_CONST_CBT_ALL_AREAS:
+                    raise
+                # the change id is not valid anymore, e.g. changed block tracking was reset
+                self.debug_print(f"Unable to query the changes since {previous_change_id}", e)
+                previous_change_id = VSPHERE_CONST_CBT_ALL_AREAS
+                extents = self._query_changed_disk_areas(vm_mor, snapshot_id, device_key, capacity, previous_change_id)
+
+            if previous_change_id == VSPHERE_CONST_CBT_ALL_AREAS:
+                self.save_progress(VSPHERE_PROG_FULL_DISK_EXPORT, disk=label)
+
+            header = {
+                VSPHERE_JSON_VMX_PATH: full_vmx_path,
+                VSPHERE_JSON_GUEST_NAME: vm_props.get(VSPHERE_CONST_PROP_NAME),
+                VSPHERE_JSON_SNAPSHOT_ID: snapshot_id,
+                VSPHERE_JSON_DISK_LABEL: label,
+                VSPHERE_JSON_DEVICE_KEY: device_key,
+                VSPHERE_JSON_CAPACITY: capacity,
+                VSPHERE_JSON_CHANGE_ID: change_id,
+                VSPHERE_JSON_PREVIOUS_CHANGE_ID: previous_change_id,
+                VSPHERE_JSON_EXTENTS: extents,
+            }
+            data_offset = self._write_disk_delta_header(local_file_path, header)
+
+            file_url = self._create_url_from_path(server, extent_file.Name, datacenter)
+            self._download_disk_extents(file_url, extents, local_file_path, data_offset)
+
+            file_size = os.path.getsize(local_file_path)
+            hashers = {VSPHERE_JSON_SHA256: hashlib.sha256()}
+            self._hash_file_range(hashers, None, local_file_path, 0, file_size)
         except Exception as e:
-            return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_CONNECTION, e), content_size)
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_EXPORT_DISK.format(disk=label), e), 0
+
+        changed_bytes = sum(length for _, length in extents)
+        file_info = {x: header.get(x) for x in VSPHERE_CONST_DISK_DELTA_KEYS}
+        file_info.update({VSPHERE_JSON_SHA256: hashers[VSPHERE_JSON_SHA256].hexdigest(), VSPHERE_JSON_TOTAL_EXTENTS: len(extents)})
+        file_info[VSPHERE_JSON_CHANGED_BYTES] = changed_bytes
+
+        status_code = self._move_file_to_vault(
+            server,
+            self.get_container_id(),
+            file_size,
+            VSPHERE_CONST_DISK_DELTA_FILE_TYPE,
+            local_file_path,
+            action_result,
+            {VSPHERE_JSON_VMX_PATH: full_vmx_path},
+            [VSPHERE_CONST_DISK_DELTA_FILE_TYPE],
+            file_info,
+        )
+
+        # the next export starts from this one, only once it is in the vault
+        if phantom.is_success(status_code):
+            change_ids[str(device_key)] = change_id
+
+        return status_code, changed_bytes
+
+    def _handle_export_disk_changes(self, action, config, param):
+        """Function that handles ACTION_ID_EXPORT_DISK_CHANGES. A snapshot of the disks of the vm is taken,
+        the areas of each disk that changed since its last export are exported, then the snapshot is removed.
+
+        Args:
+            action: The action identifier
+            config: The config given to the connector
+            param: The parameters of the action
+
+        Return:
+            A status code
+        """
 
-        if r.status_code != requests.codes.ok:  # pylint: disable=E1101
-            return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_RETURNED_STATUS_CODE, code=r.status_code), content_size)
+        # Connect to the server
+        status_code = self._connect_to_server(config)
 
-        # get the content length
-        content_size = r.headers["content-length"]
+        if phantom.is_fail(status_code):
+            return status_code
 
-        if not content_size:
-            return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_GET_CONTENT_LENGTH), content_size)
+        action_result = self.add_action_result(ActionResult(dict(param)))
 
-        self.save_progress(phantom.APP_PROG_FILE_SIZE, value=content_size, type="bytes")
+        server = config[phantom.APP_JSON_SERVER]
+        datacenter, vmx_path = self._parse_vm_path(param[VSPHERE_JSON_VMX_PATH])
 
-        bytes_to_download = int(content_size)
+        try:
+            vm = self._get_vm_by_path(vmx_path, datacenter)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
 
-        # init to download the whole file in a single read
-        block_size = bytes_to_download
+        vm_mor = str(vm._mor)
+        vm_props = self._get_vm_properties(vm_mor, [VSPHERE_CONST_PROP_VMX_PATH, VSPHERE_CONST_PROP_CBT_ENABLED, VSPHERE_CONST_PROP_SNAPSHOTS])
+        if not vm_props or not vm_props.get(VSPHERE_CONST_PROP_CBT_ENABLED):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CBT_DISABLED)
 
-        # if the file is big then download in % increments
-        if bytes_to_download > big_file_size_bytes:
-            block_size = (bytes_to_download * percent_block) / 100
+        # the disks of a vm with snapshots are spread over delta files, which cannot be read as is
+        if self._get_array(vm_props.get(VSPHERE_CONST_PROP_SNAPSHOTS)):
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_HAS_SNAPSHOTS)
 
-        bytes_downloaded = 0
+        snapshot_id, vm_props = self._take_disk_snapshot(vm, action, action_result, VSPHERE_CONST_CBT_PROPERTIES)
+        if not snapshot_id:
+            return action_result.get_status()
 
+        temp_dir = None
+        total_changed_bytes = 0
         try:
-            with open(local_file_path, "wb") as file_handle:
-                for chunk in r.iter_content(chunk_size=block_size):
-                    if chunk:
-                        bytes_downloaded += len(chunk)
-                        file_handle.write(chunk)
-                        file_handle.flush()
-                        os.fsync(file_handle.fileno())
-                        self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, float(bytes_downloaded) / float(bytes_to_download))
+            obj_content = self._vs_server._get_object_properties(
+                VIMor(snapshot_id, MORTypes.VirtualMachineSnapshot), property_names=[VSPHERE_CONST_PROP_SNAPSHOT_DEVICES]
+            )
+            devices = self._get_array(getattr(obj_content.PropSet[0], "Val", None) if getattr(obj_content, "PropSet", None) else None)
+            disks = [x for x in devices if x.typecode.type[1] == VSPHERE_CONST_VIRTUAL_DISK]
+
+            if not disks:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_NO_DISKS)
+
+            # all the disks are checked before any of them is exported
+            extent_files = []
+            for disk in disks:
+                status_code, extent_file = self._get_disk_extent_file(vm_props, snapshot_id, disk, action_result)
+                if phantom.is_fail(status_code):
+                    return action_result.get_status()
+                extent_files.append(extent_file)
+
+            temp_dir = mkdtemp(prefix="vsphere-", dir=self._get_vault_tmp_dir())
+
+            for disk, extent_file in zip(disks, extent_files):
+                status_code, changed_bytes = self._export_disk_changes(
+                    server, datacenter, vm_props, snapshot_id, disk, extent_file, param.get(VSPHERE_JSON_FULL, False), temp_dir, action_result
+                )
+                if phantom.is_fail(status_code):
+                    return action_result.get_status()
+                total_changed_bytes += changed_bytes
         except Exception as e:
-            return (action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_CONNECTION, e), content_size)
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_FAILED_TO_GET_SNAPSHOT_INFO, e)
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
-        return (action_result.set_status(phantom.APP_SUCCESS, phantom.APP_SUCC_FILE_DOWNLOAD), content_size)
+            if not param.get(VSPHERE_JSON_KEEP_SNAPSHOT, False):
+                self._discard_snapshot(snapshot_id, action)
+
+        action_result.update_summary({VSPHERE_JSON_TOTAL_DISKS: len(disks), VSPHERE_JSON_TOTAL_CHANGED_BYTES: total_changed_bytes})
 
-    def _parse_snap_list_file(self, local_file_path, snap_name, id):
-        """Function that parses the snapshot list file from a local location and return the file name
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _call_lease_method(self, method, lease, **elements):
+        """Function that calls a method of an export lease
 
         Args:
+            method: The name of the method, e.g. 'HttpNfcLeaseComplete'
+            lease: The managed object reference id of the lease
+            elements: The arguments of the method
 
         Return:
-            The file name that for the snapshot with 'snap_name' or None if not found
-
+            The value returned by the method
         """
 
-        snap_path = None
-        snap_list_dict = defaultdict(dict)
-        with open(local_file_path) as f:
-            for line in f:
-                # extract the snapshot index and values that we are interested in
-                # file name
-                m = re.search(r'snapshot([0-9]+)\.filename[ ]*=[ ]*"(.*)"', line)
-                if m:
-                    index = m.group(1)
-                    file_name = m.group(2)
-                    # print "File Name: {} at Index: {}".format(file_name, index)
-                    snap_list_dict[index].update({"key": index, "file_name": file_name})
-                    # try to see if this is the snapshot we are looking for
-                    # see if the display_Name for this snapshot has been filled in
-                    if VSPHERE_JSON_DISPLAY_NAME in snap_list_dict[index]:
-                        if snap_list_dict[index][VSPHERE_JSON_DISPLAY_NAME] == snap_name:
-                            if id is None:
-                                snap_path = snap_list_dict[index]["file_name"]
-                                break
-                            elif "id" in snap_list_dict[index]:
-                                if snap_list_dict[index]["id"] == id:
-                                    snap_path = snap_list_dict[index]["file_name"]
-                                    break
-                    continue
-
-                # display name
-                m = re.search(r'snapshot([0-9]+)\.displayName[ ]*=[ ]*"(.*)"', line)
-                if m:
-                    index = m.group(1)
-                    display_name = m.group(2)
-                    # print "Display Name: {} at Index: {}".format(display_name, index)
-                    snap_list_dict[index].update({"key": index, VSPHERE_JSON_DISPLAY_NAME: display_name})
-
-                    # try to see if this is the snapshot we are looking for
-                    if display_name == snap_name:
-                        # see if the file name for this snapshot has been filled in
-                        if "file_name" in snap_list_dict[index]:
-                            if id is None:
-                                snap_path = snap_list_dict[index]["file_name"]
-                                break
-                            elif "id" in snap_list_dict[index]:
-                                if snap_list_dict[index]["id"] == id:
-                                    snap_path = snap_list_dict[index]["file_name"]
-                                    break
-                    continue
+        request = getattr(VI, f"{method}RequestMsg")()
+        mor_lease = request.new__this(lease)
+        mor_lease.set_attribute_type(MORTypes.HttpNfcLease)
+        request.set_element__this(mor_lease)
+        for name, value in elements.items():
+            getattr(request, f"set_element_{name}")(value)
 
-                if id is not None:
-                    m = re.search(r'snapshot([0-9]+)\.uid[ ]*=[ ]*"(.*)"', line)
-                    if m:
-                        index = m.group(1)
-                        snap_id = m.group(2)
-                        # self.debug_print("Snap ID: {} at Index: {}".format(snap_id, index))
-                        snap_list_dict[index].update({"key": index, "id": snap_id})
-                        # try to see if this is the snapshot we are looking for
-                        if snap_id == id:
-                            # see if the file name for this snapshot has been filled in
-                            if "file_name" in snap_list_dict[index]:
-                                if VSPHERE_JSON_DISPLAY_NAME in snap_list_dict[index]:
-                                    if snap_list_dict[index][VSPHERE_JSON_DISPLAY_NAME] == snap_name:
-                                        snap_path = snap_list_dict[index]["file_name"]
-                                        break
-                        continue
-        return snap_path
+        return getattr(self._vs_server._proxy, method)(request)._returnval
 
-    def _download_snapshot_file(self, snap_name, vmx_path, config, vm, action_result, datacenter, id=None):
-        """Function that downloads the suspend file from the esx host
+    def _open_export_lease(self, snapshot_id):
+        """Function that opens an export lease of the disks of a snapshot and waits for it to be ready,
+        or for the task timeout of the asset to expire. Raises an exception on failure.
 
         Args:
-            snap_name: The name of the snapshot that is to be downloaded
-            vmx_path: The vmx_path of the vm
-            config: The config given to the connector
-            vm: The pyshpere vm object
-            action_result: ActionResult object to update the status to
+            snapshot_id: The managed object reference id of the snapshot
 
         Return:
-            A status code
+            The managed object reference id of the lease
+            The HttpNfcLeaseInfo of the lease
         """
 
-        # Progress and config
-        server = config[phantom.APP_JSON_SERVER]
+        request = VI.ExportSnapshotRequestMsg()
+        mor_snap = request.new__this(snapshot_id)
+        mor_snap.set_attribute_type(MORTypes.VirtualMachineSnapshot)
+        request.set_element__this(mor_snap)
 
-        # Downloading the snapshot is a multistep process.
-        # All we have is a snapshot name, there is no way to query the API
-        # to map this name to a file on disk (of the esx host) YET.
-        # So first we need to download the file that contains the snapshot list
-        # and info about each snapshot.
-        # Parse this file to map the snapshot name to the file_name on disk
-        # Then we create a url to the file_name.
-        # Then download it.
+        lease = str(self._vs_server._proxy.ExportSnapshot(request)._returnval)
 
-        # Create the url to the snapshot list file
-        snap_list_url = self._create_url_of_file(server, "snapshotList", vm, datacenter)
-        if not snap_list_url:
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_FIND_SNAPSHOT_LIST_FILE)
+        self.save_progress(VSPHERE_PROG_WAITING_FOR_LEASE)
 
-        # we will be downloading files for this action, so create a tmp folder for it
-        if hasattr(Vault, "get_vault_tmp_dir"):
-            temp_dir = mkdtemp(prefix="vsphere-", dir=Vault.get_vault_tmp_dir())
-        else:
-            temp_dir = mkdtemp(prefix="vsphere-", dir="/vault/tmp")
+        deadline = (time.time() + self._task_timeout) if self._task_timeout else None
+        interval = VSPHERE_CONST_TASK_POLL_MIN_INTERVAL
 
-        if not os.path.exists(temp_dir):
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_MAKE_TEMP_FOLDER)
+        while True:
+            obj_content = self._vs_server._get_object_properties(
+                VIMor(lease, MORTypes.HttpNfcLease), property_names=VSPHERE_CONST_LEASE_PROPERTIES
+            )
+            lease_props = {prop.Name: prop.Val for prop in getattr(obj_content, "PropSet", None) or []}
 
-        # download the file that contains all the snapshots
-        self.save_progress(VSPHERE_PROG_SNAPSHOT_INFO_DOWNLOADING, snap_name=snap_name)
-        local_file_path = f"{temp_dir}/{phantom.get_file_name_from_url(snap_list_url[VSPHERE_CONST_URL])}"
-        status_code, content_size = self._download_file(snap_list_url, action_result, local_file_path)
+            state = lease_props.get(VSPHERE_CONST_PROP_LEASE_STATE)
+            if state == VSPHERE_CONST_LEASE_READY:
+                return lease, lease_props.get(VSPHERE_CONST_PROP_LEASE_INFO)
 
-        if phantom.is_fail(status_code):
-            return action_result.get_status()
+            if state == VSPHERE_CONST_LEASE_ERROR:
+                raise Exception(getattr(lease_props.get(VSPHERE_CONST_PROP_LEASE_ERROR), "LocalizedMessage", None) or state)
 
-        # parse the downloaded file and get the file_name that our snapshot represents
-        snap_file = self._parse_snap_list_file(local_file_path, snap_name, id)
-        if not snap_file:
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SNAPSHOT_PATH, snap_name)
+            if deadline and (time.time() >= deadline):
+                self._call_lease_method("HttpNfcLeaseAbort", lease)
+                raise Exception(VSPHERE_ERR_TASK_TIMED_OUT.format(timeout=self._task_timeout))
 
-        # got the file name, now get the url of this file_name
-        snap_file_url = self._create_url_of_file(server, "snapshotData", vm, datacenter, snap_file)
-        if not snap_file_url:
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SNAPSHOT_URL, snap_name)
+            time.sleep(interval)
+            interval = min(interval * 2, VSPHERE_CONST_TASK_POLL_MAX_INTERVAL)
 
-        # Set the status to failure, this is to override the successfull download status of the snapshot list file,
-        action_result.set_status(phantom.APP_ERROR)
+    def _get_export_progress(self, files, capacity):
+        """Function that estimates the progress of the disks of an export lease, from the size of their files
 
-        os.remove(local_file_path)
+        Args:
+            files: The list of (device url, file url, local file path) of the disks
+            capacity: The total capacity of the disks in bytes
 
-        local_file_path = f"{temp_dir}/{phantom.get_valid_file_name(phantom.get_valid_file_name(snap_name))}-{phantom.get_file_name_from_url(snap_file_url[VSPHERE_CONST_URL])}"
+        Return:
+            The percentage of the export done, at most 99 until the lease is completed
+        """
 
-        self.save_progress(VSPHERE_PROG_SNAPSHOT_DOWNLOADING, snap_name=snap_name)
-        status_code, content_size = self._download_file(snap_file_url, action_result, local_file_path)
-        if phantom.is_fail(status_code):
-            return action_result.get_status()
+        done = 0
+        for _, file_url, local_file_path in files:
+            for path in (self._get_download_path(file_url[VSPHERE_CONST_URL_KEY], {}) + ".part", local_file_path):
+                if os.path.exists(path):
+                    done += os.path.getsize(path)
+                    break
 
-        # move it to the vault
-        try:
-            status_code = self._move_file_to_vault(
-                server,
-                self.get_container_id(),
-                content_size,
-                VSPHERE_CONST_SNAPSHOT_FILE_TYPE,
-                local_file_path,
-                action_result,
-                {VSPHERE_JSON_VMX_PATH: vmx_path},
-                ["os memory dump", VSPHERE_CONST_SNAPSHOT_FILE_TYPE],
-            )
+        return min(99, int(done * 100 / capacity)) if capacity else 0
 
-        # remove the temp folder
-        finally:
+    def _keep_lease_alive(self, lease, timeout, files, capacity, stop):
+        """Function that reports the progress of an export lease until stopped, as the server aborts a lease that is
+        not updated within its timeout. Runs in a thread, while the disks are downloaded.
+
+        Args:
+            lease: The managed object reference id of the lease
+            timeout: The timeout of the lease in seconds
+            files: The list of (device url, file url, local file path) of the disks
+            capacity: The total capacity of the disks in bytes
+            stop: The threading.Event to stop on
+        """
+
+        interval = min(VSPHERE_CONST_LEASE_KEEPALIVE_INTERVAL, max(1, (timeout or VSPHERE_CONST_LEASE_KEEPALIVE_INTERVAL) // 3))
+
+        while not stop.wait(interval):
             try:
-                os.rmdir(temp_dir)
+                self._call_lease_method("HttpNfcLeaseProgress", lease, percent=self._get_export_progress(files, capacity))
             except Exception as e:
-                self.debug_print("Handled exception", e)
-        return action_result.get_status()
+                self.debug_print("Unable to update the progress of the export lease", e)
 
-    def _download_suspend_file(self, vmx_path, config, action_result, vm, container_id, datacenter):
-        """Function that downloads the suspend file from the esx host
+    def _export_disk(self, file_url, local_file_path):
+        """Function that downloads a disk of an export lease. Runs in a worker thread, its progress is queued for
+        the thread of the action run.
 
         Args:
-            vmx_path: The vmx_path of the vm
-            config: The config given to the connector
-            action_result: ActionResult object to update the status to
-            vm: The pyshpere vm object
+            file_url: The url dictionary of the disk
+            local_file_path: The local file path to download the disk to
 
         Return:
-            A status code
+            A status code, the message, the size of the file and the dictionary of the hashes of the file
         """
 
-        # Init the status to failure
-        action_result.set_status(phantom.APP_ERROR)
-
-        # Progress and config
-        self.save_progress(VSPHERE_PROG_SUSPEND_FILE_DOWNLOADING)
-        server = config[phantom.APP_JSON_SERVER]
+        result = ActionResult()
+        file_info = {}
+        status_code, content_size = self._download_file(file_url, result, local_file_path, file_info)
 
-        vm_suspend_url = self._create_url_of_file(server, "suspend", vm, datacenter)
+        return status_code, result.get_message(), content_size, file_info
 
-        if not vm_suspend_url:
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_FIND_SUSPEND_FILE)
+    def _handle_export_vm_disks(self, action, config, param):
+        """Function that handles ACTION_ID_EXPORT_VM_DISKS. A snapshot of the disks of the vm is taken and exported
+        through an export (NFC) lease, the disks are streamed in parallel, as stream-optimized VMDK files, to the vault.
 
-        # we will be downloading file for this action, so create a tmp folder for it
-        if hasattr(Vault, "get_vault_tmp_dir"):
-            temp_dir = mkdtemp(prefix="vsphere-", dir=Vault.get_vault_tmp_dir())
-        else:
-            temp_dir = mkdtemp(prefix="vsphere-", dir="/vault/tmp")
+        Args:
+            action: The action identifier
+            config: The config given to the connector
+            param: The parameters of the action
 
-        if not os.path.exists(temp_dir):
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_CANNOT_MAKE_TEMP_FOLDER)
+        Return:
+            A status code
+        """
 
-        # download it
-        local_file_path = f"{temp_dir}/{phantom.get_file_name_from_url(vm_suspend_url[VSPHERE_CONST_URL])}"
-        status_code, content_size = self._download_file(vm_suspend_url, action_result, local_file_path)
+        # Connect to the server
+        status_code = self._connect_to_server(config)
 
         if phantom.is_fail(status_code):
+            return status_code
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        server = config[phantom.APP_JSON_SERVER]
+        datacenter, vmx_path = self._parse_vm_path(param[VSPHERE_JSON_VMX_PATH])
+
+        try:
+            vm = self._get_vm_by_path(vmx_path, datacenter)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
+
+        snapshot_id, vm_props = self._take_disk_snapshot(vm, action, action_result, [VSPHERE_CONST_PROP_NAME])
+        if not snapshot_id:
             return action_result.get_status()
 
-        # move it to the vault
+        lease = None
+        temp_dir = None
+        total_size = 0
         try:
-            status_code = self._move_file_to_vault(
-                server,
-                container_id,
-                content_size,
-                VSPHERE_CONST_SUSPEND_FILE_TYPE,
-                local_file_path,
-                action_result,
-                {VSPHERE_JSON_VMX_PATH: vmx_path},
-                ["os memory dump", VSPHERE_CONST_SUSPEND_FILE_TYPE],
-            )
-        finally:
             try:
-                # remove the temp folder
-                os.rmdir(temp_dir)
+                lease, lease_info = self._open_export_lease(snapshot_id)
             except Exception as e:
-                self.debug_print("Handled exception", e)
-        return action_result.get_status()
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_EXPORT_LEASE, e)
+
+            devices = [x for x in self._get_array(getattr(lease_info, "DeviceUrl", None)) if x.Disk]
+            if not devices:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_NO_DISKS)
+
+            # the urls of the lease are authenticated by the session, their host is '*' when it is the server
+            auth = SessionCookieAuth({k: v.coded_value for k, v in self._vs_server._proxy.binding.cookies.items()})
+            temp_dir = mkdtemp(prefix="vsphere-", dir=self._get_vault_tmp_dir())
+
+            # the urls of the lease hold a ticket of the lease, the disks are known by the vm, snapshot and device instead
+            files = []
+            for device in devices:
+                file_url = {
+                    VSPHERE_CONST_URL: device.Url.replace("*", server, 1),
+                    VSPHERE_CONST_URL_KEY: "/".join([server, str(vm._mor), snapshot_id, device.Key.strip("/")]),
+                    VSPHERE_CONST_URL_AUTH: auth,
+                    VSPHERE_CONST_URL_STREAM_OPTIMIZED: True,
+                }
+                file_name = phantom.get_valid_file_name(f"{vm_props.get(VSPHERE_CONST_PROP_NAME)}-{device.TargetId}")
+                files.append((device, file_url, f"{temp_dir}/{file_name}"))
+
+            capacity = (getattr(lease_info, "TotalDiskCapacityInKB", None) or 0) * 1024
+            stop = threading.Event()
+            keep_alive = threading.Thread(
+                target=self._keep_lease_alive, args=(lease, lease_info.LeaseTimeout, files, capacity, stop), daemon=True
+            )
+            keep_alive.start()
 
-    def _get_latest_snapshot_info(self, vm):
-        snapshot_list = vm.get_snapshots()
-
-        last_snap_time = 0
-        last_snap = None
-
-        for snapshot in snapshot_list:
-            create_time = snapshot.get_create_time()
-            create_time_secs = mktime(create_time)
-            if last_snap_time < create_time_secs:
-                last_snap_time = create_time_secs
-                last_snap = snapshot
-
-        if last_snap:
-            self.debug_print("last create time epoch", last_snap_time)
-            self.debug_print("last snap name", last_snap.get_name())
-            name = last_snap.get_name()
-            id = None
-            obj_string = last_snap.properties._obj
-            m = re.search(".*snapshot-([0-9]+)", obj_string)
-            if m:
-                id = m.group(1)
-            return name, id
+            self.save_progress(VSPHERE_PROG_EXPORTING_DISKS, total=len(files))
+            try:
+                with ThreadPoolExecutor(max_workers=min(len(files), VSPHERE_CONST_EXPORT_WORKERS)) as executor:
+                    futures = [executor.submit(self._export_disk, file_url, local_file_path) for _, file_url, local_file_path in files]
+                    pending = futures
+                    while pending:
+                        _, pending = wait(pending, timeout=VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL)
+                        self._flush_progress()
+                        if pending and capacity:
+                            self.send_progress(VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS, self._get_export_progress(files, capacity) / 100.0)
+                    results = [x.result() for x in futures]
+            finally:
+                stop.set()
+                keep_alive.join()
+
+            errors = [message for status_code, message, _, _ in results if phantom.is_fail(status_code)]
+            if errors:
+                return action_result.set_status(
+                    phantom.APP_ERROR, VSPHERE_ERR_EXPORT_DISKS.format(failed=len(errors), total=len(files)), "; ".join(errors)
+                )
+
+            self._call_lease_method("HttpNfcLeaseComplete", lease)
+            lease = None
+
+            for (_, _, local_file_path), (_, _, content_size, file_info) in zip(files, results):
+                status_code = self._move_file_to_vault(
+                    server,
+                    self.get_container_id(),
+                    content_size,
+                    VSPHERE_CONST_DISK_FILE_TYPE,
+                    local_file_path,
+                    action_result,
+                    {VSPHERE_JSON_VMX_PATH: param[VSPHERE_JSON_VMX_PATH]},
+                    [VSPHERE_CONST_DISK_FILE_TYPE],
+                    file_info,
+                )
+                if phantom.is_fail(status_code):
+                    return action_result.get_status()
+                total_size += int(content_size)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_EXPORT_LEASE, e)
+        finally:
+            if lease:
+                try:
+                    self._call_lease_method("HttpNfcLeaseAbort", lease)
+                except Exception as e:
+                    self.debug_print("Unable to abort the export lease", e)
 
-        return None, None
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
-    def _handle_take_snapshot(self, action, config, param, container_id):
-        """Function that handles ACTION_ID_TAKE_SNAPSHOT
+            if not param.get(VSPHERE_JSON_KEEP_SNAPSHOT, False):
+                self._discard_snapshot(snapshot_id, action)
+
+        action_result.update_summary({VSPHERE_JSON_TOTAL_DISKS: len(files), VSPHERE_JSON_TOTAL_SIZE: total_size})
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _rebuild_disk_image(self, image_path, files):
+        """Function that rebuilds the image of a disk from a base and the disk deltas exported since. The base is
+        a full disk delta, or a raw image of the disk. Each delta must hold the changes since the previous file.
+        The areas that were never written are left as holes of the sparse image file.
 
         Args:
+            image_path: The path of the image file to create
+            files: The list of (vault id, path) of the files, the base first
 
         Return:
-            A status code
+            The header of the last delta applied (None if there is none), and the number of deltas applied
         """
 
-        # Connect to the server
-        status_code = self._connect_to_server(config)
+        capacity = None
+        expected = VSPHERE_CONST_CBT_ALL_AREAS
+        last_header = None
+        applied = 0
 
-        if phantom.is_fail(status_code):
-            return status_code
+        with open(image_path, "wb") as image:
+            for i, (vault_id, path) in enumerate(files):
+                header, data_offset = self._read_disk_delta_header(path)
 
-        # create an action_result to represent this item
-        action_result = self.add_action_result(ActionResult(dict(param)))
+                if header is None:
+                    if i:
+                        raise Exception(VSPHERE_ERR_NOT_DISK_DELTA.format(vault_id=vault_id))
 
-        # The path will contain the datacenter also
-        datacenter, vmx_path = self._parse_vm_path(param[VSPHERE_JSON_VMX_PATH])
+                    # a raw image, the blocks of zeros are skipped to keep the image sparse
+                    with open(path, "rb") as base:
+                        while True:
+                            data = base.read(self._download_chunk_size)
+                            if not data:
+                                break
+                            if data.strip(b"\0"):
+                                image.write(data)
+                            else:
+                                image.seek(len(data), os.SEEK_CUR)
+                    capacity = os.path.getsize(path)
+                    image.truncate(capacity)
+                    expected = None
+                    continue
 
-        self.debug_print("datacenter", datacenter)
-        self.debug_print("vmx_path", vmx_path)
+                if (expected is not None) and (header[VSPHERE_JSON_PREVIOUS_CHANGE_ID] != expected):
+                    raise Exception(
+                        VSPHERE_ERR_DISK_DELTA_CHAIN.format(
+                            vault_id=vault_id, previous=header[VSPHERE_JSON_PREVIOUS_CHANGE_ID], expected=expected
+                        )
+                    )
+
+                if capacity is None:
+                    capacity = header[VSPHERE_JSON_CAPACITY]
+                    image.truncate(capacity)
+                elif header[VSPHERE_JSON_CAPACITY] != capacity:
+                    raise Exception(
+                        VSPHERE_ERR_DISK_DELTA_CAPACITY.format(vault_id=vault_id, capacity=header[VSPHERE_JSON_CAPACITY], expected=capacity)
+                    )
+
+                self.save_progress(VSPHERE_PROG_APPLYING_DISK_DELTA, vault_id=vault_id)
+
+                with open(path, "rb") as delta:
+                    delta.seek(data_offset)
+                    for offset, length in header[VSPHERE_JSON_EXTENTS]:
+                        image.seek(offset)
+                        while length:
+                            data = delta.read(min(self._download_chunk_size, length))
+                            if not data:
+                                raise Exception(VSPHERE_ERR_NOT_DISK_DELTA.format(vault_id=vault_id))
+                            image.write(data)
+                            length -= len(data)
+
+                expected = header[VSPHERE_JSON_CHANGE_ID]
+                last_header = header
+                applied += 1
+
+        return last_header, applied
+
+    def _handle_rebuild_disk_image(self, config, param):
+        """Function that handles ACTION_ID_REBUILD_DISK_IMAGE
 
-        # Get the vm object from the vmx path
-        try:
-            vm = self._vs_server.get_vm_by_path(vmx_path, datacenter)
-        except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
+        Args:
+            config: The config given to the connector
+            param: The parameters of the action
 
-        snap_name = VSPHERE_CONST_SNAPSHOT_NAME_PREFIX + phantom.get_random_chars()
-        snap_desc = VSPHERE_CONST_SNAPSHOT_DESCRIPTION.format(container_id=self.get_container_id())
+        Return:
+            A status code
+        """
 
-        self.save_progress(VSPHERE_PROG_SNAPSHOT_NAME, snap_name=snap_name)
+        action_result = self.add_action_result(ActionResult(dict(param)))
 
-        task = vm.create_snapshot(snap_name, description=snap_desc, memory=True, sync_run=False)
-        status_code = self._wait_for_async_task(task, action, action_result)
+        files = []
+        for vault_id in [x.strip() for x in param[VSPHERE_JSON_VAULT_ID].split(",") if x.strip()]:
+            try:
+                success, _, vault_info = ph_rules.vault_info(vault_id=vault_id)
+                path = vault_info[0]["path"] if (success and vault_info) else None
+            except Exception as e:
+                self.debug_print("Handled exception", e)
+                path = None
 
-        state_not_changed = False
+            if not path or not os.path.exists(path):
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VAULT_FILE.format(vault_id=vault_id))
 
-        if action_result.get_message().find(VSPHERE_VIRTUAL_MACHINE_NOT_CHANGED) != -1:
-            state_not_changed = True
+            files.append((vault_id, path))
 
-        if phantom.is_fail(status_code) and (not state_not_changed):
-            return status_code
-        else:
-            message = VSPHERE_VIRTUAL_MACHINE_NOT_CHANGED if (state_not_changed) else VSPHERE_PROG_SNAPSHOT_TAKEN
+        if not files:
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VAULT_FILE.format(vault_id=param[VSPHERE_JSON_VAULT_ID]))
 
-            self.save_progress(message)
-            action_result.set_status(phantom.APP_SUCCESS, message)
+        temp_dir = mkdtemp(prefix="vsphere-", dir=self._get_vault_tmp_dir())
+        try:
+            try:
+                # named after the vm, disk and change id of the last delta by default
+                file_name = param.get(VSPHERE_JSON_FILE_NAME)
+                if not file_name:
+                    header, _ = self._read_disk_delta_header(files[-1][1])
+                    header = header or {VSPHERE_JSON_CHANGE_ID: files[-1][0]}
+                    file_name = "-".join(str(header.get(x)) for x in (VSPHERE_JSON_GUEST_NAME, VSPHERE_JSON_DEVICE_KEY, VSPHERE_JSON_CHANGE_ID))
+                    file_name += VSPHERE_CONST_DISK_IMAGE_EXTENSION
+                image_path = f"{temp_dir}/{phantom.get_valid_file_name(file_name)}"
+
+                header, applied = self._rebuild_disk_image(image_path, files)
+                header = header or {}
+                file_size = os.path.getsize(image_path)
+                hashers = {VSPHERE_JSON_SHA256: hashlib.sha256()}
+                self._hash_file_range(hashers, None, image_path, 0, file_size)
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_REBUILD_DISK_IMAGE, e)
 
-        # now check if it needs to be downloaded
-        download = bool(param[phantom.APP_JSON_DOWNLOAD]) if (phantom.APP_JSON_DOWNLOAD in param) else True
-        if download:
-            # set the action result to failure
-            self.set_status(phantom.APP_ERROR)
-            id = None
-            if state_not_changed:
-                snap_name, id = self._get_latest_snapshot_info(vm)
-                if not snap_name or not id:
-                    return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_FAILED_TO_GET_SNAPSHOT_INFO)
-                self.debug_print(f"Latest snapshot: {snap_name} with id {id}")
+            file_info = {x: header.get(x) for x in (VSPHERE_JSON_DISK_LABEL, VSPHERE_JSON_DEVICE_KEY, VSPHERE_JSON_CHANGE_ID)}
+            file_info.update({VSPHERE_JSON_SHA256: hashers[VSPHERE_JSON_SHA256].hexdigest(), VSPHERE_JSON_CAPACITY: file_size})
 
-            status_code = self._download_snapshot_file(snap_name, vmx_path, config, vm, action_result, datacenter, id)
+            status_code = self._move_file_to_vault(
+                config[phantom.APP_JSON_SERVER],
+                self.get_container_id(),
+                file_size,
+                VSPHERE_CONST_DISK_IMAGE_FILE_TYPE,
+                image_path,
+                action_result,
+                {VSPHERE_JSON_VMX_PATH: header.get(VSPHERE_JSON_VMX_PATH)},
+                [VSPHERE_CONST_DISK_IMAGE_FILE_TYPE],
+                file_info,
+            )
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
-        return action_result.get_status()
+        if phantom.is_fail(status_code):
+            return action_result.get_status()
+
+        action_result.update_summary({VSPHERE_JSON_DELTAS_APPLIED: applied})
+
+        return action_result.set_status(phantom.APP_SUCCESS)
 
     def _revert_vm(self, action, config, param):
         """"""
@@ -883,7 +5285,7 @@ class VsphereConnector(BaseConnector):
 
         # Get the vm object from the vmx path
         try:
-            vm = self._vs_server.get_vm_by_path(vmx_path, datacenter)
+            vm = self._get_vm_by_path(vmx_path, datacenter)
         except Exception as e:
             return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
 
@@ -923,6 +5325,15 @@ class VsphereConnector(BaseConnector):
         if phantom.is_fail(status_code):
             return status_code
 
+        download = param[phantom.APP_JSON_DOWNLOAD] if (phantom.APP_JSON_DOWNLOAD in param) else False
+
+        vmx_paths = self._get_vmx_paths(param)
+        if len(vmx_paths) > 1:
+            if download:
+                action_result = self.add_action_result(ActionResult(dict(param)))
+                return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_DOWNLOAD_MULTIPLE_VMS)
+            return self._handle_power_guests(action, config, param, vmx_paths)
+
         # create an action_result to represent this item
         action_result = self.add_action_result(ActionResult(dict(param)))
 
@@ -931,7 +5342,7 @@ class VsphereConnector(BaseConnector):
 
         # Get the vm object from the vmx path
         try:
-            vm = self._vs_server.get_vm_by_path(vmx_path, datacenter)
+            vm = self._get_vm_by_path(vmx_path, datacenter)
         except Exception as e:
             return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_VM_FROM_VMX_PATH, e)
 
@@ -951,17 +5362,32 @@ class VsphereConnector(BaseConnector):
             action_result.set_status(phantom.APP_SUCCESS, VSPHERE_SUCC_CANT_EXEC, action=action, state=vm.get_status())
 
         # either the vm was already suspended or we were able to do it now check if it needs to be downloaded
-        download = param[phantom.APP_JSON_DOWNLOAD] if (phantom.APP_JSON_DOWNLOAD in param) else False
         if download:
-            status_code = self._download_suspend_file(vmx_path, config, action_result, vm, container_id, datacenter)
+            status_code = self._download_suspend_file(
+                vmx_path,
+                config,
+                action_result,
+                vm,
+                container_id,
+                datacenter,
+                param.get(VSPHERE_JSON_EXTRACT_MEMORY, False),
+                param.get(VSPHERE_JSON_MEMORY_ONLY, False),
+            )
 
         return action_result.get_status()
 
     def _test_asset_connectivity(self, config, param):
-        if phantom.is_fail(self._connect_to_server(config)):
-            self.debug_print("connect failed")
-            self.save_progress(VSPHERE_ERR_CONNECTIVITY_TEST)
-            return self.append_to_message(VSPHERE_ERR_CONNECTIVITY_TEST)
+        # every server of the asset is logged in to
+        for server in self._servers:
+            connector = self._create_server_connector(None)
+
+            if phantom.is_fail(connector._connect_to_server(dict(config, **{phantom.APP_JSON_SERVER: server}))):
+                self.debug_print("connect failed")
+                self.save_progress(VSPHERE_ERR_CONNECTIVITY_TEST)
+                return self.set_status(phantom.APP_ERROR, f"{connector.get_status_message()}. {VSPHERE_ERR_CONNECTIVITY_TEST}")
+
+            if not self._reuse_session:
+                connector._vs_server.disconnect()
 
         self.debug_print("connect passed")
         self.save_progress(VSPHERE_SUCC_CONNECTIVITY_TEST)
@@ -972,9 +5398,17 @@ class VsphereConnector(BaseConnector):
 
         result = None
         action = self.get_action_identifier()
-        config = self.get_config()
         container_id = self.get_container_id()
 
+        # the inventory actions fan out to the other servers of the asset themselves, the vm actions run on the
+        # server given as parameter, the first server of the asset by default
+        server = (param.get(phantom.APP_JSON_SERVER) or self._servers[0]).strip()
+        if server not in self._servers:
+            action_result = self.add_action_result(ActionResult(dict(param)))
+            return action_result.set_status(phantom.APP_ERROR, VSPHERE_ERR_SERVER_NOT_IN_ASSET, server=server)
+
+        config = dict(self.get_config(), **{phantom.APP_JSON_SERVER: server})
+
         if (action == self.ACTION_ID_GET_REGISTERED_GUESTS) or (action == self.ACTION_ID_GET_RUNNING_GUESTS):
             result = self._get_vms(action, config, param)
         elif action == self.ACTION_ID_START_GUEST:
@@ -989,11 +5423,22 @@ class VsphereConnector(BaseConnector):
             result = self._revert_vm(action, config, param)
         elif action == self.ACTION_ID_GET_SYSTEM_INFO:
             result = self._get_system_info(config, param)
+        elif action == self.ACTION_ID_LIST_SNAPSHOTS:
+            result = self._handle_list_snapshots(config, param)
+        elif action == self.ACTION_ID_PRUNE_SNAPSHOTS:
+            result = self._handle_prune_snapshots(config, param)
+        elif action == self.ACTION_ID_EXPORT_DISK_CHANGES:
+            result = self._handle_export_disk_changes(action, config, param)
+        elif action == self.ACTION_ID_REBUILD_DISK_IMAGE:
+            result = self._handle_rebuild_disk_image(config, param)
+        elif action == self.ACTION_ID_EXPORT_VM_DISKS:
+            result = self._handle_export_vm_disks(action, config, param)
         elif action == phantom.ACTION_ID_TEST_ASSET_CONNECTIVITY:
             result = self._test_asset_connectivity(config, param)
 
-        # clean it up
-        self._vs_server.disconnect()
+        # clean it up, unless the session is kept for the next run
+        if not self._reuse_session:
+            self._vs_server.disconnect()
 
         return result
 
@@ -1010,7 +5455,6 @@ class VsphereConnector(BaseConnector):
 
 
 if __name__ == "__main__":
-    import json
     import sys
 
     import pudb
@@ -18,15 +18,76 @@
 VSPHERE_JSON_VMX_PATH = "vmx_path"
 VSPHERE_JSON_TOTAL_GUESTS = "total_vms"
 VSPHERE_JSON_TOTAL_GUESTS_RUNNING = "running_vms"
+VSPHERE_JSON_FAILED_DATACENTERS = "failed_datacenters"
+VSPHERE_JSON_FAILED_SERVERS = "failed_servers"
 VSPHERE_JSON_GUEST_NAME = "vm_name"
 VSPHERE_JSON_GUEST_FULL_NAME = "vm_full_name"
-VSPHERE_JSON_DISPLAY_NAME = "display_name"
 VSPHERE_JSON_GUEST_HOST_NAME = "vm_hostname"
 VSPHERE_JSON_SNAP_NAME = "snapshot"
 VSPHERE_JSON_IP_HOSTNAME = "ip_hostname"
+VSPHERE_JSON_INDEX_TTL = "index_ttl"
+VSPHERE_JSON_REUSE_SESSION = "reuse_session"
+VSPHERE_JSON_TASK_TIMEOUT = "task_timeout"
+VSPHERE_JSON_DATACENTER_TIMEOUT = "datacenter_timeout"
+VSPHERE_JSON_SHA256 = "sha256"
+VSPHERE_JSON_NAME = "name"
+VSPHERE_JSON_SNAPSHOT_ID = "snapshot_id"
+VSPHERE_JSON_DESCRIPTION = "description"
+VSPHERE_JSON_CREATE_TIME = "create_time"
+VSPHERE_JSON_MEMORY = "memory"
+VSPHERE_JSON_QUIESCED = "quiesced"
+VSPHERE_JSON_SIZE = "size"
+VSPHERE_JSON_NAME_PREFIX = "name_prefix"
+VSPHERE_JSON_OLDER_THAN = "older_than"
+VSPHERE_JSON_CONTAINER_ID = "container_id"
+VSPHERE_JSON_TOTAL_SNAPSHOTS = "total_snapshots"
+VSPHERE_JSON_TOTAL_SIZE = "total_size"
+VSPHERE_JSON_COMPRESSION = "compression"
+VSPHERE_JSON_ORIGINAL_SIZE = "original_size"
+VSPHERE_JSON_COMPRESSED_SIZE = "compressed_size"
+VSPHERE_JSON_DOWNLOAD_BUFFER_SIZE = "download_buffer_size"
+VSPHERE_JSON_DELTA = "delta"
+VSPHERE_JSON_FULL_RESYNC = "full_resync"
+VSPHERE_JSON_CHANGE_TYPE = "change_type"
+VSPHERE_JSON_TASK_DURATION = "task_duration"
+VSPHERE_JSON_TOTAL_VMS_SUCCEEDED = "total_vms_succeeded"
+VSPHERE_JSON_TOTAL_VMS_FAILED = "total_vms_failed"
+VSPHERE_JSON_KEEP_LAST = "keep_last"
+VSPHERE_JSON_DRY_RUN = "dry_run"
+VSPHERE_JSON_SNAPSHOT_KEEP_LAST = "snapshot_keep_last"
+VSPHERE_JSON_SNAPSHOT_MAX_AGE = "snapshot_max_age"
+VSPHERE_JSON_TOTAL_SNAPSHOTS_REMOVED = "total_snapshots_removed"
+VSPHERE_JSON_TOTAL_SNAPSHOTS_FAILED = "total_snapshots_failed"
+VSPHERE_JSON_SPACE_RECLAIMED = "space_reclaimed"
+VSPHERE_JSON_SNAPSHOTS_PRUNED = "snapshots_pruned"
+VSPHERE_JSON_EXTRACT_MEMORY = "extract_memory"
+VSPHERE_JSON_MEMORY_ONLY = "memory_only"
+VSPHERE_JSON_MEMORY_REGIONS = "memory_regions"
+VSPHERE_JSON_ADDRESS = "address"
+VSPHERE_JSON_SOURCE_FILE = "source_file"
+VSPHERE_JSON_DOWNLOAD_FROM_HOST = "download_from_host"
+VSPHERE_JSON_FULL = "full"
+VSPHERE_JSON_KEEP_SNAPSHOT = "keep_snapshot"
+VSPHERE_JSON_DEVICE_KEY = "device_key"
+VSPHERE_JSON_DISK_LABEL = "disk_label"
+VSPHERE_JSON_CAPACITY = "capacity"
+VSPHERE_JSON_CHANGE_ID = "change_id"
+VSPHERE_JSON_PREVIOUS_CHANGE_ID = "previous_change_id"
+VSPHERE_JSON_EXTENTS = "extents"
+VSPHERE_JSON_TOTAL_EXTENTS = "total_extents"
+VSPHERE_JSON_CHANGED_BYTES = "changed_bytes"
+VSPHERE_JSON_TOTAL_DISKS = "total_disks"
+VSPHERE_JSON_TOTAL_CHANGED_BYTES = "total_changed_bytes"
+VSPHERE_JSON_VAULT_ID = "vault_id"
+VSPHERE_JSON_FILE_NAME = "file_name"
+VSPHERE_JSON_DELTAS_APPLIED = "deltas_applied"
 
 # Status messages for vsphere app
 VSPHERE_ERR_SERVER_CONNECT = "Connection to {server_ip} failed"
+VSPHERE_ERR_NO_SERVER = "Please provide at least one server"
+VSPHERE_ERR_SERVER_NOT_IN_ASSET = "The server '{server}' is not one of the servers of the asset"
+VSPHERE_ERR_SERVERS_FAILED = "Failed on all the servers: {servers}"
+VSPHERE_ERR_DELTA_SERVERS = "The delta mode is only supported with a single server"
 VSPHERE_SUCC_CANT_EXEC = "Cannot execute {action} since current state of vm is {state}"
 VSPHERE_ERR_CANNOT_FIND_SNAPSHOT_LIST_FILE = "Cannot find snapshot list file"
 VSPHERE_ERR_SNAPSHOT_PATH = "Cannot find path for snapshot '{}'"
@@ -41,6 +102,59 @@ VSPHERE_ERR_FAILED_TO_GET_SNAPSHOT_INFO = "Failed to get information of latest s
 VSPHERE_ERR_FAILED_TO_REVERT_VM = "Failed to revert vm. Error: {err_msg}"
 VSPHERE_ERR_SERVER_CONNECTION = "Server connection error"
 VSPHERE_ERR_SERVER_RETURNED_STATUS_CODE = "Server returned error code: {code}"
+VSPHERE_ERR_GET_SNAPSHOTS = "Failed to get the snapshots of the vms"
+VSPHERE_ERR_GET_VMS = "Failed to get the vms of datacenter '{datacenter}'"
+VSPHERE_ERR_DATACENTER_TIMEOUT = "Timed out after {timeout} seconds"
+VSPHERE_ERR_SERVER_POOL_TIMEOUT = "Timed out waiting for a server of the pool"
+VSPHERE_ERR_SESSION_EXPIRED = "The session has expired"
+VSPHERE_ERR_GET_VMS_DELTA = "Failed to get the changes of the vms"
+VSPHERE_ERR_TASK_TIMED_OUT = "The task did not finish within {timeout} seconds"
+VSPHERE_ERR_ALL_VMS_FAILED = "The action failed for all the vms"
+VSPHERE_ERR_DOWNLOAD_MULTIPLE_VMS = "Downloading the suspend file is only supported for a single vm"
+VSPHERE_SUCC_VMS_PROCESSED = "The action succeeded for {succeeded} of {total} vms"
+VSPHERE_SUCC_PARTIAL_DATACENTERS = "Got the vms of {succeeded} of {total} datacenters, failed datacenters: {datacenters}"
+VSPHERE_SUCC_PARTIAL_SERVERS = "Got the vms of {succeeded} of {total} servers, failed servers: {servers}"
+VSPHERE_ERR_INCOMPLETE_SEGMENT = "Incomplete download of the bytes {start}-{end}, received {received} bytes"
+VSPHERE_ERR_NO_RETENTION = "Please provide 'keep_last' or 'older_than', or configure a snapshot retention policy in the asset"
+VSPHERE_ERR_ALL_SNAPSHOTS_FAILED = "Failed to remove all the snapshots"
+VSPHERE_SUCC_SNAPSHOTS_REMOVED = "Removed {removed} of {total} snapshots"
+VSPHERE_SUCC_SNAPSHOTS_TO_REMOVE = "Dry run, {total} snapshots would be removed"
+VSPHERE_SUCC_DRY_RUN = "Dry run, the snapshot was not removed"
+VSPHERE_SUCC_MEMORY_NOT_EXTRACTED = "Added {file_name} to the vault, but the memory of the vm could not be extracted from it: {error}"
+VSPHERE_ERR_CBT_DISABLED = "Changed block tracking is not enabled on the vm"
+VSPHERE_ERR_CBT_NOT_ACTIVE = (
+    "Changed block tracking is not active yet on disk '{disk}', it becomes active after the next power cycle or snapshot of the vm"
+)
+VSPHERE_ERR_NO_DISKS = "The vm has no disks to export"
+VSPHERE_ERR_VM_HAS_SNAPSHOTS = (
+    "The vm has snapshots, the changes of its disks can only be exported from a vm without snapshots, please remove them first"
+)
+VSPHERE_ERR_DISK_CHAIN = (
+    "The data of disk '{disk}' is spread over the delta files of earlier snapshots, please remove the other snapshots of the vm first"
+)
+VSPHERE_ERR_DISK_EXTENT_FILE = "Cannot find the extent file of disk '{disk}'"
+VSPHERE_ERR_EXPORT_DISK = "Failed to export the changes of disk '{disk}'"
+VSPHERE_ERR_VAULT_FILE = "Cannot find vault file {vault_id}"
+VSPHERE_ERR_NOT_DISK_DELTA = "Vault file {vault_id} is not a disk delta"
+VSPHERE_ERR_DISK_DELTA_CHAIN = (
+    "Disk delta {vault_id} does not follow the previous file, it holds the changes since {previous} instead of {expected}"
+)
+VSPHERE_ERR_DISK_DELTA_CAPACITY = "Disk delta {vault_id} is of a disk of {capacity} bytes instead of {expected}"
+VSPHERE_ERR_REBUILD_DISK_IMAGE = "Failed to rebuild the disk image"
+VSPHERE_ERR_EXPORT_LEASE = "Failed to export the disks through an export lease"
+VSPHERE_ERR_EXPORT_DISKS = "Failed to export {failed} of {total} disks"
+VSPHERE_ERR_EXTRACT_MEMORY = "Unable to extract the memory of the vm from {file_name}"
+VSPHERE_ERR_NOT_CHECKPOINT_FILE = "Not a VMware checkpoint file"
+VSPHERE_ERR_CHECKPOINT_TRUNCATED = "The checkpoint file is truncated"
+VSPHERE_ERR_NO_MEMORY_IN_CHECKPOINT = "The checkpoint file does not hold the memory of the vm, and no separate .vmem file was found"
+VSPHERE_ERR_INVALID_COMPRESSION = "Please provide one of {values} as the compression"
+VSPHERE_ERR_DOWNLOAD_IN_PROGRESS = "The file is being downloaded by another run of the action"
+VSPHERE_ERR_DOWNLOAD_INTERRUPTED = "Download failed, run the action again to resume it"
+VSPHERE_ERR_INCOMPLETE_DOWNLOAD = "Incomplete download, received {received} of {size} bytes"
+VSPHERE_ERR_SEARCH_INVENTORY = "Failed to search the inventory"
+VSPHERE_ERR_INVALID_INTEGER = "Please provide a valid integer value in the '{key}' parameter"
+VSPHERE_ERR_NEGATIVE_INTEGER = "Please provide a valid non-negative integer value in the '{key}' parameter"
+VSPHERE_ERR_ZERO_INTEGER = "Please provide a non-zero positive integer value in the '{key}' parameter"
 
 # Progress messages format string
 VSPHERE_PROG_SUSPEND_FILE_DOWNLOADING = "Downloading suspend file"
@@ -52,21 +166,287 @@ VSPHERE_PROG_SNAPSHOT_TAKEN = "Created snapshot"
 VSPHERE_PROG_TASK_QUEUED = "Task queued"
 VSPHERE_PROG_TASK_COMPLETED_PERCENT = "Task '{task_name}' {progress}% completed"
 VSPHERE_PROG_TASK_RUNNING = "Task running"
+VSPHERE_PROG_TASKS_COMPLETED = "{finished} of {total} tasks completed"
+VSPHERE_PROG_EXTRACTING_MEMORY = "Extracting the memory of the vm from {file_name}"
+VSPHERE_PROG_DOWNLOADING_FROM_HOST = "Downloading the file from its host {host}"
+VSPHERE_PROG_HOST_NOT_REACHABLE = "Unable to download the file from its host, downloading it through the server"
 VSPHERE_PROG_SNAPSHOT_DOWNLOADING = "Downloading snapshot file for '{snap_name}'"
 VSPHERE_PROG_SNAPSHOT_INFO_DOWNLOADING = "Downloading snapshot information file for '{snap_name}'"
 VSPHERE_PROG_FINISHED_DOWNLOADING_STATUS = "Finished downloading {0:.0%}"
+VSPHERE_PROG_FILE_IN_VAULT = "The file has not changed since it was added to the vault as {vault_id}, skipping the download"
+VSPHERE_PROG_DOWNLOADED_BYTES = "Downloaded {0} bytes"
+VSPHERE_PROG_DOWNLOAD_RESUMING = "Resuming the download of an earlier run"
+VSPHERE_PROG_DOWNLOAD_RETRYING = "Download interrupted ({error}), retrying in {delay} seconds"
+VSPHERE_PROG_QUERYING_CHANGES = "Querying the changed areas of disk '{disk}'"
+VSPHERE_PROG_FULL_DISK_EXPORT = "No earlier export of disk '{disk}', exporting all its allocated areas"
+VSPHERE_PROG_APPLYING_DISK_DELTA = "Applying disk delta {vault_id}"
+VSPHERE_PROG_WAITING_FOR_LEASE = "Waiting for the export lease to be ready"
+VSPHERE_PROG_EXPORTING_DISKS = "Exporting {total} disks"
+VSPHERE_PROG_REUSING_SESSION = "Reusing the session of an earlier run"
+VSPHERE_PROG_FULL_RESYNC = "The changes since the last run are not available anymore, doing a full resync"
+VSPHERE_PROG_BUILDING_INDEX = "Building the ip and hostname index of the inventory"
 
 # Other constants used in the connector
 VSPHERE_CONST_VM_STATE_RUNNING = "running"
 VSPHERE_CONST_VM_STATE_NOT_RUNNING = "not_running"
 VSPHERE_CONST_SNAPSHOT_NAME_PREFIX = "PH_Snapshot_"
-VSPHERE_CONST_SNAPSHOT_DESCRIPTION = "Snapshot taken by Phantom for container {container_id}"
+VSPHERE_CONST_SNAPSHOT_DESCRIPTION_PREFIX = "Snapshot taken by Phantom for container "
+VSPHERE_CONST_SNAPSHOT_DESCRIPTION = VSPHERE_CONST_SNAPSHOT_DESCRIPTION_PREFIX + "{container_id}"
 VSPHERE_CONST_SNAPSHOT_FILE_TYPE = "vm snapshot file"
 VSPHERE_CONST_SUSPEND_FILE_TYPE = "vm suspend file"
+VSPHERE_CONST_DISK_DELTA_FILE_TYPE = "vm disk delta"
+VSPHERE_CONST_DISK_IMAGE_FILE_TYPE = "vm disk image"
+VSPHERE_CONST_DISK_FILE_TYPE = "vm disk"
+VSPHERE_CONST_MEMORY_FILE_TYPE = "vm memory"
 VSPHERE_CONST_DEFAULT_DATACENTER = "ha-datacenter"
 VSPHERE_CONST_URL = "url"
 VSPHERE_CONST_DATACENTER = "dcPath"
 VSPHERE_CONST_DATASTORE = "dsName"
+VSPHERE_CONST_URL_AUTH = "auth"
+VSPHERE_CONST_URL_STREAM_OPTIMIZED = "stream_optimized"
+# the key a url that changes from one run to the next is known by, for its partial file and vault index entry
+VSPHERE_CONST_URL_KEY = "key"
+VSPHERE_CONST_POWERED_ON = "poweredOn"
+
+# vm properties fetched in bulk through the property collector
+VSPHERE_CONST_PROP_NAME = "name"
+VSPHERE_CONST_PROP_IP = "guest.ipAddress"
+VSPHERE_CONST_PROP_HOSTNAME = "guest.hostName"
+VSPHERE_CONST_PROP_FULL_NAME = "config.guestFullName"
+VSPHERE_CONST_PROP_POWER_STATE = "runtime.powerState"
+VSPHERE_CONST_PROP_QUESTION = "runtime.question"
+VSPHERE_CONST_PROP_VMX_PATH = "config.files.vmPathName"
+VSPHERE_CONST_VM_PROPERTIES = [
+    VSPHERE_CONST_PROP_VMX_PATH,
+    VSPHERE_CONST_PROP_NAME,
+    VSPHERE_CONST_PROP_IP,
+    VSPHERE_CONST_PROP_HOSTNAME,
+    VSPHERE_CONST_PROP_FULL_NAME,
+    VSPHERE_CONST_PROP_POWER_STATE,
+    VSPHERE_CONST_PROP_QUESTION,
+]
+# key under which the mor id of the vm is added to its bulk fetched properties
+VSPHERE_CONST_VM_MOR = "mor"
+
+# snapshot tree and extended file layout of a vm, to map the snapshots to their files
+VSPHERE_CONST_PROP_SNAPSHOTS = "snapshot.rootSnapshotList"
+VSPHERE_CONST_PROP_LAYOUT_SNAPSHOTS = "layoutEx.snapshot"
+VSPHERE_CONST_PROP_LAYOUT_FILES = "layoutEx.file"
+VSPHERE_CONST_SNAPSHOT_PROPERTIES = [
+    VSPHERE_CONST_PROP_VMX_PATH,
+    VSPHERE_CONST_PROP_SNAPSHOTS,
+    VSPHERE_CONST_PROP_LAYOUT_SNAPSHOTS,
+    VSPHERE_CONST_PROP_LAYOUT_FILES,
+]
+# the types of the files of the disk chains in the extended file layout of a vm
+VSPHERE_CONST_DISK_FILE_TYPES = ["diskDescriptor", "diskExtent"]
+VSPHERE_CONST_SNAPSHOT_DATA_FILE = "data_file"
+VSPHERE_CONST_SNAPSHOT_MEMORY_FILE = "memory_file"
+VSPHERE_CONST_SNAPSHOT_CREATE_EPOCH = "create_epoch"
+VSPHERE_CONST_SNAPSHOT_DATA_KEYS = [
+    VSPHERE_JSON_NAME,
+    VSPHERE_JSON_SNAPSHOT_ID,
+    VSPHERE_JSON_DESCRIPTION,
+    VSPHERE_JSON_CREATE_TIME,
+    VSPHERE_JSON_MEMORY,
+    VSPHERE_JSON_QUIESCED,
+    VSPHERE_JSON_SIZE,
+]
+VSPHERE_CONST_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# a 'snapshot<index>.<key> = "<value>"' line of the snapshot list (.vmsd) file
+VSPHERE_CONST_VMSD_LINE_PATTERN = r'^\s*snapshot(\d+)\.(\w+)\s*=\s*"(.*)"'
+# the comma between two paths of the vmx_path parameter, each path starts with the [datacenter] or [datastore]
+VSPHERE_CONST_VMX_PATH_SEPARATOR_PATTERN = r",\s*(?=\[)"
+
+# ip/hostname index of the inventory of each server kept in the state file
+VSPHERE_CONST_STATE_INVENTORY_INDEXES = "inventory_indexes"
+VSPHERE_CONST_INDEX_SERVER = "server"
+VSPHERE_CONST_INDEX_TIMESTAMP = "timestamp"
+VSPHERE_CONST_INDEX_TOTAL_VMS = "total_vms"
+VSPHERE_CONST_INDEX_IPS = "ips"
+VSPHERE_CONST_INDEX_HOSTNAMES = "hostnames"
+VSPHERE_CONST_INDEX_FAILED_DATACENTERS = "failed_datacenters"
+VSPHERE_CONST_DEFAULT_INDEX_TTL = 600
+VSPHERE_CONST_INDEX_MIN_REFRESH_INTERVAL = 60
+
+# login session of each server kept in the state file, the cookies are encrypted
+VSPHERE_CONST_STATE_SESSIONS = "sessions"
+VSPHERE_CONST_SESSION_SERVER = "server"
+VSPHERE_CONST_SESSION_USERNAME = "username"
+VSPHERE_CONST_SESSION_COOKIES = "cookies"
+VSPHERE_CONST_SESSION_DATACENTERS = "datacenters"
+VSPHERE_CONST_SESSION_DATACENTERS_TIMESTAMP = "datacenters_timestamp"
+# vmx path to vm mor cache kept in the state file
+VSPHERE_CONST_STATE_VM_CACHE = "vm_cache"
+VSPHERE_CONST_VM_CACHE_VM = "vm"
+VSPHERE_CONST_VM_CACHE_DATACENTER = "datacenter"
+VSPHERE_CONST_VM_CACHE_TIMESTAMP = "timestamp"
+VSPHERE_CONST_VM_CACHE_TTL = 86400
+
+# property collector used by the delta mode of list vms, kept in the state file
+VSPHERE_CONST_STATE_VMS_DELTA = "vms_delta"
+VSPHERE_CONST_DELTA_SERVER = "server"
+VSPHERE_CONST_DELTA_COLLECTOR = "collector"
+VSPHERE_CONST_DELTA_FILTERS = "filters"
+VSPHERE_CONST_DELTA_VIEWS = "views"
+VSPHERE_CONST_DELTA_VERSION = "version"
+VSPHERE_CONST_DELTA_VMS = "vms"
+# single server entries of the state file written by the earlier versions
+VSPHERE_CONST_STATE_OLD_KEYS = ["inventory_index", "session"]
+VSPHERE_CONST_CHANGE_ADDED = "added"
+VSPHERE_CONST_CHANGE_MODIFIED = "modified"
+VSPHERE_CONST_CHANGE_REMOVED = "removed"
+VSPHERE_CONST_CHANGE_UNCHANGED = "unchanged"
+
+# task monitoring
+VSPHERE_CONST_TASK_PROP_STATE = "info.state"
+VSPHERE_CONST_TASK_PROP_PROGRESS = "info.progress"
+VSPHERE_CONST_TASK_PROPERTIES = [VSPHERE_CONST_TASK_PROP_STATE, VSPHERE_CONST_TASK_PROP_PROGRESS]
+# longest a single WaitForUpdatesEx call blocks, so that the deadline is checked regularly
+VSPHERE_CONST_TASK_MAX_WAIT = 30
+VSPHERE_CONST_TASK_POLL_MIN_INTERVAL = 0.25
+VSPHERE_CONST_TASK_POLL_MAX_INTERVAL = 5
+
+# power tasks issued at the same time when acting on several vms
+VSPHERE_CONST_MAX_CONCURRENT_TASKS = 20
+
+# datacenters listed at the same time, each worker leases a server of the pool
+VSPHERE_CONST_INVENTORY_WORKERS = 4
+
+# servers of the asset queried at the same time by the inventory actions
+VSPHERE_CONST_MAX_SERVER_WORKERS = 10
+# seconds to wait for the servers whose inventory is stopped to log out
+VSPHERE_CONST_SERVER_STOP_TIMEOUT = 10
+# the entries of the state file kept per server, the only ones the copies of the connector of the servers write
+VSPHERE_CONST_STATE_SERVER_KEYS = [VSPHERE_CONST_STATE_SESSIONS, VSPHERE_CONST_STATE_INVENTORY_INDEXES]
+
+# servers (SOAP bindings on the session of the run) leased to the worker threads, an idle one is checked before reuse
+VSPHERE_CONST_SERVER_POOL_SIZE = 4
+VSPHERE_CONST_SERVER_POOL_CHECK_INTERVAL = 60
+VSPHERE_CONST_TASK_SUCCEEDED = "success"
+VSPHERE_CONST_TASK_FAILED = "failed"
+VSPHERE_CONST_TASK_SKIPPED = "skipped"
+
+# downloads of the datastore files, big files are fetched in segments by a pool of workers
+VSPHERE_CONST_DOWNLOAD_SEGMENT_SIZE = 64 * 1024 * 1024
+VSPHERE_CONST_DOWNLOAD_WORKERS = 4
+# connections kept alive per host by the http session, enough for the download workers and the SOAP calls
+VSPHERE_CONST_HTTP_POOL_SIZE = 16
+# in KB, the amount of data held in memory by each download stream
+VSPHERE_CONST_DEFAULT_DOWNLOAD_BUFFER_SIZE = 1024
+VSPHERE_CONST_DOWNLOAD_PROGRESS_INTERVAL = 2
+
+# interrupted downloads are retried with an exponential backoff, then resumed by the next run from a checkpoint
+VSPHERE_CONST_DOWNLOAD_DIR = "vsphere-downloads"
+VSPHERE_CONST_DOWNLOAD_RETRIES = 5
+VSPHERE_CONST_DOWNLOAD_RETRY_DELAY = 1
+VSPHERE_CONST_DOWNLOAD_MAX_RETRY_DELAY = 60
+VSPHERE_CONST_DOWNLOAD_CHECKPOINT_INTERVAL = 30
+VSPHERE_CONST_DOWNLOAD_CHECKPOINT_TTL = 86400
+VSPHERE_CONST_CHECKPOINT_URL = "url"
+VSPHERE_CONST_CHECKPOINT_SIZE = "size"
+VSPHERE_CONST_CHECKPOINT_VALIDATOR = "validator"
+VSPHERE_CONST_CHECKPOINT_BYTES = "bytes"
+VSPHERE_CONST_CHECKPOINT_SEGMENTS = "segments"
+
+# datastore files already added to the vault, by datastore path, size and modification time
+VSPHERE_CONST_STATE_VAULT_INDEX = "vault_index"
+VSPHERE_CONST_VAULT_INDEX_VAULT_ID = "vault_id"
+VSPHERE_CONST_VAULT_INDEX_TIMESTAMP = "timestamp"
+VSPHERE_CONST_VAULT_INDEX_TTL = 30 * 86400
+VSPHERE_CONST_VAULT_INDEX_KEY = "vault_index_key"
+VSPHERE_CONST_VAULT_INDEX_DEDUPLICATED = "deduplicated"
+
+# compression of the files added to the vault, zstd needs the zstandard module
+VSPHERE_CONST_COMPRESSION_NONE = "none"
+VSPHERE_CONST_COMPRESSION_GZIP = "gzip"
+VSPHERE_CONST_COMPRESSION_ZSTD = "zstd"
+VSPHERE_CONST_COMPRESSION_EXTENSIONS = {
+    VSPHERE_CONST_COMPRESSION_NONE: "",
+    VSPHERE_CONST_COMPRESSION_GZIP: ".gz",
+    VSPHERE_CONST_COMPRESSION_ZSTD: ".zst",
+}
+VSPHERE_CONST_GZIP_LEVEL = 6
+VSPHERE_CONST_GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+VSPHERE_CONST_ZSTD_LEVEL = 3
+
+# exports of the changed areas of the disks, through changed block tracking (CBT). The change id of each
+# exported disk is kept in the state, by vm mor and device key, as the starting point of the next export
+VSPHERE_CONST_PROP_CBT_ENABLED = "config.changeTrackingEnabled"
+VSPHERE_CONST_PROP_CURRENT_SNAPSHOT = "snapshot.currentSnapshot"
+VSPHERE_CONST_PROP_SNAPSHOT_DEVICES = "config.hardware.device"
+VSPHERE_CONST_CBT_PROPERTIES = [
+    VSPHERE_CONST_PROP_VMX_PATH,
+    VSPHERE_CONST_PROP_NAME,
+    VSPHERE_CONST_PROP_CURRENT_SNAPSHOT,
+    VSPHERE_CONST_PROP_LAYOUT_SNAPSHOTS,
+    VSPHERE_CONST_PROP_LAYOUT_FILES,
+]
+VSPHERE_CONST_VIRTUAL_DISK = "VirtualDisk"
+VSPHERE_CONST_DISK_EXTENT = "diskExtent"
+VSPHERE_CONST_CBT_ALL_AREAS = "*"
+VSPHERE_CONST_STATE_CHANGE_IDS = "change_ids"
+
+# a disk delta file is the magic, the length of the json header (8 bytes, big endian), the header and,
+# from the next aligned offset, the data of the extents of the header, one after the other
+VSPHERE_CONST_DISK_DELTA_MAGIC = b"VSPHDLT1"
+VSPHERE_CONST_DISK_DELTA_ALIGNMENT = 4096
+VSPHERE_CONST_DISK_DELTA_EXTENSION = ".delta"
+VSPHERE_CONST_DISK_IMAGE_EXTENSION = ".img"
+VSPHERE_CONST_DISK_DELTA_KEYS = [
+    VSPHERE_JSON_DISK_LABEL,
+    VSPHERE_JSON_DEVICE_KEY,
+    VSPHERE_JSON_CAPACITY,
+    VSPHERE_JSON_CHANGE_ID,
+    VSPHERE_JSON_PREVIOUS_CHANGE_ID,
+    VSPHERE_JSON_TOTAL_EXTENTS,
+    VSPHERE_JSON_CHANGED_BYTES,
+]
+
+# exports of the disks of a snapshot through an export (NFC) lease, which the server aborts if its progress
+# is not updated within its timeout
+VSPHERE_CONST_PROP_LEASE_STATE = "state"
+VSPHERE_CONST_PROP_LEASE_INFO = "info"
+VSPHERE_CONST_PROP_LEASE_ERROR = "error"
+VSPHERE_CONST_LEASE_PROPERTIES = [VSPHERE_CONST_PROP_LEASE_STATE, VSPHERE_CONST_PROP_LEASE_INFO, VSPHERE_CONST_PROP_LEASE_ERROR]
+VSPHERE_CONST_LEASE_READY = "ready"
+VSPHERE_CONST_LEASE_ERROR = "error"
+VSPHERE_CONST_LEASE_KEEPALIVE_INTERVAL = 60
+VSPHERE_CONST_EXPORT_WORKERS = 4
+
+# a checkpoint (.vmss/.vmsn) file is a header, a table of groups and, for each group, a list of tags that ends
+# with an empty one. The memory of the vm is the data of the Memory tag of the memory group, its regions map
+# the pages of the data to physical pages
+VSPHERE_CONST_CHECKPOINT_MAGICS = [0xBED2BED0, 0xBAD1BAD1, 0xBED2BED2, 0xBED3BED3]
+VSPHERE_CONST_CHECKPOINT_HEADER_FORMAT = "<III"
+VSPHERE_CONST_CHECKPOINT_GROUP_FORMAT = "<64sQQ"
+VSPHERE_CONST_CHECKPOINT_BIG_TAG_SIZES = [62, 63]
+VSPHERE_CONST_CHECKPOINT_MEMORY_GROUP = "memory"
+VSPHERE_CONST_CHECKPOINT_MEMORY_TAG = "Memory"
+VSPHERE_CONST_CHECKPOINT_REGIONS_COUNT_TAG = "regionsCount"
+VSPHERE_CONST_CHECKPOINT_REGION_PPN_TAG = "regionPPN"
+VSPHERE_CONST_CHECKPOINT_REGION_PAGE_NUM_TAG = "regionPageNum"
+VSPHERE_CONST_CHECKPOINT_REGION_SIZE_TAG = "regionSize"
+VSPHERE_CONST_MEMORY_PAGE_SIZE = 4096
+VSPHERE_CONST_MEMORY_EXTENSION = ".raw"
+VSPHERE_CONST_VMEM_EXTENSION = ".vmem"
+VSPHERE_CONST_MEMORY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# the files of a vm are downloaded from the host that mounts its datastore, rather than through vCenter,
+# with a service ticket of the vCenter session for each request
+VSPHERE_CONST_API_TYPE_VCENTER = "VirtualCenter"
+VSPHERE_CONST_PROP_RUNTIME_HOST = "runtime.host"
+VSPHERE_CONST_PROP_DATASTORES = "datastore"
+VSPHERE_CONST_PROP_DATASTORE_HOSTS = "host"
+VSPHERE_CONST_PROP_CONNECTION_STATE = "runtime.connectionState"
+VSPHERE_CONST_HOST_CONNECTED = "connected"
+VSPHERE_CONST_HOST_DATACENTER = "ha-datacenter"
+VSPHERE_CONST_HTTP_GET = "httpGet"
+VSPHERE_CONST_SERVICE_TICKET_COOKIE = "vmware_cgi_ticket"
+VSPHERE_CONST_URL_FALLBACK = "fallback"
+
+# same user agent pysphere impersonates on login
+VSPHERE_CONST_USER_AGENT = "VMware VI Client/5.0.0"
 
 # This text is compared with an error that we get from the vsphere server, don't change
 # If you need to change this, then change this value to a list and add the newer string to it.
@@ -74,3 +454,11 @@ VSPHERE_CONST_DATASTORE = "dsName"
 VSPHERE_VIRTUAL_MACHINE_NOT_CHANGED = (
     "Snapshot not taken since the state of the virtual machine has not changed since the last snapshot operation"
 )
+
+# the RetrievePropertiesEx responses of the bulk vm fetches are decoded without the ZSI object graph
+VSPHERE_CONST_SOAP_ACTION = "urn:vim25/6.7"
+VSPHERE_CONST_SOAP_ENV_NS = "http://schemas.xmlsoap.org/soap/envelope/"
+VSPHERE_CONST_VIM_NS = "urn:vim25"
+VSPHERE_CONST_XSD_NS = "http://www.w3.org/2001/XMLSchema"
+VSPHERE_CONST_XSI_TYPE = "{http://www.w3.org/2001/XMLSchema-instance}type"
+VSPHERE_CONST_MOR_TYPE = "ManagedObjectReference"